@@ -0,0 +1,463 @@
+"""Endpoint benchmark suite.
+
+Builds the app with create_app against a database seeded by the synthetic
+data generator, drives every GET route plus the write scenarios of the
+purchase path (cart, checkout, order creation, order status, flash sale
+admission) through the Flask test client and records p50/p95 latency, query
+count and response size per route. Scenarios needing a fresh cart or order
+prepare it before each timed request and undo their changes afterwards.
+Write routes without a scenario are listed in UNMEASURED_ROUTES with the
+reason, a route in neither is reported as not measured.
+
+    # record a baseline
+    $ python -m benchmarks.endpoints --scale small --output baseline.json
+
+    # compare against it, exits with 1 on regressions
+    $ python -m benchmarks.endpoints --scale small --compare baseline.json
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+from datetime import datetime
+from itertools import cycle
+
+os.environ["APP_SETTINGS"] = "project.config.BenchmarkConfig"
+
+from project import create_app, db  # noqa: E402
+from project.api.cart_store import cart_store  # noqa: E402
+from project.api.data_generator import DataGenerator  # noqa: E402
+from project.api.shopping import persist_cart  # noqa: E402
+from project.models import (  # noqa: E402
+    User, Sku, Prize, Campaign, Order, Banners, CartItem
+)
+
+SCALES = {
+    "tiny": {"users": 100, "skus": 10, "campaigns": 5, "orders": 200, "carts": 20},
+    "small": {"users": 1000, "skus": 50, "campaigns": 10, "orders": 2000, "carts": 100},
+    "medium": {"users": 10000, "skus": 500, "campaigns": 100, "orders": 20000, "carts": 1000},
+    "large": {"users": 100000, "skus": 5000, "campaigns": 1000, "orders": 200000, "carts": 10000},
+}
+
+PASSWORD = "greaterthaneight"
+
+# users taking turns in the checkout, order and admission scenarios
+POOL_SIZE = 50
+
+# orders moved at once by the bulk status scenario
+BULK_STATUS_ORDERS = 10
+
+# routes which change state on GET or cannot run under the test client
+SKIPPED_ENDPOINTS = {
+    "static",
+    "auth.logout",
+    "auth.google_login_token",
+    "campaign.get_campaign_status",
+}
+
+# write routes without a scenario, and why
+UNMEASURED_ROUTES = {
+    "DELETE /admin/sql_stats": "resets the statistics of the app",
+    "POST /admin/users/import": "bulk import, measured with manage.py import-users",
+    "POST /banner/register": "catalogue administration",
+    "PATCH /banner/update/<int:banner_id>": "catalogue administration",
+    "DELETE /banner/delete/<int:banner_id>": "deletes a fixture of the GET routes",
+    "POST /campaign/register": "catalogue administration",
+    "PATCH /campaign/update/<int:campaign_id>": "catalogue administration",
+    "PUT /campaign/update/<int:campaign_id>": "catalogue administration",
+    "DELETE /campaign/delete/<int:campaign_id>": "deletes a fixture of the GET routes",
+    "PATCH /order/update/<int:order_id>": "changes the fixture order of the GET routes",
+    "DELETE /order/delete/<int:order_id>": "deletes a fixture of the GET routes",
+    "POST /prize/register": "catalogue administration",
+    "PATCH /prize/update/<int:prize_id>": "catalogue administration",
+    "PUT /prize/update/<int:prize_id>": "catalogue administration",
+    "DELETE /prize/delete/<int:prize_id>": "deletes a fixture of the GET routes",
+    "POST /prize/redeem-coupon": "a coupon is redeemed once",
+    "POST /sku/register": "catalogue administration",
+    "PATCH /sku/update/<int:sku_id>": "catalogue administration",
+    "DELETE /sku/delete/<int:sku_id>": "deletes a fixture of the GET routes",
+    "POST /upload/image": "uploads to ImageKit",
+    "POST /users/upload": "uploads to ImageKit",
+    "POST /users/auth/register": "dominated by the bcrypt cost, see project/passwords.py",
+    "POST /users/auth/verify": "sends a sign-in code",
+    "POST /users/auth/google_token": "calls Google",
+    "PATCH /users/update_info": "profile edit, not on the purchase path",
+    "PATCH /users/update_location": "profile edit, not on the purchase path",
+    "PUT /users/update_location": "profile edit, not on the purchase path",
+}
+
+# known N+1s, their query count grows with the user's rows: every coupon or
+# order item serializes its campaign, sku, images and stock one by one
+KNOWN_N_PLUS_ONE = {
+    "GET /order/get_coupon": "Coupon.to_json per coupon",
+    "GET /order/get/<int:order_id>": "Order_Sku.to_json per item",
+    "GET /users/home/mobile": "Campaign.to_json per campaign",
+}
+
+
+def seed_database(app, scale: str, seed: int):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        DataGenerator(seed=seed).generate(**SCALES[scale])
+
+
+def load_fixtures(app) -> dict:
+    """Pick existing ids and auth headers to fill in route arguments"""
+    with app.app_context():
+        admin = User.query.filter_by(is_admin=True).first()
+        order = Order.query.filter(Order.user_id != admin.id).first()
+        user = User.query.get(order.user_id)
+        banner = Banners.query.first()
+        cart_item = CartItem.query.first()
+        campaign = Campaign.query.filter_by(is_active=True).first() \
+            or Campaign.query.first()
+
+        # a second campaign sold through a waiting room of one, so that
+        # every other user joining it is queued
+        flash_sale = Campaign.query.filter(Campaign.id != campaign.id).first()
+        flash_sale.admission_limit = 1
+        db.session.commit()
+
+        pool = User.query.filter(User.id.notin_([admin.id, user.id])).order_by(
+            User.id).limit(POOL_SIZE).all()
+
+        def headers(user):
+            token = user.encode_auth_token(user.id)
+            if isinstance(token, bytes):
+                token = token.decode()
+
+            return {"Authorization": "Bearer {}".format(token)}
+
+        return {
+            "admin_headers": headers(admin),
+            "user_headers": headers(user),
+            "username": user.email,
+            "pool": [(pool_user.id, headers(pool_user)) for pool_user in pool],
+            "campaign": campaign.id,
+            "flash_sale": flash_sale.id,
+            "sku_stock_id": campaign.sku.sku_stock[0].id,
+            "sku_images_id": campaign.sku.sku_images[0].id,
+            "args": {
+                "user_id": user.id,
+                "sku_id": Sku.query.first().id,
+                "prize_id": Prize.query.first().id,
+                "campaign_id": campaign.id,
+                "order_id": order.id,
+                "banner_id": banner.id if banner else 1,
+                "cart_item_id": cart_item.id if cart_item else 1,
+            }
+        }
+
+
+def route_names(app) -> list:
+    """"METHOD rule" of every route of the app"""
+    return sorted("{} {}".format(method, rule.rule)
+                  for rule in app.url_map.iter_rules()
+                  for method in rule.methods - {"HEAD", "OPTIONS"})
+
+
+def get_routes(app, fixtures: dict, scenarios: list) -> list:
+    """Build a (name, request kwargs) pair for every GET route without a
+    scenario"""
+    routes = []
+    scenario_names = {scenario[0] for scenario in scenarios}
+
+    for rule in sorted(app.url_map.iter_rules(), key=lambda rule: rule.rule):
+        if rule.endpoint in SKIPPED_ENDPOINTS or "GET" not in rule.methods:
+            continue
+
+        if "GET {}".format(rule.rule) in scenario_names:
+            continue
+
+        path = rule.rule
+        for argument in rule.arguments:
+            path = path.replace("<int:{}>".format(argument),
+                                str(fixtures["args"].get(argument, 1)))
+
+        routes.append(("GET {}".format(rule.rule), {
+            "method": "GET",
+            "path": path,
+            "headers": fixtures["user_headers"]
+        }))
+
+    return routes
+
+
+def get_scenarios(app, fixtures: dict) -> list:
+    """(name, request, cleanup, prepare) write scenarios. prepare, if set,
+    builds the request before each run, cleanup undoes what a run changed"""
+    add_to_cart = {
+        "campaign_id": fixtures["campaign"],
+        "sku_stock_id": fixtures["sku_stock_id"],
+        "sku_images_id": fixtures["sku_images_id"],
+        "quantity": 1
+    }
+    pool = cycle(fixtures["pool"])
+    moved = []
+
+    def remove_cart_item(client, response):
+        if response.json and response.json.get("id"):
+            client.delete("/shopping/remove_from_cart/{}".format(response.json["id"]),
+                          headers=fixtures["admin_headers"])
+
+    def clear_cart(client, response):
+        with app.app_context():
+            cart_store().clear(fixtures["args"]["user_id"])
+
+    def fill_cart(user_id):
+        cart_store().add_item(user_id, add_to_cart["campaign_id"],
+                              add_to_cart["sku_stock_id"],
+                              add_to_cart["sku_images_id"], 1)
+
+    def checkout(client):
+        user_id, headers = next(pool)
+        with app.app_context():
+            fill_cart(user_id)
+
+        return {"method": "POST", "path": "/shopping/checkout",
+                "json": {"shipping_fee": 0.0}, "headers": headers}
+
+    def create_order(client):
+        # a cart checked out without its order
+        user_id, headers = next(pool)
+        with app.app_context():
+            fill_cart(user_id)
+            persist_cart(user_id, cart_store().items(user_id)).checkedout_at = \
+                datetime.utcnow()
+            db.session.commit()
+            cart_store().clear(user_id)
+
+        return {"method": "POST", "path": "/order/create",
+                "json": {"shipping_fee": 0.0}, "headers": headers}
+
+    def pending_orders(count: int) -> list:
+        with app.app_context():
+            return [order_id for (order_id,) in db.session.query(Order.id).filter(
+                Order.status == "pending").order_by(Order.id).limit(count)]
+
+    def order_status(client):
+        moved[:] = pending_orders(1)
+        return {"method": "PUT", "path": "/order/status/{}".format(moved[0]),
+                "json": {"status": "paid"}, "headers": fixtures["admin_headers"]}
+
+    def bulk_order_status(client):
+        moved[:] = pending_orders(BULK_STATUS_ORDERS)
+        return {"method": "PUT", "path": "/order/status",
+                "json": {"order_ids": list(moved), "status": "paid"},
+                "headers": fixtures["admin_headers"]}
+
+    def reset_orders(client, response):
+        with app.app_context():
+            db.session.execute(Order.__table__.update().where(
+                Order.id.in_(moved)).values(status="pending"))
+            db.session.commit()
+
+    def join_waiting_room(client):
+        _, headers = next(pool)
+        return {"method": "POST",
+                "path": "/shopping/admission/{}".format(fixtures["flash_sale"]),
+                "headers": headers}
+
+    def poll_waiting_room(client):
+        response = client.open(**join_waiting_room(client))
+        token = (response.json.get("admission") or {}).get("token", "")
+        return {"method": "GET", "path": "/shopping/admission/poll?token={}".format(token)}
+
+    def update_cart(client):
+        with app.app_context():
+            fill_cart(fixtures["args"]["user_id"])
+
+        return {"method": "PUT",
+                "path": "/shopping/update_cart/{}".format(add_to_cart["sku_stock_id"]),
+                "json": {"quantity": 2}, "headers": fixtures["user_headers"]}
+
+    def remove_from_cart(client):
+        request = update_cart(client)
+        return {"method": "DELETE",
+                "path": "/shopping/remove_from_cart/{}".format(add_to_cart["sku_stock_id"]),
+                "headers": request["headers"]}
+
+    return [
+        ("POST /users/auth/login", {
+            "method": "POST",
+            "path": "/users/auth/login",
+            "json": {"username": fixtures["username"], "password": PASSWORD}
+        }, None, None),
+        ("POST /shopping/add_to_cart", {
+            "method": "POST",
+            "path": "/shopping/add_to_cart",
+            "json": add_to_cart,
+            "headers": fixtures["admin_headers"]
+        }, remove_cart_item, None),
+        ("POST /shopping/add_to_cart/batch", {
+            "method": "POST",
+            "path": "/shopping/add_to_cart/batch",
+            "json": {"items": [add_to_cart], "all_or_nothing": True},
+            "headers": fixtures["user_headers"]
+        }, clear_cart, None),
+        ("POST /shopping/checkout", None, None, checkout),
+        ("POST /order/create", None, None, create_order),
+        ("PUT /order/status/<int:order_id>", None, reset_orders, order_status),
+        ("PUT /order/status", None, reset_orders, bulk_order_status),
+        ("POST /shopping/admission/<int:campaign_id>", None, None, join_waiting_room),
+        ("GET /shopping/admission/poll", None, None, poll_waiting_room),
+        ("PUT /shopping/update_cart/<int:sku_stock_id>", None, clear_cart, update_cart),
+        ("DELETE /shopping/remove_from_cart/<int:sku_stock_id>", None, clear_cart,
+         remove_from_cart),
+    ]
+
+
+def percentile(samples: list, fraction: float) -> float:
+    samples = sorted(samples)
+    return samples[int(fraction * (len(samples) - 1))]
+
+
+def measure(client, request: dict, iterations: int, warmup: int, cleanup=None,
+            prepare=None) -> dict:
+    timings, queries, size, status = [], [], 0, None
+
+    for iteration in range(warmup + iterations):
+        if prepare:
+            request = prepare(client)
+
+        started = time.perf_counter()
+        response = client.open(request["path"], method=request["method"],
+                               json=request.get("json"),
+                               headers=request.get("headers"))
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        if cleanup:
+            cleanup(client, response)
+
+        if iteration < warmup:
+            continue
+
+        timings.append(elapsed_ms)
+        queries.append(int(response.headers.get("X-Query-Count", 0)))
+        size = len(response.data)
+        status = response.status_code
+
+    return {
+        "status": status,
+        "p50_ms": round(percentile(timings, 0.5), 3),
+        "p95_ms": round(percentile(timings, 0.95), 3),
+        "queries": max(queries),
+        "bytes": size
+    }
+
+
+def report(name: str, result: dict):
+    print("{:<55} {p50_ms:>9.2f} {p95_ms:>9.2f} {queries:>7} {bytes:>9} {status}{}".format(
+        name, " N+1" if name in KNOWN_N_PLUS_ONE else "", **result))
+
+
+def run(app, iterations: int, warmup: int) -> dict:
+    fixtures = load_fixtures(app)
+    client = app.test_client()
+    results = {}
+
+    scenarios = get_scenarios(app, fixtures)
+    for name, request in get_routes(app, fixtures, scenarios):
+        results[name] = measure(client, request, iterations, warmup)
+        report(name, results[name])
+
+    for name, request, cleanup, prepare in scenarios:
+        assert name not in results, "Route {} is measured twice".format(name)
+        results[name] = measure(client, request, iterations, warmup, cleanup, prepare)
+        report(name, results[name])
+
+    skipped = {"GET {}".format(rule.rule) for rule in app.url_map.iter_rules()
+               if rule.endpoint in SKIPPED_ENDPOINTS}
+    for name in route_names(app):
+        if name not in results and name not in skipped and name not in UNMEASURED_ROUTES:
+            print("NOT MEASURED {}".format(name))
+
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Return the routes slower or issuing more queries than the baseline"""
+    regressions = []
+
+    for name, result in results.items():
+        base = baseline["routes"].get(name)
+        if not base:
+            continue
+
+        if result["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append("{}: p95 {:.2f}ms -> {:.2f}ms".format(
+                name, base["p95_ms"], result["p95_ms"]))
+
+        if result["queries"] > base["queries"]:
+            regressions.append("{}: queries {} -> {}".format(
+                name, base["queries"], result["queries"]))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--scale", choices=SCALES.keys(), default="small")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--reuse-db", action="store_true",
+                        help="Skip seeding and reuse the existing database.")
+    parser.add_argument("--output", help="Write results as a JSON baseline.")
+    parser.add_argument("--compare", help="Baseline JSON to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed p95 slowdown relative to the baseline.")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Keep application logging, including N+1 warnings.")
+    args = parser.parse_args()
+
+    app = create_app()
+
+    # create_app configures logging, quiet it afterwards
+    if not args.verbose:
+        logging.getLogger("project").setLevel(logging.ERROR)
+
+    if not args.reuse_db:
+        print("Seeding {} database...".format(args.scale))
+        seed_database(app, args.scale, args.seed)
+
+    print("{:<55} {:>9} {:>9} {:>7} {:>9} status".format(
+        "route", "p50_ms", "p95_ms", "queries", "bytes"))
+    results = run(app, args.iterations, args.warmup)
+
+    report = {
+        "meta": {
+            "scale": args.scale,
+            "seed": args.seed,
+            "iterations": args.iterations,
+            "database": app.config["SQLALCHEMY_DATABASE_URI"].split(":")[0],
+            "python": platform.python_version(),
+            "known_n_plus_one": sorted(KNOWN_N_PLUS_ONE),
+        },
+        "routes": results
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION {}".format(regression))
+
+        if regressions:
+            sys.exit(1)
+
+        print("No regressions against {}".format(args.compare))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
+import click
+from flask import current_app
 from flask.cli import FlaskGroup
+from flask_migrate import stamp
 
 from project import create_app, db
+from project.api.sql_stats import load_snapshot
 from project.models.user_model import User, Location
 
 app = create_app()
@@ -14,14 +18,16 @@ def recreate_db():
     db.drop_all()
     db.create_all()
     db.session.commit()
+    stamp()
 
 
 @cli.command()
 def create_db():
-    """Creates a local database."""
+    """Creates a local database, at the latest migration."""
     print("Creating database...")
     db.create_all()
     db.session.commit()
+    stamp()
 
 
 @cli.command()
@@ -72,5 +78,175 @@ def seed_db():
     print("Database seeded!")
 
 
+@cli.command()
+@click.option("--users", default=1000, help="Number of users.")
+@click.option("--skus", default=100, help="Number of skus, each with 1-6 variants.")
+@click.option("--campaigns", default=20, help="Number of campaigns.")
+@click.option("--orders", default=5000, help="Number of orders, each with 1-3 coupons.")
+@click.option("--carts", default=0, help="Number of filled carts, kept in CART_STORE_URL.")
+@click.option("--seed", default=42, help="Random seed.")
+@click.option("--batch-size", default=5000, help="Rows inserted per transaction.")
+def generate_data(users, skus, campaigns, orders, carts, seed, batch_size):
+    """Generates a synthetic data set for load and benchmark databases."""
+    from project.api.data_generator import DataGenerator
+
+    print("Generating data...")
+    DataGenerator(seed=seed, batch_size=batch_size).generate(
+        users=users, skus=skus, campaigns=campaigns, orders=orders, carts=carts)
+    print("Data generated!")
+
+
+@cli.command()
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(["csv", "ndjson"]),
+              help="File format, taken from the extension if not given.")
+@click.option("--batch-size", type=int, help="Users inserted per transaction.")
+def import_users(path, fmt, batch_size):
+    """Imports users from a CSV or NDJSON file."""
+    from project.api.user_import import import_users
+
+    fmt = fmt or path.rsplit(".", 1)[-1].lower()
+
+    print("Importing users...")
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        result = import_users(f, fmt, batch_size)
+
+    for error in result["errors"]:
+        print("line {line}: {message}".format(**error))
+    print("Imported {imported} user(s), rejected {rejected}".format(**result))
+
+
+@cli.command()
+@click.option("--limit", default=20, help="Number of statements to report.")
+@click.option("--sort", default="total_ms",
+              type=click.Choice(["calls", "total_ms", "mean_ms", "p95_ms", "max_ms"]))
+@click.option("--explain/--no-explain", default=False, help="Print captured query plans.")
+def sql_report(limit, sort, explain):
+    """Reports the statement statistics dumped by every process to SQL_STATS_PATH."""
+    path = current_app.config.get("SQL_STATS_PATH")
+    if not path:
+        print("SQL_STATS_PATH is not configured")
+        return
+
+    snapshot = load_snapshot(path, limit=limit, sort=sort)
+    if snapshot is None:
+        print("No statistics dumped to {}".format(path))
+        return
+
+    print("{:>8} {:>12} {:>10} {:>10} {:>10}  statement".format(
+        "calls", "total_ms", "mean_ms", "p95_ms", "max_ms"))
+    for item in snapshot["statements"]:
+        print("{calls:>8} {total_ms:>12.1f} {mean_ms:>10.2f} {p95_ms:>10.2f} {max_ms:>10.2f}  {statement}".format(**item))
+
+        if explain and item.get("explain"):
+            for row in item["explain"]:
+                print("{:>55}{}".format("", " | ".join(row)))
+
+    print()
+    print("{:>8} {:>12} {:>10} {:>10} {:>10}  endpoint".format(
+        "calls", "total_ms", "mean_ms", "p95_ms", "max_ms"))
+    for item in snapshot["endpoints"]:
+        print("{calls:>8} {total_ms:>12.1f} {mean_ms:>10.2f} {p95_ms:>10.2f} {max_ms:>10.2f}  {endpoint}".format(**item))
+
+
+@cli.command()
+@click.option("--retention-days", type=int, help="Archive rows older than this many days.")
+@click.option("--batch-size", type=int, help="Rows moved per transaction.")
+def archive_data(retention_days, batch_size):
+    """Moves finished orders, coupons and inactive carts to archive tables."""
+    from project.api.archive import archive_data
+
+    print("Archiving data...")
+    archived = archive_data(retention_days, batch_size)
+    print("Archived {orders} order(s) and {carts} cart(s)".format(**archived))
+
+
+@cli.command()
+@click.option("--batch-size", default=500, help="Carts moved per transaction.")
+def migrate_carts(batch_size):
+    """Moves the carts being filled to CART_STORE_URL and releases their stock."""
+    from project.api.cart_store import move_carts_to_store
+
+    print("Moving carts...")
+    moved = move_carts_to_store(batch_size)
+    print("Moved {} cart(s)".format(moved))
+
+
+@cli.command()
+def refresh_campaigns():
+    """Reconciles the state of every campaign and draw with sku counters."""
+    from project.api.utils import refresh_campaigns
+
+    print("Refreshing campaigns...")
+    refresh_campaigns()
+    print("Campaigns refreshed!")
+
+
+@cli.command()
+@click.option("--repair", is_flag=True, help="Set drifting sku counters to their expected value.")
+@click.option("--batch-size", type=int, help="Skus repaired per transaction.")
+def reconcile_inventory(repair, batch_size):
+    """Reports sku counters that drifted from orders and carts."""
+    from project.api.inventory import reconcile_inventory
+
+    print("Reconciling inventory...")
+    result = reconcile_inventory(repair, batch_size)
+
+    print("{:>8}  {:<18} {:>10} {:>10}".format("sku", "counter", "stored", "expected"))
+    for row in result["drift"]:
+        for name, value in row.items():
+            if name in ("sku_id", "in_flight"):
+                continue
+            print("{:>8}  {:<18} {:>10} {:>10}{}".format(
+                row["sku_id"], name, value["stored"], value["expected"],
+                "  (in flight)" if row["in_flight"] else ""))
+
+    print("{} drifting sku(s), {} counter(s) repaired".format(
+        len(result["drift"]), result["repaired"]))
+
+
+@cli.command()
+@click.option("--job", "jobs", multiple=True,
+              help="Only run the given job(s), no timers or outbox events.")
+@click.option("--once", is_flag=True, help="Run due jobs once and exit.")
+def worker(jobs, once):
+    """Runs the background jobs on their intervals."""
+    from project.api.worker import Worker
+
+    try:
+        worker = Worker(jobs=list(jobs))
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--job")
+
+    if once:
+        ran = worker.run_once()
+        if worker.dispatch:
+            print("Fired {} timer(s)".format(ran["timers"]))
+            print("Dispatched {} event(s)".format(ran["events"]))
+        print("Ran {} job(s)".format(ran["jobs"]))
+        return
+
+    try:
+        worker.run_forever()
+    except KeyboardInterrupt:
+        print("Worker stopped")
+
+
+@cli.command()
+def jobs():
+    """Reports the lease, last run and backlog of the background jobs."""
+    from project.api.worker import job_status
+
+    print("{:<20} {:>6} {:>10} {:>8}  {:<20} {:<28} error".format(
+        "job", "runs", "duration", "backlog", "last finished", "owner"))
+    for job in job_status():
+        print("{:<20} {:>6} {:>10} {:>8}  {:<20} {:<28} {}".format(
+            job["name"], job["runs"],
+            "{:.3f}s".format(job["last_duration"]) if job["last_duration"] is not None else "-",
+            job["backlog"] if job["backlog"] is not None else "-",
+            (job["last_finished_at"] or "-")[:19], job["owner"] or "-",
+            job["last_error"] or ""))
+
+
 if __name__ == "__main__":
     cli()
@@ -0,0 +1,25 @@
+"""user email lower index
+
+Revision ID: 1139aee8b49d
+Revises: 593b135fa3b3
+Create Date: 2026-10-19 15:09:27.800672
+
+The user import checks its emails against lower(email).
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1139aee8b49d'
+down_revision = '593b135fa3b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_user_email_lower', 'user', [sa.text('lower(email)')], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_user_email_lower', table_name='user')
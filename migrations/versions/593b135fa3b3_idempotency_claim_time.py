@@ -0,0 +1,31 @@
+"""idempotency claim time
+
+Revision ID: 593b135fa3b3
+Revises: b50d0dc978e4
+Create Date: 2026-10-19 15:04:37.826452
+
+A claim still processing after IDEMPOTENCY_PROCESSING_TIMEOUT_SECONDS is
+taken over by a retry, claimed_at is when the current claim started. Existing
+rows were claimed when they were created.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '593b135fa3b3'
+down_revision = 'b50d0dc978e4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('idempotency_key', sa.Column('claimed_at', sa.DateTime(), nullable=True))
+    op.execute("UPDATE idempotency_key SET claimed_at = created_at")
+    with op.batch_alter_table('idempotency_key') as batch_op:
+        batch_op.alter_column('claimed_at', existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('idempotency_key') as batch_op:
+        batch_op.drop_column('claimed_at')
@@ -0,0 +1,256 @@
+"""worker, ledger and archive tables
+
+Revision ID: 81ec5fd1015c
+Revises:
+Create Date: 2026-10-19 14:49:42.684308
+
+Brings a database created by create-db before the migrations existed up to
+date: the worker, timer, outbox, idempotency, inventory ledger, coupon
+sequence, ticket index and archive tables, the new campaign, draw and
+sku_stock columns and the new indexes. Pending campaign and draw dates get
+their timers.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '81ec5fd1015c'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('coupon_sequence',
+    sa.Column('name', sa.String(length=32), nullable=False),
+    sa.Column('next_value', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.create_table('inventory_entry',
+    sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), autoincrement=True, nullable=False),
+    sa.Column('sku_stock_id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('ref_id', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_inventory_entry_created_at'), 'inventory_entry', ['created_at'], unique=False)
+    op.create_index('ix_inventory_entry_sku_stock_id_id', 'inventory_entry', ['sku_stock_id', 'id'], unique=False)
+    op.create_table('job_lock',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('owner', sa.String(length=128), nullable=True),
+    sa.Column('locked_until', sa.DateTime(), nullable=True),
+    sa.Column('last_started_at', sa.DateTime(), nullable=True),
+    sa.Column('last_finished_at', sa.DateTime(), nullable=True),
+    sa.Column('last_duration', sa.Float(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('backlog', sa.Integer(), nullable=True),
+    sa.Column('runs', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.create_table('outbox_event',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('event_type', sa.String(length=64), nullable=False),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('available_at', sa.DateTime(), nullable=False),
+    sa.Column('processed_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_outbox_event_status_available_at', 'outbox_event', ['status', 'available_at'], unique=False)
+    op.create_table('scheduled_task',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('kind', sa.String(length=32), nullable=False),
+    sa.Column('ref_id', sa.Integer(), nullable=False),
+    sa.Column('run_at', sa.DateTime(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('kind', 'ref_id', name='uq_scheduled_task_kind_ref_id')
+    )
+    op.create_index(op.f('ix_scheduled_task_run_at'), 'scheduled_task', ['run_at'], unique=False)
+    op.create_table('idempotency_key',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('key', sa.String(length=128), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('request_hash', sa.String(length=64), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('response_status', sa.Integer(), nullable=True),
+    sa.Column('response_body', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'key', name='uq_idempotency_key_user_id_key')
+    )
+    op.create_index(op.f('ix_idempotency_key_expires_at'), 'idempotency_key', ['expires_at'], unique=False)
+    op.create_table('shopping_cart_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('is_active', sa.Boolean(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('checkedout_at', sa.DateTime(), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('order_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('total_quantity', sa.Integer(), nullable=False),
+    sa.Column('total_tax', sa.Float(), nullable=False),
+    sa.Column('shipping_fee', sa.Float(), nullable=False),
+    sa.Column('total_amount', sa.Float(), nullable=False),
+    sa.Column('booking_date', sa.DateTime(), nullable=False),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('location_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['location_id'], ['location.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_order_archive_user_id'), 'order_archive', ['user_id'], unique=False)
+    op.create_table('cart_item_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('cart_id', sa.Integer(), nullable=False),
+    sa.Column('campaign_id', sa.Integer(), nullable=False),
+    sa.Column('sku_stock_id', sa.Integer(), nullable=False),
+    sa.Column('sku_images_id', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('reservation_date', sa.DateTime(), nullable=False),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['campaign_id'], ['campaign.id'], ),
+    sa.ForeignKeyConstraint(['cart_id'], ['shopping_cart_archive.id'], ),
+    sa.ForeignKeyConstraint(['sku_images_id'], ['sku_images.id'], ),
+    sa.ForeignKeyConstraint(['sku_stock_id'], ['sku_stock.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_cart_item_archive_cart_id'), 'cart_item_archive', ['cart_id'], unique=False)
+    op.create_table('coupon_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('campaign_id', sa.Integer(), nullable=False),
+    sa.Column('sku_images_id', sa.Integer(), nullable=False),
+    sa.Column('sku_stock_id', sa.Integer(), nullable=False),
+    sa.Column('code', sa.String(length=128), nullable=False),
+    sa.Column('create_date', sa.DateTime(), nullable=False),
+    sa.Column('amount_paid', sa.Float(), nullable=False),
+    sa.Column('is_redeemed', sa.Boolean(), nullable=False),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['campaign_id'], ['campaign.id'], ),
+    sa.ForeignKeyConstraint(['sku_images_id'], ['sku_images.id'], ),
+    sa.ForeignKeyConstraint(['sku_stock_id'], ['sku_stock.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('code')
+    )
+    op.create_index(op.f('ix_coupon_archive_user_id'), 'coupon_archive', ['user_id'], unique=False)
+    op.create_table('ticket_index',
+    sa.Column('campaign_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('tickets', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['campaign_id'], ['campaign.id'], ),
+    sa.PrimaryKeyConstraint('campaign_id')
+    )
+    op.create_table('ticket_range',
+    sa.Column('campaign_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('user_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('ticket_count', sa.Integer(), nullable=False),
+    sa.Column('ticket_end', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['campaign_id'], ['campaign.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('campaign_id', 'user_id')
+    )
+    op.create_index('ix_ticket_range_campaign_id_ticket_end', 'ticket_range', ['campaign_id', 'ticket_end'], unique=False)
+    op.create_table('order_sku_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('sales_tax', sa.Float(), nullable=False),
+    sa.Column('total_price', sa.Float(), nullable=False),
+    sa.Column('order_id', sa.Integer(), nullable=False),
+    sa.Column('coupon_id', sa.Integer(), nullable=True),
+    sa.Column('campaign_id', sa.Integer(), nullable=False),
+    sa.Column('sku_stock_id', sa.Integer(), nullable=False),
+    sa.Column('sku_images_id', sa.Integer(), nullable=False),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['campaign_id'], ['campaign.id'], ),
+    sa.ForeignKeyConstraint(['coupon_id'], ['coupon_archive.id'], ),
+    sa.ForeignKeyConstraint(['order_id'], ['order_archive.id'], ),
+    sa.ForeignKeyConstraint(['sku_images_id'], ['sku_images.id'], ),
+    sa.ForeignKeyConstraint(['sku_stock_id'], ['sku_stock.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_order_sku_archive_order_id'), 'order_sku_archive', ['order_id'], unique=False)
+    with op.batch_alter_table('campaign') as batch_op:
+        batch_op.add_column(sa.Column('cart_hold_minutes', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('admission_limit', sa.Integer(), nullable=True))
+    op.create_index(op.f('ix_cart_item_reservation_date'), 'cart_item', ['reservation_date'], unique=False)
+    op.create_index(op.f('ix_coupon_campaign_id'), 'coupon', ['campaign_id'], unique=False)
+    with op.batch_alter_table('draw') as batch_op:
+        batch_op.add_column(sa.Column('winner_coupon_id', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_draw_campaign_id'), ['campaign_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_draw_winner_coupon_id'), ['winner_coupon_id'], unique=False)
+    # coupons are assigned when the order_created event is processed
+    with op.batch_alter_table('order_sku') as batch_op:
+        batch_op.alter_column('coupon_id', existing_type=sa.Integer(), nullable=True)
+    # the ledger starts empty, stock is the whole stock level
+    with op.batch_alter_table('sku_stock') as batch_op:
+        batch_op.add_column(sa.Column('ledger_id', sa.BigInteger(), nullable=False,
+                                      server_default='0'))
+
+    # timers of pending transitions, see project/api/timers.py
+    op.execute(
+        "INSERT INTO scheduled_task (kind, ref_id, run_at, attempts) "
+        "SELECT 'campaign_start', id, start_date, 0 FROM campaign "
+        "WHERE start_date IS NOT NULL AND is_active = 0")
+    op.execute(
+        "INSERT INTO scheduled_task (kind, ref_id, run_at, attempts) "
+        "SELECT 'campaign_end', id, end_date, 0 FROM campaign "
+        "WHERE end_date IS NOT NULL")
+    op.execute(
+        "INSERT INTO scheduled_task (kind, ref_id, run_at, attempts) "
+        "SELECT 'draw_end', id, end_date, 0 FROM draw "
+        "WHERE end_date IS NOT NULL AND winner_id IS NULL")
+
+def downgrade():
+    with op.batch_alter_table('sku_stock') as batch_op:
+        batch_op.drop_column('ledger_id')
+    with op.batch_alter_table('order_sku') as batch_op:
+        batch_op.alter_column('coupon_id', existing_type=sa.Integer(), nullable=False)
+    with op.batch_alter_table('draw') as batch_op:
+        batch_op.drop_index(batch_op.f('ix_draw_winner_coupon_id'))
+        batch_op.drop_index(batch_op.f('ix_draw_campaign_id'))
+        batch_op.drop_column('winner_coupon_id')
+    op.drop_index(op.f('ix_coupon_campaign_id'), table_name='coupon')
+    op.drop_index(op.f('ix_cart_item_reservation_date'), table_name='cart_item')
+    with op.batch_alter_table('campaign') as batch_op:
+        batch_op.drop_column('admission_limit')
+        batch_op.drop_column('cart_hold_minutes')
+    op.drop_index(op.f('ix_order_sku_archive_order_id'), table_name='order_sku_archive')
+    op.drop_table('order_sku_archive')
+    op.drop_index('ix_ticket_range_campaign_id_ticket_end', table_name='ticket_range')
+    op.drop_table('ticket_range')
+    op.drop_table('ticket_index')
+    op.drop_index(op.f('ix_coupon_archive_user_id'), table_name='coupon_archive')
+    op.drop_table('coupon_archive')
+    op.drop_index(op.f('ix_cart_item_archive_cart_id'), table_name='cart_item_archive')
+    op.drop_table('cart_item_archive')
+    op.drop_index(op.f('ix_order_archive_user_id'), table_name='order_archive')
+    op.drop_table('order_archive')
+    op.drop_table('shopping_cart_archive')
+    op.drop_index(op.f('ix_idempotency_key_expires_at'), table_name='idempotency_key')
+    op.drop_table('idempotency_key')
+    op.drop_index(op.f('ix_scheduled_task_run_at'), table_name='scheduled_task')
+    op.drop_table('scheduled_task')
+    op.drop_index('ix_outbox_event_status_available_at', table_name='outbox_event')
+    op.drop_table('outbox_event')
+    op.drop_table('job_lock')
+    op.drop_index('ix_inventory_entry_sku_stock_id_id', table_name='inventory_entry')
+    op.drop_index(op.f('ix_inventory_entry_created_at'), table_name='inventory_entry')
+    op.drop_table('inventory_entry')
+    op.drop_table('coupon_sequence')
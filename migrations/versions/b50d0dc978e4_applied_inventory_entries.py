@@ -0,0 +1,55 @@
+"""applied inventory entries
+
+Revision ID: b50d0dc978e4
+Revises: 81ec5fd1015c
+Create Date: 2026-10-19 14:52:25.172926
+
+Sku_Stock.ledger_id, the last entry folded into the stock snapshot, is
+replaced by a flag per entry: an entry committed after a later one was
+compacted is no longer skipped.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b50d0dc978e4'
+down_revision = '81ec5fd1015c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('inventory_entry') as batch_op:
+        batch_op.add_column(sa.Column('applied', sa.Boolean(), nullable=False,
+                                      server_default=sa.false()))
+        batch_op.drop_index('ix_inventory_entry_sku_stock_id_id')
+        batch_op.create_index('ix_inventory_entry_applied_id', ['applied', 'id'], unique=False)
+        batch_op.create_index('ix_inventory_entry_sku_stock_id_applied_id',
+                              ['sku_stock_id', 'applied', 'id'], unique=False)
+
+    op.execute(
+        "UPDATE inventory_entry SET applied = 1 WHERE id <= "
+        "(SELECT ledger_id FROM sku_stock WHERE sku_stock.id = inventory_entry.sku_stock_id)")
+
+    with op.batch_alter_table('sku_stock') as batch_op:
+        batch_op.drop_column('ledger_id')
+
+
+def downgrade():
+    with op.batch_alter_table('sku_stock') as batch_op:
+        batch_op.add_column(sa.Column('ledger_id', sa.BigInteger(), nullable=False,
+                                      server_default='0'))
+
+    # fold the whole ledger, the snapshots are then as of its last entry
+    op.execute(
+        "UPDATE sku_stock SET stock = stock + (SELECT COALESCE(SUM(quantity), 0) "
+        "FROM inventory_entry WHERE inventory_entry.sku_stock_id = sku_stock.id "
+        "AND applied = 0), ledger_id = (SELECT COALESCE(MAX(id), 0) "
+        "FROM inventory_entry WHERE inventory_entry.sku_stock_id = sku_stock.id)")
+
+    with op.batch_alter_table('inventory_entry') as batch_op:
+        batch_op.drop_index('ix_inventory_entry_sku_stock_id_applied_id')
+        batch_op.drop_index('ix_inventory_entry_applied_id')
+        batch_op.create_index('ix_inventory_entry_sku_stock_id_id', ['sku_stock_id', 'id'], unique=False)
+        batch_op.drop_column('applied')
@@ -14,10 +14,19 @@ from project.exceptions import handle_exception
 # get credentials from .env file
 load_dotenv()
 
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Leave expression indexes, e.g. lower(email), out of autogenerate: they
+    are not reflected and would be added again by every revision"""
+    if type_ == "index" and not reflected:
+        return all(isinstance(expression, db.Column) for expression in object.expressions)
+    return True
+
+
 # instantiate the extensions
 db = SQLAlchemy()
 toolbar = DebugToolbarExtension()
-migrate = Migrate()
+migrate = Migrate(include_object=include_object)
 bcrypt = Bcrypt()
 crontab = Crontab()
 
@@ -41,6 +50,17 @@ def create_app(script_info=None):
     bcrypt.init_app(app)
     crontab.init_app(app)
 
+    from project.passwords import init_passwords
+    init_passwords(app)
+    from project.api.coupon_codes import init_coupon_codes
+    init_coupon_codes(app)
+    from project.api.cart_store import init_cart_store
+    init_cart_store(app)
+    from project.api.query_budget import init_query_budget
+    init_query_budget(app)
+    from project.api.sql_stats import init_sql_stats
+    init_sql_stats(app)
+
     @app.after_request
     def after_request(response):
         response.headers.add(
@@ -70,6 +90,8 @@ def create_app(script_info=None):
     app.register_blueprint(banner_blueprint)
     from project.api import upload_blueprint
     app.register_blueprint(upload_blueprint)
+    from project.api import admin_blueprint
+    app.register_blueprint(admin_blueprint)
 
     @app.errorhandler(Exception)
     def manage_exception(ex):
@@ -83,11 +105,3 @@ def create_app(script_info=None):
     app.shell_context_processor({'app': app, 'db': db})
 
     return app
-
-# run the cron job every second
-# @crontab.job(minute='*')
-# def lucky_draw_cron():
-#     from project.api import lucky_draw, refresh_campaigns
-
-#     refresh_campaigns()
-#     lucky_draw()
@@ -7,4 +7,6 @@ from .prize import prize_blueprint
 from .order import order_blueprint
 from .banner import banner_blueprint
 from .upload import upload_blueprint
-from .utils import refresh_campaigns, lucky_draw
+from .admin import admin_blueprint
+from .utils import refresh_campaigns, refresh_touched_campaigns, lucky_draw
+from .timers import schedule_timer, cancel_timer, fire_due_timers
@@ -0,0 +1,154 @@
+import io
+
+from flask import Blueprint, jsonify, request
+
+from project import db
+from project.api.authentications import authenticate
+from project.api.inventory import stock_history
+from project.api.sql_stats import statement_stats
+from project.api.user_import import import_users as run_user_import
+from project.api.worker import job_status
+
+from project.exceptions import APIError
+from project.models import User, Sku_Stock
+
+admin_blueprint = Blueprint('admin', __name__, template_folder='templates')
+
+
+@admin_blueprint.route('/admin/ping', methods=['GET'])
+def ping_pong():
+    return jsonify({
+        'status': True,
+        'message': 'pong V0.1!'
+    })
+
+
+@admin_blueprint.route('/admin/sql_stats', methods=['GET', 'DELETE'])
+@authenticate
+def sql_stats(user_id):
+    """Get or reset SQL statement statistics"""
+    response_object = {
+        'status': False,
+        'message': "You don't have permission to view sql statistics"
+    }
+
+    user = User.query.get(user_id)
+    if not user or not user.is_admin:
+        return jsonify(response_object), 200
+
+    if request.method == 'DELETE':
+        statement_stats.reset()
+
+        response_object['status'] = True
+        response_object['message'] = 'Sql statistics reset successfully'
+        return jsonify(response_object), 200
+
+    limit = request.args.get('limit', type=int)
+    sort = request.args.get('sort', 'total_ms')
+    if sort not in ('calls', 'total_ms', 'mean_ms', 'p95_ms', 'max_ms'):
+        sort = 'total_ms'
+
+    response_object['status'] = True
+    response_object['message'] = 'Sql statistics retrieved successfully'
+    response_object['data'] = statement_stats.snapshot(limit=limit, sort=sort)
+
+    return jsonify(response_object), 200
+
+
+@admin_blueprint.route('/admin/jobs', methods=['GET'])
+@authenticate
+def jobs(user_id):
+    """Get the lease, last run and backlog of the background jobs"""
+    response_object = {
+        'status': False,
+        'message': "You don't have permission to view jobs"
+    }
+
+    user = User.query.get(user_id)
+    if not user or not user.is_admin:
+        return jsonify(response_object), 200
+
+    response_object['status'] = True
+    response_object['message'] = 'Jobs retrieved successfully'
+    response_object['data'] = {
+        'jobs': job_status()
+    }
+
+    return jsonify(response_object), 200
+
+
+@admin_blueprint.route('/admin/inventory/<int:sku_stock_id>', methods=['GET'])
+@authenticate
+def inventory(user_id, sku_stock_id):
+    """Get the current stock and latest ledger entries of a sku stock"""
+    response_object = {
+        'status': False,
+        'message': "You don't have permission to view inventory"
+    }
+
+    user = User.query.get(user_id)
+    if not user or not user.is_admin:
+        return jsonify(response_object), 200
+
+    sku_stock = Sku_Stock.query.options(db.undefer(Sku_Stock.stock_level)).get(sku_stock_id)
+    if not sku_stock:
+        response_object['message'] = 'Stock does not exist'
+        return jsonify(response_object), 200
+
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+
+    response_object['status'] = True
+    response_object['message'] = 'Inventory retrieved successfully'
+    response_object['data'] = {
+        'sku_stock': sku_stock.to_json(),
+        'snapshot': {
+            'stock': sku_stock.stock,
+            'unapplied': sku_stock.stock_level - sku_stock.stock
+        },
+        'entries': [entry.to_json() for entry in stock_history(
+            sku_stock_id, limit=limit)]
+    }
+
+    return jsonify(response_object), 200
+
+
+@admin_blueprint.route('/admin/users/import', methods=['POST'])
+@authenticate
+def import_users(user_id):
+    """Import users from a CSV or NDJSON file, uploaded as the file field or
+    sent as the request body"""
+    response_object = {
+        'status': False,
+        'message': "You don't have permission to import users"
+    }
+
+    user = User.query.get(user_id)
+    if not user or not user.is_admin:
+        return jsonify(response_object), 200
+
+    upload = request.files.get('file')
+    if upload:
+        stream = upload.stream
+        filename = upload.filename or ''
+    else:
+        stream = request.stream
+        filename = ''
+
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else None
+    fmt = request.args.get('format') or extension or (
+        'csv' if 'csv' in (request.content_type or '') else 'ndjson')
+
+    try:
+        text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+        result = run_user_import(text, fmt, request.args.get('batch_size', type=int))
+
+    except (APIError, UnicodeDecodeError) as e:
+        response_object['message'] = str(e)
+        return jsonify(response_object), 200
+
+    response_object['status'] = True
+    response_object['message'] = '{imported} user(s) imported, {rejected} rejected'.format(
+        **result)
+    response_object['data'] = result
+
+    return jsonify(response_object), 200
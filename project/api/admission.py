@@ -0,0 +1,270 @@
+"""Flash sale admission control.
+
+A campaign with admission_limit set is sold through a waiting room: at most
+admission_limit users may fill a cart and check out at once, the others get
+a queue position and a polling token and are admitted in arrival order. The
+state lives in the key-value backend of project/api/cart_store.py, so every
+request worker sees the same room:
+
+- room:<campaign_id>:limit is the admission_limit of the campaign,
+- room:<campaign_id>:tail counts the tickets handed out,
+- room:<campaign_id>:released counts the tickets that left the room,
+- room:<campaign_id>:active counts the admitted users,
+- room:<campaign_id>:queue holds user_id -> {ticket, joined_at} of waiting
+  users, written once per ticket,
+- room:<campaign_id>:polls holds user_id -> last poll of waiting users,
+- room:<campaign_id>:admitted holds user_id -> admission expiry.
+
+Tickets are admitted in arrival order: ticket t may be admitted once
+t <= released + limit. Every ticket leaves exactly once, by checking out, by
+its admission expiring after ADMISSION_TTL_SECONDS or by not polling for
+ADMISSION_POLL_TIMEOUT_SECONDS while queued, and the HDEL removing it
+decides who increments released. Queued tickets leaving move the frontier
+without freeing a slot, so a ticket is only admitted if incrementing active
+keeps it within the limit, and only admitted users leaving decrement it: the
+number of admitted users never exceeds the limit without any lock. The
+waiting_rooms job removes the expired and abandoned tickets.
+
+The polling token is signed with SECRET_KEY and names the campaign, user and
+ticket, polling with it touches neither the database nor the auth token
+checks. Admitted users pay one HGET per cart request.
+"""
+import json
+import time
+import logging
+
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeSerializer
+
+from project import db
+from project.api.cart_store import kv_backend
+from project.models import Campaign
+
+logger = logging.getLogger(__name__)
+
+
+def _serializer() -> URLSafeSerializer:
+    return URLSafeSerializer(current_app.config.get("SECRET_KEY"), salt="admission")
+
+
+class WaitingRoom:
+    """Admission state of a flash sale campaign"""
+
+    def __init__(self, backend, campaign_id: int):
+        self.backend = backend
+        self.campaign_id = campaign_id
+
+        prefix = "room:{}".format(int(campaign_id))
+        self.limit_key = prefix + ":limit"
+        self.tail_key = prefix + ":tail"
+        self.released_key = prefix + ":released"
+        self.active_key = prefix + ":active"
+        self.queue_key = prefix + ":queue"
+        self.polls_key = prefix + ":polls"
+        self.admitted_key = prefix + ":admitted"
+
+    def open(self, limit: int):
+        self.backend.set(self.limit_key, str(limit))
+
+    def _frontier(self):
+        """Highest ticket that may be admitted, None if the room is not open"""
+        limit = self.backend.get(self.limit_key)
+        if limit is None:
+            return None
+
+        return int(self.backend.get(self.released_key) or 0) + int(limit)
+
+    def _release(self, key: str, user_id) -> bool:
+        """Remove a ticket, the caller removing it moves the frontier and
+        frees the slot of an admitted user"""
+        if not self.backend.hdel(key, str(user_id)):
+            return False
+
+        if key == self.admitted_key:
+            self.backend.decr(self.active_key)
+        self.backend.incr(self.released_key)
+        return True
+
+    def _admission(self, user_id, now: float):
+        """Remaining seconds of a user's admission, None if not admitted"""
+        expires = self.backend.hget(self.admitted_key, str(user_id))
+        if not expires:
+            return None
+
+        if float(expires) > now:
+            return int(float(expires) - now)
+
+        # admission ran out, the user has to queue again
+        self._release(self.admitted_key, user_id)
+        return None
+
+    def _queued(self, user_id):
+        entry = self.backend.hget(self.queue_key, str(user_id))
+        return json.loads(entry)["ticket"] if entry else None
+
+    def _join(self, user_id, now: float) -> int:
+        """Queued ticket of a user, taking one if needed"""
+        ticket = self._queued(user_id)
+        if ticket is not None:
+            return ticket
+
+        ticket = self.backend.incr(self.tail_key)
+        if self.backend.hsetnx(self.queue_key, str(user_id), json.dumps(
+                {"ticket": ticket, "joined_at": now})):
+            return ticket
+
+        # a concurrent request of the user queued first, the ticket taken
+        # here is never used and leaves at once
+        self.backend.incr(self.released_key)
+        return self._queued(user_id)
+
+    def _take_slot(self) -> bool:
+        """Count an admission unless the room is full"""
+        limit = int(self.backend.get(self.limit_key) or 0)
+        if self.backend.incr(self.active_key) <= limit:
+            return True
+
+        self.backend.decr(self.active_key)
+        return False
+
+    def _poll(self, user_id, ticket: int, now: float) -> dict:
+        """Admit a queued ticket once its turn has come"""
+        frontier = self._frontier()
+        if frontier is None:
+            return {"admitted": False, "message": "Waiting room is closed"}
+
+        if ticket <= frontier and self._take_slot():
+            if not self.backend.hdel(self.queue_key, str(user_id)):
+                self.backend.decr(self.active_key)
+                return {"admitted": False, "message": "Ticket expired, please join again"}
+
+            self.backend.hdel(self.polls_key, str(user_id))
+            ttl = current_app.config.get("ADMISSION_TTL_SECONDS")
+            self.backend.hset(self.admitted_key, str(user_id), str(now + ttl))
+            return {"admitted": True, "expires_in": ttl}
+
+        self.backend.hset(self.polls_key, str(user_id), str(now))
+
+        return {
+            "admitted": False,
+            "position": max(ticket - frontier, 1),
+            "token": _serializer().dumps([self.campaign_id, int(user_id), ticket]),
+            "retry_after": current_app.config.get("ADMISSION_POLL_SECONDS")
+        }
+
+    def is_admitted(self, user_id) -> bool:
+        expires = self.backend.hget(self.admitted_key, str(user_id))
+        return bool(expires) and float(expires) > time.time()
+
+    def join(self, user_id) -> dict:
+        """Queue status of a user, joining the queue if needed"""
+        now = time.time()
+
+        expires_in = self._admission(user_id, now)
+        if expires_in is not None:
+            return {"admitted": True, "expires_in": expires_in}
+
+        return self._poll(user_id, self._join(user_id, now), now)
+
+    def poll(self, user_id, ticket: int) -> dict:
+        """Queue status of the ticket of a polling token"""
+        now = time.time()
+
+        expires_in = self._admission(user_id, now)
+        if expires_in is not None:
+            return {"admitted": True, "expires_in": expires_in}
+
+        if self._queued(user_id) != ticket:
+            return {"admitted": False, "message": "Ticket expired, please join again"}
+
+        return self._poll(user_id, ticket, now)
+
+    def leave(self, user_id) -> bool:
+        """Free the slot of an admitted user"""
+        return self._release(self.admitted_key, user_id)
+
+    def sweep(self) -> int:
+        """Remove expired admissions and abandoned queue tickets, returns
+        the number of tickets removed"""
+        now = time.time()
+        abandoned = now - current_app.config.get("ADMISSION_POLL_TIMEOUT_SECONDS")
+
+        removed = 0
+        for user_id, expires in self.backend.hgetall(self.admitted_key).items():
+            if float(expires) <= now and self._release(self.admitted_key, user_id):
+                removed += 1
+
+        polls = self.backend.hgetall(self.polls_key)
+        for user_id, entry in self.backend.hgetall(self.queue_key).items():
+            polled_at = float(polls.get(user_id) or json.loads(entry)["joined_at"])
+            if polled_at > abandoned:
+                continue
+
+            if self._release(self.queue_key, user_id):
+                removed += 1
+            self.backend.hdel(self.polls_key, user_id)
+
+        return removed
+
+
+def waiting_rooms(campaign_ids) -> list:
+    """(waiting room, admission limit) of the flash sale campaigns among the
+    given ones"""
+    campaign_ids = list(campaign_ids)
+    if not campaign_ids:
+        return []
+
+    backend = kv_backend()
+    return [(WaitingRoom(backend, campaign_id), limit) for campaign_id, limit in
+            db.session.query(Campaign.id, Campaign.admission_limit).filter(
+                Campaign.id.in_(campaign_ids),
+                Campaign.admission_limit != None).order_by(Campaign.id)]
+
+
+def poll_token(token: str) -> dict:
+    """Queue status of a polling token, None if the token is invalid"""
+    try:
+        campaign_id, user_id, ticket = _serializer().loads(token)
+    except (BadSignature, TypeError, ValueError):
+        return None
+
+    status = WaitingRoom(kv_backend(), campaign_id).poll(user_id, ticket)
+    status["campaign_id"] = campaign_id
+    return status
+
+
+def admission_required(user_id, campaign_ids) -> dict:
+    """Queue status of the first flash sale campaign the user is not
+    admitted to, None if the user may buy from all of them"""
+    for room, limit in waiting_rooms(campaign_ids):
+        if room.is_admitted(user_id):
+            continue
+
+        room.open(limit)
+        status = room.join(user_id)
+        if not status["admitted"]:
+            status["campaign_id"] = room.campaign_id
+            return status
+
+    return None
+
+
+def leave_waiting_rooms(user_id, campaign_ids):
+    """Free the slots of a user who checked out"""
+    for room, _ in waiting_rooms(campaign_ids):
+        room.leave(user_id)
+
+
+def sweep_waiting_rooms() -> int:
+    """Remove expired and abandoned tickets of active flash sales"""
+    campaign_ids = [campaign_id for (campaign_id,) in db.session.query(
+        Campaign.id).filter(Campaign.admission_limit != None,
+                            Campaign.is_active == True)]
+
+    removed = sum(room.sweep() for room, _ in waiting_rooms(campaign_ids))
+    db.session.commit()
+
+    if removed:
+        logger.info("Removed {} waiting room ticket(s)".format(removed))
+
+    return removed
@@ -0,0 +1,146 @@
+"""Archive tier for orders, coupons and inactive carts.
+
+Delivered/cancelled orders older than ARCHIVE_RETENTION_DAYS whose campaigns
+are closed and drawn are moved, together with their order skus and coupons,
+to the *_archive tables. Inactive carts checked out before the retention
+window are moved with their items. Rows are moved in batches with
+INSERT ... SELECT followed by DELETE, one commit per batch.
+"""
+import logging
+from datetime import datetime, timedelta
+
+from flask import current_app, request
+from sqlalchemy import func, literal, or_, select
+
+from project import db
+from project.api.leases import job_heartbeat
+from project.models import (
+    Campaign,
+    CartItem,
+    CartItemArchive,
+    Coupon,
+    CouponArchive,
+    Draw,
+    Order,
+    OrderArchive,
+    Order_Sku,
+    Order_SkuArchive,
+    ShoppingCart,
+    ShoppingCartArchive
+)
+
+logger = logging.getLogger(__name__)
+
+ARCHIVED_ORDER_STATUSES = ['delivered', 'cancelled']
+
+
+def include_archived() -> bool:
+    """Whether the current request asked to read from the archive too"""
+    return request.args.get('include_archived', '').lower() in ('1', 'true', 'yes')
+
+
+def _copy(source, target, condition, archived_at):
+    """Copy rows matching condition from source table to target table"""
+    columns = [column.name for column in source.__table__.columns]
+
+    db.session.execute(target.__table__.insert().from_select(
+        columns + ['archived_at'],
+        select(*[source.__table__.c[name] for name in columns],
+               literal(archived_at, db.DateTime)).where(condition)
+    ))
+
+
+def _delete(source, condition):
+    db.session.execute(source.__table__.delete().where(condition))
+
+
+def archive_orders(cutoff: datetime, batch_size: int) -> int:
+    """Archive finished orders of closed campaigns booked before cutoff"""
+    open_campaign_items = db.session.query(Order_Sku.id).join(
+        Campaign, Campaign.id == Order_Sku.campaign_id).outerjoin(
+        Draw, Draw.campaign_id == Campaign.id).filter(
+        Order_Sku.order_id == Order.id,
+        or_(Campaign.is_active == True,
+            Campaign.end_date == None,
+            Campaign.end_date >= cutoff,
+            Draw.winner_id == None))
+
+    archived = 0
+    while True:
+        order_ids = [order_id for (order_id,) in db.session.query(Order.id).filter(
+            Order.status.in_(ARCHIVED_ORDER_STATUSES),
+            Order.booking_date < cutoff,
+            ~open_campaign_items.exists()
+        ).order_by(Order.id).limit(batch_size)]
+
+        if not order_ids:
+            break
+
+        coupon_ids = [coupon_id for (coupon_id,) in db.session.query(
+            Order_Sku.coupon_id).filter(Order_Sku.order_id.in_(order_ids))]
+
+        archived_at = datetime.utcnow()
+        _copy(Order, OrderArchive, Order.id.in_(order_ids), archived_at)
+        _copy(Coupon, CouponArchive, Coupon.id.in_(coupon_ids), archived_at)
+        _copy(Order_Sku, Order_SkuArchive,
+              Order_Sku.order_id.in_(order_ids), archived_at)
+
+        _delete(Order_Sku, Order_Sku.order_id.in_(order_ids))
+        _delete(Coupon, Coupon.id.in_(coupon_ids))
+        _delete(Order, Order.id.in_(order_ids))
+        db.session.commit()
+
+        archived += len(order_ids)
+        logger.info("Archived {} order(s) and {} coupon(s)".format(
+            len(order_ids), len(coupon_ids)))
+        job_heartbeat()
+
+    return archived
+
+
+def archive_carts(cutoff: datetime, batch_size: int) -> int:
+    """Archive inactive carts checked out before cutoff"""
+    archived = 0
+    while True:
+        cart_ids = [cart_id for (cart_id,) in db.session.query(ShoppingCart.id).filter(
+            ShoppingCart.is_active == False,
+            func.coalesce(ShoppingCart.checkedout_at,
+                          ShoppingCart.created_at) < cutoff
+        ).order_by(ShoppingCart.id).limit(batch_size)]
+
+        if not cart_ids:
+            break
+
+        archived_at = datetime.utcnow()
+        _copy(ShoppingCart, ShoppingCartArchive,
+              ShoppingCart.id.in_(cart_ids), archived_at)
+        _copy(CartItem, CartItemArchive,
+              CartItem.cart_id.in_(cart_ids), archived_at)
+
+        _delete(CartItem, CartItem.cart_id.in_(cart_ids))
+        _delete(ShoppingCart, ShoppingCart.id.in_(cart_ids))
+        db.session.commit()
+
+        archived += len(cart_ids)
+        logger.info("Archived {} cart(s)".format(len(cart_ids)))
+        job_heartbeat()
+
+    return archived
+
+
+def archive_data(retention_days: int = None, batch_size: int = None) -> dict:
+    """Archive orders, coupons and carts older than the retention window"""
+    retention_days = retention_days or current_app.config.get(
+        "ARCHIVE_RETENTION_DAYS")
+    batch_size = batch_size or current_app.config.get("ARCHIVE_BATCH_SIZE")
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+
+    try:
+        return {
+            "orders": archive_orders(cutoff, batch_size),
+            "carts": archive_carts(cutoff, batch_size)
+        }
+
+    except Exception:
+        db.session.rollback()
+        raise
@@ -1,17 +1,16 @@
-import random
-import string
 import logging
 from flask import jsonify, request, Blueprint
 
 from google.oauth2 import id_token
 from google.auth.transport import requests as google_requests
 
-from project import db, bcrypt
+from project import db
 from project.api.credentials import *
 from project.api.authentications import authenticate, require_secure_transport
 from project.api.validators import email_validator, field_type_validator, required_validator
 from project.models import User, BlacklistToken, Location
 from project.exceptions import APIError
+from project.passwords import check_password, hash_password, needs_rehash
 
 auth_blueprint = Blueprint('auth', __name__)
 
@@ -74,11 +73,15 @@ def login():
             response_object['message'] = 'Username or password is incorrect.'
             return jsonify(response_object), 200
 
-        if bcrypt.check_password_hash(user.password, password.encode('utf-8')):
+        if check_password(user.password, password):
             if user.account_suspension:
                 response_object['message'] = 'Account is suspended by admin.'
                 return jsonify(response_object), 200
 
+            # the cost factor changed since the password was hashed
+            if needs_rehash(user.password):
+                user.password = hash_password(password)
+
             user.active = True
             user.update()
 
@@ -285,14 +288,11 @@ def google_login_token():
                 return jsonify(response_object)
 
         else:
-            user_object['password'] = random_string(10)
-
             new_user = User(
                 firstname=user_object['first_name'],
                 lastname=user_object['last_name'],
                 email=user_object['email'],
-                mobile_no=None,
-                password=user_object['password']
+                mobile_no=None
             )
 
             new_user.active = False
@@ -315,12 +315,6 @@ def google_login_token():
         return jsonify(response_object), 400
 
 
-def random_string(stringLength=10):
-    """Generate a random string of fixed length """
-    letters = string.ascii_lowercase
-    return ''.join(random.choice(letters) for i in range(stringLength))
-
-
 def social_media_check_user_exists(email):
     # check for existing user
     user = User.query.filter_by(email=email).first()
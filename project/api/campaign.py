@@ -114,7 +114,7 @@ def get_campaign_status(user_id, campaign_id):
         if not campaign:
             return jsonify(response_object), 200
 
-        campaign.start_date = datetime.now() if is_active else None
+        campaign.start_date = datetime.utcnow() if is_active else None
         campaign.is_active = is_active
 
         campaign.update()
@@ -175,12 +175,15 @@ def create_campaign(user_id):
         post_data = request.get_json()
         field_types = {'name': str, 'description': str, 'prize_id': int,
                        'threshold': int, 'video_url': str, 'sku_id': int,
-                       'image_url': str, 'start_date': str, 'end_date': str}
+                       'image_url': str, 'start_date': str, 'end_date': str,
+                       'cart_hold_minutes': int, 'admission_limit': int}
 
         required_fields = list(field_types.keys())
         required_fields.remove('start_date')
         required_fields.remove('end_date')
         required_fields.remove('threshold')
+        required_fields.remove('cart_hold_minutes')
+        required_fields.remove('admission_limit')
 
         post_data = field_type_validator(post_data, field_types)
         required_validator(post_data, required_fields)
@@ -211,6 +214,8 @@ def create_campaign(user_id):
                 end_date=post_data.get('end_date'),
                 user_id=user_id
             )
+            campaign.cart_hold_minutes = post_data.get('cart_hold_minutes')
+            campaign.admission_limit = post_data.get('admission_limit')
             campaign.insert()
 
             Draw(
@@ -249,7 +254,8 @@ def update_campaign(user_id, campaign_id):
         post_data = request.get_json()
         field_types = {'name': str, 'description': str, 'prize_id': int,
                        'is_active': bool, 'threshold': int, 'sku_id': int,
-                       'image_url': str, 'start_date': str, 'end_date': str}
+                       'image_url': str, 'start_date': str, 'end_date': str,
+                       'cart_hold_minutes': int, 'admission_limit': int}
 
         post_data = field_type_validator(post_data, field_types)
 
@@ -274,6 +280,13 @@ def update_campaign(user_id, campaign_id):
         campaign.is_active = post_data.get('is_active') if post_data.get('is_active') is not None \
             else campaign.is_active
 
+        campaign.cart_hold_minutes = post_data.get('cart_hold_minutes') \
+            if post_data.get('cart_hold_minutes') is not None else campaign.cart_hold_minutes
+
+        # 0 turns the waiting room off
+        if post_data.get('admission_limit') is not None:
+            campaign.admission_limit = post_data.get('admission_limit') or None
+
         campaign.update()
 
         response_object['status'] = True
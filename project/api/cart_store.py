@@ -0,0 +1,316 @@
+"""Cart storage in a key-value store.
+
+Carts being filled live in a Redis-compatible store instead of
+shopping_cart/cart_item rows: the cart of a user is the hash cart:<user_id>
+with one field per sku stock holding the item as JSON, and it expires
+CART_STORE_TTL_SECONDS after its last change. Browsing a cart needs no
+database write and no cart row at all. Checkout persists the cart to
+ShoppingCart/CartItem, reserving its stock, and clears the hash.
+
+With CART_STORE_URL set (e.g. redis://localhost:6379/0) the redis package is
+used, otherwise an in-process stand-in. The stand-in is not shared between
+processes, the app refuses to start without CART_STORE_URL outside of
+testing and debug mode unless CART_STORE_LOCAL is set.
+
+Items of a stored cart are identified by their sku_stock_id, which is the
+cart item id of update_cart and remove_from_cart. Carts filled before the
+store existed are moved to it by move_carts_to_store(), releasing the stock
+they reserved since stock is now reserved at checkout.
+"""
+import json
+import time
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+
+from flask import current_app
+
+from project import db
+from project.api.inventory import record_stock_changes
+from project.models import CartItem, ShoppingCart
+
+logger = logging.getLogger(__name__)
+
+
+class LocalBackend:
+    """In-process stand-in for the commands of a Redis server used here"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}
+        self.expires = {}
+
+    def _evict(self, key: str):
+        expires = self.expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+
+    def _hash(self, key: str, create: bool = False):
+        self._evict(key)
+
+        if create:
+            return self.data.setdefault(key, {})
+        return self.data.get(key, {})
+
+    def get(self, key: str):
+        with self.lock:
+            self._evict(key)
+            value = self.data.get(key)
+            return None if value is None else str(value)
+
+    def set(self, key: str, value: str):
+        with self.lock:
+            self.data[key] = value
+            self.expires.pop(key, None)
+
+    def incr(self, key: str) -> int:
+        with self.lock:
+            self._evict(key)
+            self.data[key] = int(self.data.get(key, 0)) + 1
+            return self.data[key]
+
+    def decr(self, key: str) -> int:
+        with self.lock:
+            self._evict(key)
+            self.data[key] = int(self.data.get(key, 0)) - 1
+            return self.data[key]
+
+    def hgetall(self, key: str) -> dict:
+        with self.lock:
+            return dict(self._hash(key))
+
+    def hget(self, key: str, field: str):
+        with self.lock:
+            return self._hash(key).get(field)
+
+    def hset(self, key: str, field: str, value: str):
+        with self.lock:
+            self._hash(key, create=True)[field] = value
+
+    def hsetnx(self, key: str, field: str, value: str) -> bool:
+        with self.lock:
+            fields = self._hash(key, create=True)
+            if field in fields:
+                return False
+
+            fields[field] = value
+            return True
+
+    def hdel(self, key: str, field: str) -> int:
+        with self.lock:
+            fields = self._hash(key)
+            if field not in fields:
+                return 0
+
+            del fields[field]
+            if not fields:
+                self.data.pop(key, None)
+                self.expires.pop(key, None)
+            return 1
+
+    def hlen(self, key: str) -> int:
+        with self.lock:
+            return len(self._hash(key))
+
+    def delete(self, key: str):
+        with self.lock:
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+
+    def expire(self, key: str, seconds: int):
+        with self.lock:
+            if key in self.data:
+                self.expires[key] = time.monotonic() + seconds
+
+
+class RedisBackend:
+    """Commands of a Redis-compatible server used here"""
+
+    def __init__(self, url: str):
+        import redis
+
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+
+    def get(self, key: str):
+        return self.client.get(key)
+
+    def set(self, key: str, value: str):
+        self.client.set(key, value)
+
+    def incr(self, key: str) -> int:
+        return self.client.incr(key)
+
+    def decr(self, key: str) -> int:
+        return self.client.decr(key)
+
+    def hgetall(self, key: str) -> dict:
+        return self.client.hgetall(key)
+
+    def hget(self, key: str, field: str):
+        return self.client.hget(key, field)
+
+    def hset(self, key: str, field: str, value: str):
+        self.client.hset(key, field, value)
+
+    def hsetnx(self, key: str, field: str, value: str) -> bool:
+        return bool(self.client.hsetnx(key, field, value))
+
+    def hdel(self, key: str, field: str) -> int:
+        return self.client.hdel(key, field)
+
+    def hlen(self, key: str) -> int:
+        return self.client.hlen(key)
+
+    def delete(self, key: str):
+        self.client.delete(key)
+
+    def expire(self, key: str, seconds: int):
+        self.client.expire(key, seconds)
+
+
+def create_backend(url: str = None):
+    return RedisBackend(url) if url else LocalBackend()
+
+
+def kv_backend():
+    """Key-value backend of the current app, shared by the cart store and
+    the waiting rooms of project/api/admission.py"""
+    backend = current_app.extensions.get("kv_backend")
+
+    if backend is None:
+        backend = create_backend(current_app.config.get("CART_STORE_URL"))
+        current_app.extensions["kv_backend"] = backend
+
+    return backend
+
+
+class CartStore:
+    """Carts of users as hashes of sku_stock_id -> item"""
+
+    def __init__(self, backend, ttl: int):
+        self.backend = backend
+        self.ttl = ttl
+
+    @staticmethod
+    def key(user_id) -> str:
+        return "cart:{}".format(int(user_id))
+
+    @staticmethod
+    def _item(sku_stock_id: int, value: str) -> dict:
+        item = json.loads(value)
+        item["sku_stock_id"] = int(sku_stock_id)
+        return item
+
+    def items(self, user_id) -> list:
+        """Items of a cart in the order they were added"""
+        items = [self._item(sku_stock_id, value) for sku_stock_id, value in
+                 self.backend.hgetall(self.key(user_id)).items()]
+        return sorted(items, key=lambda item: item["reservation_date"])
+
+    def get_item(self, user_id, sku_stock_id: int):
+        value = self.backend.hget(self.key(user_id), str(sku_stock_id))
+        return self._item(sku_stock_id, value) if value else None
+
+    def _value(self, campaign_id: int, sku_images_id: int, quantity: int,
+               reservation_date: str = None) -> str:
+        return json.dumps({
+            "campaign_id": campaign_id,
+            "sku_images_id": sku_images_id,
+            "quantity": quantity,
+            "reservation_date": reservation_date or datetime.utcnow().isoformat()
+        })
+
+    def add_item(self, user_id, campaign_id: int, sku_stock_id: int,
+                 sku_images_id: int, quantity: int) -> bool:
+        """Add an item, returns False if the sku stock is already in the cart"""
+        key = self.key(user_id)
+        added = self.backend.hsetnx(key, str(sku_stock_id), self._value(
+            campaign_id, sku_images_id, quantity))
+        self.backend.expire(key, self.ttl)
+
+        return added
+
+    def set_quantity(self, user_id, item: dict, quantity: int):
+        key = self.key(user_id)
+        self.backend.hset(key, str(item["sku_stock_id"]), self._value(
+            item["campaign_id"], item["sku_images_id"], quantity,
+            item["reservation_date"]))
+        self.backend.expire(key, self.ttl)
+
+    def remove_item(self, user_id, sku_stock_id: int) -> bool:
+        return bool(self.backend.hdel(self.key(user_id), str(sku_stock_id)))
+
+    def count(self, user_id) -> int:
+        return self.backend.hlen(self.key(user_id))
+
+    def clear(self, user_id):
+        self.backend.delete(self.key(user_id))
+
+
+def init_cart_store(app):
+    """Refuse to start with the in-process store outside of testing and
+    debug mode, carts would differ between processes"""
+    if app.config.get("CART_STORE_URL") or app.config.get("CART_STORE_LOCAL"):
+        return
+
+    if not (app.testing or app.debug):
+        raise RuntimeError("CART_STORE_URL is not set")
+
+
+def cart_store() -> CartStore:
+    """Cart store of the current app"""
+    store = current_app.extensions.get("cart_store")
+
+    if store is None:
+        store = CartStore(kv_backend(), current_app.config.get("CART_STORE_TTL_SECONDS"))
+        current_app.extensions["cart_store"] = store
+
+    return store
+
+
+def move_carts_to_store(batch_size: int = 500) -> int:
+    """Move the items of active carts not checked out yet from
+    shopping_cart/cart_item to the cart store and release their stock,
+    returns the number of carts moved. Safe to run again after a failure,
+    items already in the store are kept."""
+    store = cart_store()
+
+    moved = 0
+    while True:
+        carts = ShoppingCart.query.filter(
+            ShoppingCart.is_active == True,
+            ShoppingCart.checkedout_at == None).order_by(
+            ShoppingCart.id).limit(batch_size).all()
+        if not carts:
+            break
+
+        cart_ids = [shopping_cart.id for shopping_cart in carts]
+        users = {shopping_cart.id: shopping_cart.user_id for shopping_cart in carts}
+        items = CartItem.query.filter(CartItem.cart_id.in_(cart_ids)).all()
+
+        released = Counter()
+        for cart_item in items:
+            user_id = users[cart_item.cart_id]
+            key = store.key(user_id)
+
+            store.backend.hsetnx(key, str(cart_item.sku_stock_id), store._value(
+                cart_item.campaign_id, cart_item.sku_images_id, cart_item.quantity,
+                cart_item.reservation_date.isoformat()))
+            store.backend.expire(key, store.ttl)
+
+            released[cart_item.sku_stock_id] += cart_item.quantity
+
+        record_stock_changes([(sku_stock_id, quantity, 'release', None)
+                              for sku_stock_id, quantity in released.items()])
+        db.session.execute(CartItem.__table__.delete().where(
+            CartItem.cart_id.in_(cart_ids)))
+        db.session.execute(ShoppingCart.__table__.delete().where(
+            ShoppingCart.id.in_(cart_ids)))
+        db.session.commit()
+
+        moved += len(carts)
+        logger.info("Moved {} cart(s) to the cart store".format(moved))
+
+    return moved
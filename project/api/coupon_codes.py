@@ -0,0 +1,181 @@
+"""Coupon code generation.
+
+Every coupon gets a unique serial from the coupon_sequence table. A process
+reserves COUPON_CODE_BLOCK_SIZE serials at a time with one UPDATE on its own
+connection and hands them out from memory, so issuing the coupons of an
+order needs no database round trip per code and no uniqueness retries.
+
+A code is the base32 serial followed by a truncated HMAC-SHA256 of it keyed
+with COUPON_CODE_SECRET, e.g. AAAA-AAB4-K2QF-7XMA. The serial makes codes
+unique and the tag lets verify_code() reject forged or mistyped codes
+without a query.
+
+COUPON_CODE_SECRET is required outside of testing and debug mode, where
+SECRET_KEY stands in for it: the app refuses to start, and codes are
+neither signed nor verified, without it.
+"""
+import os
+import re
+import hmac
+import base64
+import hashlib
+import threading
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from project import db
+from project.models import CouponSequence
+
+SEQUENCE_NAME = 'coupon'
+
+# 5 bytes serial and 5 bytes tag, 8 base32 characters each
+SERIAL_BYTES = 5
+TAG_BYTES = 5
+
+CODE_RE = re.compile(r"^[A-Z2-7]{4}-[A-Z2-7]{4}-[A-Z2-7]{4}-[A-Z2-7]{4}$")
+
+# codes issued before signed codes and by earlier data generators
+LEGACY_CODE_RE = re.compile(r"^([A-Z]{3}-\d+-\d{4}-\d{4}|GEN-\d+)$")
+
+
+class BlockAllocator:
+    """Hands out serials from blocks reserved in coupon_sequence"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.lock = threading.Lock()
+        self.pid = None
+        self.next = self.end = 0
+
+    def _increment(self, connection, size: int):
+        """Advance the sequence by size, returns its new value or None if
+        the sequence does not exist yet"""
+        table = CouponSequence.__table__
+
+        result = connection.execute(table.update().where(
+            table.c.name == self.name).values(
+            next_value=table.c.next_value + size))
+        if not result.rowcount:
+            return None
+
+        return connection.execute(db.select(table.c.next_value).where(
+            table.c.name == self.name)).scalar()
+
+    def _create(self):
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(CouponSequence.__table__.insert().values(
+                    name=self.name, next_value=1))
+        except IntegrityError:
+            # created by another worker meanwhile
+            pass
+
+    def _reserve(self, size: int):
+        while True:
+            # own transaction, the block is kept even if the caller rolls back
+            with db.engine.begin() as connection:
+                end = self._increment(connection, size)
+
+            if end is not None:
+                break
+
+            self._create()
+
+        self.next, self.end = end - size, end
+
+    def _reserve_in_session(self, size: int) -> list:
+        # SQLite has a single writer, reserve exactly what is needed inside
+        # the caller's transaction and keep no block around
+        end = self._increment(db.session, size)
+        if end is None:
+            db.session.execute(CouponSequence.__table__.insert().values(
+                name=self.name, next_value=1 + size))
+            end = 1 + size
+
+        return list(range(end - size, end))
+
+    def allocate(self, count: int) -> list:
+        if db.engine.dialect.name == 'sqlite':
+            return self._reserve_in_session(count)
+
+        block_size = current_app.config.get("COUPON_CODE_BLOCK_SIZE")
+        serials = []
+
+        with self.lock:
+            # a forked worker must not reuse its parent's block
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.next = self.end = 0
+
+            while len(serials) < count:
+                if self.next >= self.end:
+                    self._reserve(max(block_size, count - len(serials)))
+
+                taken = min(self.end - self.next, count - len(serials))
+                serials.extend(range(self.next, self.next + taken))
+                self.next += taken
+
+        return serials
+
+
+allocator = BlockAllocator(SEQUENCE_NAME)
+
+
+def _require_secret(app) -> str:
+    secret = app.config.get("COUPON_CODE_SECRET")
+    if secret:
+        return secret
+
+    if not (app.testing or app.debug):
+        raise RuntimeError("COUPON_CODE_SECRET is not set")
+
+    return app.config.get("SECRET_KEY")
+
+
+def _secret() -> bytes:
+    return _require_secret(current_app).encode()
+
+
+def _b32(data: bytes) -> str:
+    return base64.b32encode(data).decode()
+
+
+def _tag(serial_bytes: bytes, secret: bytes) -> bytes:
+    return hmac.new(secret, serial_bytes, hashlib.sha256).digest()[:TAG_BYTES]
+
+
+def encode_code(serial: int, secret: bytes = None) -> str:
+    serial_bytes = serial.to_bytes(SERIAL_BYTES, 'big')
+    text = _b32(serial_bytes) + _b32(_tag(serial_bytes, secret or _secret()))
+    return '-'.join(text[i:i + 4] for i in range(0, len(text), 4))
+
+
+def generate_codes(count: int) -> list:
+    """Return count new unique coupon codes"""
+    secret = _secret()
+    return [encode_code(serial, secret) for serial in allocator.allocate(count)]
+
+
+def verify_code(code: str) -> bool:
+    """Check the signature of a code without touching the database"""
+    if not isinstance(code, str) or not CODE_RE.match(code):
+        return False
+
+    raw = base64.b32decode(code.replace('-', ''))
+    serial_bytes, tag = raw[:SERIAL_BYTES], raw[SERIAL_BYTES:]
+
+    return hmac.compare_digest(tag, _tag(serial_bytes, _secret()))
+
+
+def is_valid_code(code: str) -> bool:
+    """Whether a code may exist, legacy codes can only be checked in the
+    database"""
+    return verify_code(code) or bool(
+        isinstance(code, str) and LEGACY_CODE_RE.match(code))
+
+
+def init_coupon_codes(app):
+    """Refuse to start without a coupon code secret outside of testing and
+    debug mode"""
+    _require_secret(app)
@@ -0,0 +1,446 @@
+"""Deterministic synthetic data generator for load and benchmark databases.
+
+Rows are built in Python from a seeded random generator and written with
+executemany inserts in batches, one transaction per batch. Ids are assigned
+up front (continuing after the current max id of each table) so related rows
+can be generated without reading anything back. All users share a single
+precomputed password hash.
+
+Coupons get signed codes from project/api/coupon_codes.py, stock changes
+are written to the inventory ledger like the app does (a restock per sku
+stock, a sale per order line, applied to the stock snapshots) and active
+carts go to the cart store of project/api/cart_store.py.
+"""
+import random
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from project import db
+from project.api.cart_store import cart_store
+from project.api.coupon_codes import generate_codes
+from project.models import (
+    User,
+    Location,
+    Sku,
+    Sku_Images,
+    Sku_Stock,
+    Prize,
+    Campaign,
+    Coupon,
+    Draw,
+    Order,
+    Order_Sku,
+    InventoryEntry
+)
+from project.passwords import hash_password
+
+logger = logging.getLogger(__name__)
+
+FIRST_NAMES = ["James", "Mary", "John", "Patricia", "Robert", "Jennifer",
+               "Michael", "Linda", "David", "Elizabeth", "Ali", "Fatima",
+               "Omar", "Aisha", "Wei", "Mei", "Carlos", "Sofia"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia",
+              "Miller", "Davis", "Khan", "Ahmed", "Chen", "Wang", "Lopez"]
+CITIES = [("New York", "NY", "USA"), ("Chicago", "IL", "USA"),
+          ("Manchester", "NH", "UK"), ("London", "LDN", "UK"),
+          ("Dubai", "DU", "UAE"), ("Lahore", "PB", "Pakistan")]
+CATEGORIES = ["tshirt", "hoodie", "shoes", "cap", "jacket", "watch"]
+SIZES = ["S", "M", "L", "XL"]
+COLORS = ["red", "black", "white", "blue"]
+
+# weights of order statuses, cancelled orders do not count as sold
+ORDER_STATUSES = [("pending", 20), ("paid", 20), ("shipped", 15),
+                  ("delivered", 40), ("cancelled", 5)]
+
+EPOCH = datetime(2023, 1, 1)
+
+
+class DataGenerator:
+    """Generates users, skus, campaigns, orders and carts in bulk"""
+
+    def __init__(self, seed: int = 42, batch_size: int = 5000,
+                 password: str = "greaterthaneight"):
+        self.random = random.Random(seed)
+        self.batch_size = batch_size
+        self.password_hash = hash_password(password)
+
+        self.user_ids = []
+        self.campaigns = []
+        self.sku_prices = {}
+        self.sku_images = {}
+        self.sku_stocks = {}
+        self.initial_stock = {}
+
+        self.sold, self.delivered, self.stock_taken = {}, {}, {}
+        self.codes = iter(())
+
+    @staticmethod
+    def _next_id(model) -> int:
+        return (db.session.query(func.max(model.id)).scalar() or 0) + 1
+
+    def _insert(self, model, rows: list):
+        if rows:
+            db.session.execute(model.__table__.insert(), rows)
+
+    def _flush(self, buffers: dict, force: bool = False):
+        """Insert buffered rows, in dependency order, once a batch is full"""
+        if not force and max(len(rows) for rows in buffers.values()) < self.batch_size:
+            return
+
+        for model, rows in buffers.items():
+            self._insert(model, rows)
+            rows.clear()
+
+        db.session.commit()
+
+    def _code(self) -> str:
+        """Next signed coupon code, reserved a batch at a time"""
+        code = next(self.codes, None)
+        if code is None:
+            self.codes = iter(generate_codes(self.batch_size))
+            code = next(self.codes)
+
+        return code
+
+    def _date(self, max_days: int = 365) -> datetime:
+        return EPOCH + timedelta(seconds=self.random.randrange(max_days * 86400))
+
+    def generate_users(self, count: int):
+        user_id = self._next_id(User)
+        location_id = self._next_id(Location)
+        buffers = {User: [], Location: []}
+
+        for offset in range(count):
+            firstname = self.random.choice(FIRST_NAMES)
+            lastname = self.random.choice(LAST_NAMES)
+            city, state, country = self.random.choice(CITIES)
+
+            buffers[User].append({
+                "id": user_id + offset,
+                "firstname": firstname,
+                "lastname": lastname,
+                "email": "{}.{}.{}@example.com".format(
+                    firstname, lastname, user_id + offset).lower(),
+                "mobile_no": str(7000000000 + user_id + offset),
+                "password": self.password_hash,
+                "gender": self.random.choice(["male", "female"]),
+                "role": "admin" if offset == 0 else "user",
+                "active": True,
+                "account_suspension": False,
+                "is_admin": offset == 0
+            })
+            buffers[Location].append({
+                "id": location_id + offset,
+                "address": "{} Main Street".format(self.random.randrange(1, 9999)),
+                "city": city,
+                "state": state,
+                "country": country,
+                "zipcode": str(self.random.randrange(10000, 99999)),
+                "user_id": user_id + offset
+            })
+
+            self._flush(buffers)
+
+        self._flush(buffers, force=True)
+
+        self.user_ids = list(range(user_id, user_id + count))
+        self.location_offset = location_id - user_id
+        logger.info("Generated {} user(s)".format(count))
+
+    def generate_skus(self, count: int):
+        owner_id = self.user_ids[0]
+        sku_id = self._next_id(Sku)
+        image_id = self._next_id(Sku_Images)
+        stock_id = self._next_id(Sku_Stock)
+        buffers = {Sku: [], Sku_Images: [], Sku_Stock: [], InventoryEntry: []}
+
+        for offset in range(count):
+            current_sku_id = sku_id + offset
+            price = round(self.random.uniform(5, 200), 2)
+            category = self.random.choice(CATEGORIES)
+            quantity = 0
+
+            self.sku_images[current_sku_id] = []
+            for _ in range(self.random.randint(1, 3)):
+                buffers[Sku_Images].append({
+                    "id": image_id,
+                    "sku_id": current_sku_id,
+                    "image": "https://ik.imagekit.io/classy/{}-{}.png".format(
+                        category, image_id)
+                })
+                self.sku_images[current_sku_id].append(image_id)
+                image_id += 1
+
+            self.sku_stocks[current_sku_id] = []
+            variants = self.random.sample(
+                [(size, color) for size in SIZES for color in COLORS],
+                self.random.randint(1, 6))
+            for size, color in variants:
+                stock = self.random.randint(50, 500)
+                buffers[Sku_Stock].append({
+                    "id": stock_id,
+                    "sku_id": current_sku_id,
+                    "size": size,
+                    "color": color,
+                    "stock": stock
+                })
+                buffers[InventoryEntry].append({
+                    "sku_stock_id": stock_id,
+                    "kind": "restock",
+                    "quantity": stock,
+                    "applied": True,
+                    "created_at": EPOCH
+                })
+                self.sku_stocks[current_sku_id].append(stock_id)
+                self.initial_stock[stock_id] = stock
+                quantity += stock
+                stock_id += 1
+
+            buffers[Sku].append({
+                "id": current_sku_id,
+                "user_id": owner_id,
+                "name": "{} {}".format(category.title(), current_sku_id),
+                "description": "Synthetic {}".format(category),
+                "category": category,
+                "price": price,
+                "sales_tax": round(price * 0.05, 2),
+                "quantity": quantity,
+                "number_sold": 0,
+                "number_delivered": 0,
+                "size_chart": "https://ik.imagekit.io/classy/size-chart.png"
+            })
+            self.sku_prices[current_sku_id] = (price, round(price * 0.05, 2))
+
+            # sku images and stocks reference the sku, insert it first
+            self._flush(buffers)
+
+        self._flush(buffers, force=True)
+        logger.info("Generated {} sku(s)".format(count))
+
+    def generate_campaigns(self, count: int):
+        owner_id = self.user_ids[0]
+        sku_ids = list(self.sku_prices.keys())
+        campaign_id = self._next_id(Campaign)
+        prize_id = self._next_id(Prize)
+        draw_id = self._next_id(Draw)
+        buffers = {Prize: [], Campaign: [], Draw: []}
+
+        for offset in range(count):
+            current_campaign_id = campaign_id + offset
+            sku_id = sku_ids[offset % len(sku_ids)]
+            is_active = self.random.random() < 0.7
+            start_date = self._date()
+            end_date = None if is_active else start_date + timedelta(
+                days=self.random.randint(7, 60))
+
+            buffers[Prize].append({
+                "id": prize_id + offset,
+                "user_id": owner_id,
+                "name": "Prize {}".format(prize_id + offset),
+                "description": "Synthetic prize",
+                "image": "https://ik.imagekit.io/classy/prize.png"
+            })
+            buffers[Campaign].append({
+                "id": current_campaign_id,
+                "user_id": owner_id,
+                "sku_id": sku_id,
+                "prize_id": prize_id + offset,
+                "name": "Campaign {}".format(current_campaign_id),
+                "description": "Synthetic campaign",
+                "image": "https://ik.imagekit.io/classy/campaign.png",
+                "threshold": 80,
+                "is_active": is_active,
+                "start_date": start_date,
+                "end_date": end_date
+            })
+            buffers[Draw].append({
+                "id": draw_id + offset,
+                "campaign_id": current_campaign_id,
+                "start_date": end_date,
+                "end_date": end_date + timedelta(days=7) if end_date else None
+            })
+            self.campaigns.append((current_campaign_id, sku_id))
+
+            self._flush(buffers)
+
+        self._flush(buffers, force=True)
+        logger.info("Generated {} campaign(s)".format(count))
+
+    def _order_line(self):
+        campaign_id, sku_id = self.random.choice(self.campaigns)
+        return {
+            "campaign_id": campaign_id,
+            "sku_id": sku_id,
+            "sku_stock_id": self.random.choice(self.sku_stocks[sku_id]),
+            "sku_images_id": self.random.choice(self.sku_images[sku_id]),
+            "quantity": self.random.randint(1, 3)
+        }
+
+    def generate_orders(self, count: int):
+        order_id = self._next_id(Order)
+        order_sku_id = self._next_id(Order_Sku)
+        coupon_id = self._next_id(Coupon)
+        buffers = {Order: [], Coupon: [], Order_Sku: [], InventoryEntry: []}
+
+        first_coupon_id = coupon_id
+
+        statuses = [status for status, _ in ORDER_STATUSES]
+        weights = [weight for _, weight in ORDER_STATUSES]
+
+        for offset in range(count):
+            current_order_id = order_id + offset
+            user_id = self.random.choice(self.user_ids)
+            status = self.random.choices(statuses, weights)[0]
+            booking_date = self._date()
+            order = {
+                "id": current_order_id,
+                "status": status,
+                "total_quantity": 0,
+                "total_tax": 0.0,
+                "shipping_fee": 0.0,
+                "total_amount": 0.0,
+                "booking_date": booking_date,
+                "user_id": user_id,
+                "location_id": user_id + self.location_offset
+            }
+
+            for _ in range(self.random.randint(1, 3)):
+                line = self._order_line()
+                price, sales_tax = self.sku_prices[line["sku_id"]]
+                total_price = round(price * line["quantity"], 2)
+
+                buffers[Coupon].append({
+                    "id": coupon_id,
+                    "user_id": user_id,
+                    "campaign_id": line["campaign_id"],
+                    "sku_images_id": line["sku_images_id"],
+                    "sku_stock_id": line["sku_stock_id"],
+                    "code": self._code(),
+                    "create_date": booking_date,
+                    "amount_paid": total_price,
+                    "is_redeemed": False
+                })
+                buffers[Order_Sku].append({
+                    "id": order_sku_id,
+                    "order_id": current_order_id,
+                    "quantity": line["quantity"],
+                    "total_price": total_price,
+                    "sales_tax": sales_tax,
+                    "coupon_id": coupon_id,
+                    "campaign_id": line["campaign_id"],
+                    "sku_stock_id": line["sku_stock_id"],
+                    "sku_images_id": line["sku_images_id"]
+                })
+                coupon_id += 1
+                order_sku_id += 1
+
+                order["total_quantity"] += line["quantity"]
+                order["total_amount"] += total_price
+                order["total_tax"] += sales_tax
+
+                if status != "cancelled":
+                    self._take_stock(line)
+                    buffers[InventoryEntry].append({
+                        "sku_stock_id": line["sku_stock_id"],
+                        "kind": "sale",
+                        "quantity": -line["quantity"],
+                        "ref_id": current_order_id,
+                        "applied": True,
+                        "created_at": booking_date
+                    })
+                    self.sold[line["sku_id"]] = self.sold.get(
+                        line["sku_id"], 0) + line["quantity"]
+
+                if status == "delivered":
+                    self.delivered[line["sku_id"]] = self.delivered.get(
+                        line["sku_id"], 0) + line["quantity"]
+
+            order["total_amount"] = round(order["total_amount"], 2)
+            order["total_tax"] = round(order["total_tax"], 2)
+            buffers[Order].append(order)
+            self._flush(buffers)
+
+        self._flush(buffers, force=True)
+        logger.info("Generated {} order(s) and {} coupon(s)".format(
+            count, coupon_id - first_coupon_id))
+
+    def _take_stock(self, line: dict):
+        self.stock_taken[line["sku_stock_id"]] = self.stock_taken.get(
+            line["sku_stock_id"], 0) + line["quantity"]
+
+    def update_counters(self):
+        """Grow stocks to cover what was sold, restocking them in the
+        ledger, and set the stock snapshots and sku counters accordingly"""
+        stock_rows, sku_quantity, restocks = [], {}, []
+
+        for sku_id, stock_ids in self.sku_stocks.items():
+            for stock_id in stock_ids:
+                taken = self.stock_taken.get(stock_id, 0)
+                initial = max(self.initial_stock[stock_id], taken)
+                if initial > self.initial_stock[stock_id]:
+                    restocks.append({
+                        "sku_stock_id": stock_id,
+                        "kind": "restock",
+                        "quantity": initial - self.initial_stock[stock_id],
+                        "applied": True,
+                        "created_at": EPOCH + timedelta(days=365)
+                    })
+
+                stock_rows.append({"_id": stock_id, "stock": initial - taken})
+                sku_quantity[sku_id] = sku_quantity.get(sku_id, 0) + initial
+
+        sku_rows = [{
+            "_id": sku_id,
+            "quantity": quantity,
+            "number_sold": self.sold.get(sku_id, 0),
+            "number_delivered": self.delivered.get(sku_id, 0)
+        } for sku_id, quantity in sku_quantity.items()]
+
+        for start in range(0, len(restocks), self.batch_size):
+            self._insert(InventoryEntry, restocks[start:start + self.batch_size])
+            db.session.commit()
+
+        stock_table = Sku_Stock.__table__
+        sku_table = Sku.__table__
+
+        for start in range(0, len(stock_rows), self.batch_size):
+            db.session.execute(stock_table.update().where(
+                stock_table.c.id == db.bindparam("_id")).values(
+                stock=db.bindparam("stock")),
+                stock_rows[start:start + self.batch_size])
+            db.session.commit()
+
+        for start in range(0, len(sku_rows), self.batch_size):
+            db.session.execute(sku_table.update().where(
+                sku_table.c.id == db.bindparam("_id")).values(
+                quantity=db.bindparam("quantity"),
+                number_sold=db.bindparam("number_sold"),
+                number_delivered=db.bindparam("number_delivered")),
+                sku_rows[start:start + self.batch_size])
+            db.session.commit()
+
+    def generate_carts(self, count: int):
+        """Fill the carts of distinct users in the cart store, stock is only
+        reserved when a cart is checked out"""
+        store = cart_store()
+        user_ids = self.random.sample(
+            self.user_ids, min(count, len(self.user_ids)))
+
+        for user_id in user_ids:
+            for _ in range(self.random.randint(1, 3)):
+                line = self._order_line()
+                store.add_item(user_id, line["campaign_id"], line["sku_stock_id"],
+                               line["sku_images_id"], line["quantity"])
+
+        logger.info("Generated {} cart(s)".format(len(user_ids)))
+
+    def generate(self, users: int, skus: int, campaigns: int,
+                 orders: int, carts: int = 0):
+        self.generate_users(max(users, 1))
+        self.generate_skus(max(skus, 1))
+        self.generate_campaigns(max(campaigns, 1))
+        self.generate_orders(orders)
+        self.generate_carts(carts)
+        self.update_counters()
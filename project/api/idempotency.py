@@ -0,0 +1,195 @@
+"""Idempotency-Key support for retried write requests.
+
+A request carrying an Idempotency-Key header claims (user, key) by inserting
+an idempotency_key row before the endpoint runs and stores the response on
+it afterwards. A retry with the same key and request gets the stored
+response back without running the endpoint again, while a concurrent
+duplicate waits for the first request to finish. A claim still processing
+after IDEMPOTENCY_PROCESSING_TIMEOUT_SECONDS was left by a crashed request
+and is taken over by the next retry. Reusing a key for a different request
+is rejected. Keys expire after IDEMPOTENCY_TTL_SECONDS and
+are purged by the worker.
+"""
+import time
+import hashlib
+import logging
+from functools import wraps
+from datetime import datetime, timedelta
+
+from flask import current_app, jsonify, make_response, request
+from sqlalchemy.exc import IntegrityError
+
+from project import db
+from project.models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+
+def request_hash() -> str:
+    digest = hashlib.sha256()
+    digest.update(request.method.encode())
+    digest.update(request.full_path.encode())
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def _stale(existing: IdempotencyKey) -> bool:
+    """Whether a claim was left processing by a request that died"""
+    timeout = timedelta(seconds=current_app.config.get(
+        "IDEMPOTENCY_PROCESSING_TIMEOUT_SECONDS"))
+    return existing.status == 'processing' and \
+        existing.claimed_at <= datetime.utcnow() - timeout
+
+
+def _reclaim(existing: IdempotencyKey) -> bool:
+    """Take over a stale claim, returns False if another retry took it"""
+    table = IdempotencyKey.__table__
+    result = db.session.execute(table.update().where(
+        table.c.id == existing.id,
+        table.c.status == 'processing',
+        table.c.claimed_at == existing.claimed_at
+    ).values(claimed_at=datetime.utcnow()))
+    db.session.commit()
+
+    if result.rowcount == 1:
+        logger.info("Took over the stale {} {} of user {}".format(
+            IDEMPOTENCY_HEADER, existing.key, existing.user_id))
+    return result.rowcount == 1
+
+
+def _claim(key: str, user_id: int, hashed: str):
+    """Claim a key, returns None if claimed or the existing unexpired row"""
+    while True:
+        try:
+            IdempotencyKey(key, user_id, hashed, datetime.utcnow() + timedelta(
+                seconds=current_app.config.get("IDEMPOTENCY_TTL_SECONDS"))).insert()
+            return None
+
+        except IntegrityError:
+            db.session.rollback()
+
+        existing = IdempotencyKey.query.filter_by(user_id=user_id, key=key).first()
+        if not existing:
+            # released meanwhile
+            continue
+
+        if existing.expires_at > datetime.utcnow():
+            if existing.request_hash == hashed and _stale(existing) and _reclaim(existing):
+                return None
+            return existing
+
+        existing.delete()
+
+
+def _wait(key: str, user_id: int):
+    """Wait for a concurrent request holding the key to finish"""
+    deadline = time.monotonic() + current_app.config.get("IDEMPOTENCY_WAIT_SECONDS")
+
+    while True:
+        # end the transaction to see the other request's commit
+        db.session.rollback()
+
+        existing = IdempotencyKey.query.filter_by(user_id=user_id, key=key).first()
+        if not existing or existing.status == 'done' or _stale(existing):
+            return existing
+
+        if time.monotonic() >= deadline:
+            # still processing
+            return existing
+
+        time.sleep(0.05)
+
+
+def _replay(existing: IdempotencyKey):
+    response = current_app.response_class(
+        existing.response_body, status=existing.response_status,
+        mimetype='application/json')
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _release(key: str, user_id: int):
+    """Drop the claim of a failed request so that it can be retried"""
+    logger.info("Releasing {} {} of user {}".format(IDEMPOTENCY_HEADER, key, user_id))
+    db.session.rollback()
+    db.session.execute(IdempotencyKey.__table__.delete().where(
+        IdempotencyKey.user_id == user_id, IdempotencyKey.key == key))
+    db.session.commit()
+
+
+def idempotent(f):
+    """Make an authenticated endpoint replay its response for a repeated
+    Idempotency-Key, use under @authenticate"""
+    @wraps(f)
+    def decorated_function(user_id, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return f(user_id, *args, **kwargs)
+
+        response_object = {
+            'status': False,
+            'message': 'Invalid {} header'.format(IDEMPOTENCY_HEADER)
+        }
+
+        if len(key) > 128:
+            return jsonify(response_object), 400
+
+        hashed = request_hash()
+        existing = _claim(key, int(user_id), hashed)
+
+        if existing and existing.request_hash != hashed:
+            response_object['message'] = '{} was already used for a different request'.format(
+                IDEMPOTENCY_HEADER)
+            return jsonify(response_object), 422
+
+        if existing and existing.status != 'done':
+            existing = _wait(key, int(user_id))
+
+            if not existing or _stale(existing):
+                # the first request failed and released the key, or died
+                return decorated_function(user_id, *args, **kwargs)
+
+            if existing.status != 'done':
+                response_object['message'] = 'A request with this {} is still in progress'.format(
+                    IDEMPOTENCY_HEADER)
+                return jsonify(response_object), 409
+
+        if existing:
+            return _replay(existing)
+
+        try:
+            response = make_response(f(user_id, *args, **kwargs))
+
+        except Exception:
+            _release(key, int(user_id))
+            raise
+
+        if response.status_code >= 500:
+            _release(key, int(user_id))
+            return response
+
+        db.session.rollback()
+        db.session.execute(IdempotencyKey.__table__.update().where(
+            IdempotencyKey.user_id == int(user_id),
+            IdempotencyKey.key == key
+        ).values(
+            status='done',
+            response_status=response.status_code,
+            response_body=response.get_data(as_text=True)
+        ))
+        db.session.commit()
+
+        return response
+
+    return decorated_function
+
+
+def purge_idempotency_keys() -> int:
+    """Delete expired keys, returns the number deleted"""
+    result = db.session.execute(IdempotencyKey.__table__.delete().where(
+        IdempotencyKey.expires_at <= datetime.utcnow()))
+    db.session.commit()
+
+    return result.rowcount
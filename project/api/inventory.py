@@ -0,0 +1,343 @@
+"""Inventory ledger and counter reconciliation.
+
+Stock changes are appended to inventory_entry instead of updating the
+sku_stock row: each reserve, release, sale, return and restock is one
+immutable entry. Sku_Stock.stock is a snapshot of the applied entries and
+the current stock, Sku_Stock.stock_level, is the snapshot plus the
+unapplied ones, read with the (sku_stock_id, applied, id) index. The
+inventory_ledger job folds unapplied entries into the snapshots and flags
+them applied in the same transaction, so that the tail stays short whatever
+the order entries are committed in. Entries are kept for audits, see
+stock_history().
+
+Checks that must not oversell lock the sku_stock rows first and read the
+levels after the lock, see locked_stock_levels(). Compaction takes the same
+locks in the same order, sku_stock then inventory_entry.
+
+Sku.number_sold, Sku.number_delivered and the stock are maintained
+incrementally by the cart, order and outbox code paths. reconcile_inventory()
+recomputes them for the whole catalog from grouped aggregates of order skus
+(archived ones included) and active cart items, diffs them against the
+stored counters with NumPy and reports the drift. With repair, drifting sku
+counters are set back in batches of INVENTORY_RECONCILE_BATCH_SIZE, each
+UPDATE matching the stored value seen by the scan so that a counter changed
+meanwhile is left for the next run. Skus of orders with unprocessed outbox
+events are skipped since their counters are legitimately behind.
+
+Stock drift is only reported: it is known per sku (quantity less reserved and
+ordered items) but stocks created before the ledger have no restock entry, so
+it cannot be attributed to a variant.
+"""
+import json
+import logging
+from datetime import datetime
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import and_, bindparam, case, func
+
+from project import db
+from project.api.leases import job_heartbeat
+from project.api.utils import refresh_touched_campaigns, touch_skus
+from project.models import (
+    Sku,
+    Sku_Stock,
+    ShoppingCart,
+    CartItem,
+    Order,
+    Order_Sku,
+    OrderArchive,
+    Order_SkuArchive,
+    OutboxEvent,
+    InventoryEntry
+)
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = ('number_sold', 'number_delivered')
+
+# orders whose items are no longer held
+RELEASED_STATUSES = ('cancelled', 'returned')
+
+
+def record_stock(sku_stock_id: int, quantity: int, kind: str, ref_id: int = None):
+    """Append a stock change to the ledger, not committed"""
+    db.session.add(InventoryEntry(sku_stock_id, quantity, kind, ref_id))
+
+
+def record_stock_changes(changes: list):
+    """Append (sku_stock_id, quantity, kind, ref_id) stock changes with one
+    INSERT, not committed"""
+    if not changes:
+        return
+
+    now = datetime.utcnow()
+    db.session.execute(InventoryEntry.__table__.insert(), [{
+        "sku_stock_id": sku_stock_id,
+        "quantity": quantity,
+        "kind": kind,
+        "ref_id": ref_id,
+        "created_at": now
+    } for sku_stock_id, quantity, kind, ref_id in changes])
+
+
+def stock_levels(sku_stock_ids) -> dict:
+    """Current stock of sku stocks, {sku_stock_id: stock}"""
+    return dict(db.session.query(Sku_Stock.id, Sku_Stock.stock_level).filter(
+        Sku_Stock.id.in_(list(sku_stock_ids))).all())
+
+
+def locked_stock_levels(sku_stock_ids) -> dict:
+    """Lock sku stocks until the end of the transaction and read their
+    current stock, {sku_stock_id: stock}
+
+    The entries are summed with a locking read, which sees the entries
+    committed since the transaction's snapshot was taken."""
+    sku_stock_ids = list(sku_stock_ids)
+    if not sku_stock_ids:
+        return {}
+
+    levels = dict(db.session.query(Sku_Stock.id, Sku_Stock.stock).filter(
+        Sku_Stock.id.in_(sku_stock_ids)).with_for_update().all())
+
+    for sku_stock_id, quantity in db.session.query(
+            InventoryEntry.sku_stock_id, func.sum(InventoryEntry.quantity)).filter(
+            InventoryEntry.sku_stock_id.in_(list(levels)),
+            InventoryEntry.applied == False).group_by(
+            InventoryEntry.sku_stock_id).with_for_update(read=True):
+        levels[sku_stock_id] += int(quantity)
+
+    return levels
+
+
+def stock_history(sku_stock_id: int, since: datetime = None, limit: int = 100) -> list:
+    """Latest ledger entries of a sku stock, newest first"""
+    query = InventoryEntry.query.filter(InventoryEntry.sku_stock_id == sku_stock_id)
+    if since:
+        query = query.filter(InventoryEntry.created_at >= since)
+
+    return query.order_by(InventoryEntry.id.desc()).limit(limit).all()
+
+
+def compact_inventory() -> int:
+    """Fold unapplied ledger entries into the stock snapshots, returns the
+    number of entries applied"""
+    batch_size = current_app.config.get("INVENTORY_LEDGER_BATCH_SIZE")
+    sku_stock_table = Sku_Stock.__table__
+    entry_table = InventoryEntry.__table__
+
+    applied = 0
+    while True:
+        entries = db.session.query(
+            InventoryEntry.id, InventoryEntry.sku_stock_id, InventoryEntry.quantity).filter(
+            InventoryEntry.applied == False).order_by(
+            InventoryEntry.id).limit(batch_size).all()
+        if not entries:
+            break
+
+        deltas = {}
+        for _, sku_stock_id, quantity in entries:
+            deltas[sku_stock_id] = deltas.get(sku_stock_id, 0) + quantity
+
+        db.session.execute(sku_stock_table.update().where(
+            sku_stock_table.c.id == bindparam('row_id')).values(
+            stock=sku_stock_table.c.stock + bindparam('delta')), [
+            {"row_id": sku_stock_id, "delta": delta}
+            for sku_stock_id, delta in sorted(deltas.items())])
+
+        result = db.session.execute(entry_table.update().where(
+            entry_table.c.id.in_([entry[0] for entry in entries]),
+            entry_table.c.applied == False).values(applied=True))
+
+        # applied meanwhile by another run, which already moved the stock
+        if result.rowcount != len(entries):
+            db.session.rollback()
+            break
+
+        db.session.commit()
+        applied += len(entries)
+        job_heartbeat()
+
+        if len(entries) < batch_size:
+            break
+
+    if applied:
+        logger.info("Applied {} ledger entries to the stock snapshots".format(applied))
+
+    return applied
+
+
+def _align(sku_ids: np.ndarray, rows: list) -> np.ndarray:
+    """Spread (sku_id, value) rows over the sorted sku ids, 0 if missing"""
+    values = np.zeros(len(sku_ids), dtype=np.int64)
+    if not rows:
+        return values
+
+    keys = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    positions = np.searchsorted(sku_ids, keys)
+    found = (positions < len(sku_ids)) & (
+        sku_ids[np.minimum(positions, len(sku_ids) - 1)] == keys)
+
+    np.add.at(values, positions[found], np.fromiter(
+        (int(row[1] or 0) for row in rows), dtype=np.int64, count=len(rows))[found])
+    return values
+
+
+def _order_totals(order_model, order_sku_model) -> list:
+    """Held, sold and delivered quantities per sku of live or archived
+    orders"""
+    live = ~order_model.status.in_(RELEASED_STATUSES)
+
+    return db.session.query(
+        Sku_Stock.sku_id,
+        func.sum(case((live, order_sku_model.quantity), else_=0)),
+        func.sum(case((and_(live, order_sku_model.coupon_id != None),
+                       order_sku_model.quantity), else_=0)),
+        func.sum(case((order_model.status == 'delivered',
+                       order_sku_model.quantity), else_=0))
+    ).join(
+        order_model, order_model.id == order_sku_model.order_id).join(
+        Sku_Stock, Sku_Stock.id == order_sku_model.sku_stock_id).group_by(
+        Sku_Stock.sku_id).all()
+
+
+def _in_flight_skus() -> set:
+    """Skus of orders with pending outbox events"""
+    order_ids = set()
+    for (payload,) in db.session.query(OutboxEvent.payload).filter(
+            OutboxEvent.status == 'pending'):
+        payload = json.loads(payload)
+        order_ids.update(payload.get('order_ids') or [])
+        if payload.get('order_id'):
+            order_ids.add(payload['order_id'])
+
+    if not order_ids:
+        return set()
+
+    return {sku_id for (sku_id,) in db.session.query(Sku_Stock.sku_id).join(
+        Order_Sku, Order_Sku.sku_stock_id == Sku_Stock.id).filter(
+        Order_Sku.order_id.in_(list(order_ids))).distinct()}
+
+
+def inventory_drift() -> list:
+    """Compare stored sku counters with the ones derived from orders and
+    carts, returns a dict per drifting sku"""
+    skus = db.session.query(
+        Sku.id, Sku.quantity, Sku.number_sold, Sku.number_delivered).order_by(
+        Sku.id).all()
+
+    if not skus:
+        return []
+
+    sku_ids = np.fromiter((row[0] for row in skus), dtype=np.int64, count=len(skus))
+    stored = {
+        name: np.fromiter((int(row[i] or 0) for row in skus),
+                          dtype=np.int64, count=len(skus))
+        for i, name in enumerate(('quantity',) + COUNTERS, start=1)
+    }
+
+    stock = _align(sku_ids, db.session.query(
+        Sku_Stock.sku_id, func.sum(Sku_Stock.stock)).group_by(
+        Sku_Stock.sku_id).all())
+
+    # unapplied tail of the ledger
+    stock += _align(sku_ids, db.session.query(
+        Sku_Stock.sku_id, func.sum(InventoryEntry.quantity)).join(
+        InventoryEntry, and_(
+            InventoryEntry.sku_stock_id == Sku_Stock.id,
+            InventoryEntry.applied == False)).group_by(
+        Sku_Stock.sku_id).all())
+
+    reserved = _align(sku_ids, db.session.query(
+        Sku_Stock.sku_id, func.sum(CartItem.quantity)).join(
+        CartItem, CartItem.sku_stock_id == Sku_Stock.id).join(
+        ShoppingCart, ShoppingCart.id == CartItem.cart_id).filter(
+        ShoppingCart.is_active == True).group_by(Sku_Stock.sku_id).all())
+
+    held = np.zeros(len(sku_ids), dtype=np.int64)
+    expected = {name: np.zeros(len(sku_ids), dtype=np.int64) for name in COUNTERS}
+
+    for order_model, order_sku_model in ((Order, Order_Sku),
+                                         (OrderArchive, Order_SkuArchive)):
+        rows = _order_totals(order_model, order_sku_model)
+        held += _align(sku_ids, [(row[0], row[1]) for row in rows])
+        expected['number_sold'] += _align(sku_ids, [(row[0], row[2]) for row in rows])
+        expected['number_delivered'] += _align(sku_ids, [(row[0], row[3]) for row in rows])
+
+    expected['stock'] = stored['quantity'] - reserved - held
+    stored['stock'] = stock
+
+    fields = COUNTERS + ('stock',)
+    drifting = np.zeros(len(sku_ids), dtype=bool)
+    for name in fields:
+        drifting |= stored[name] != expected[name]
+
+    in_flight = _in_flight_skus()
+
+    drift = []
+    for position in np.flatnonzero(drifting):
+        sku_id = int(sku_ids[position])
+        drift.append({
+            "sku_id": sku_id,
+            "in_flight": sku_id in in_flight,
+            **{name: {"stored": int(stored[name][position]),
+                      "expected": int(expected[name][position])}
+               for name in fields
+               if stored[name][position] != expected[name][position]}
+        })
+
+    return drift
+
+
+def _repair(drift: list, batch_size: int) -> int:
+    """Set drifting sku counters to their expected value, returns the number
+    of counters repaired"""
+    sku_table = Sku.__table__
+    repaired = 0
+
+    for name in COUNTERS:
+        rows = [{"row_id": row["sku_id"],
+                 "stored": row[name]["stored"],
+                 "expected": row[name]["expected"]}
+                for row in drift if name in row and not row["in_flight"]]
+
+        statement = sku_table.update().where(
+            sku_table.c.id == bindparam('row_id'),
+            sku_table.c[name] == bindparam('stored')).values(
+            {name: bindparam('expected')})
+
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            result = db.session.execute(statement, batch)
+
+            touch_skus(row["row_id"] for row in batch)
+            refresh_touched_campaigns(commit=False)
+            db.session.commit()
+
+            repaired += result.rowcount
+            job_heartbeat()
+
+    return repaired
+
+
+def reconcile_inventory(repair: bool = None, batch_size: int = None) -> dict:
+    """Report inventory drift and optionally repair the sku counters"""
+    config = current_app.config
+    repair = config.get("INVENTORY_RECONCILE_REPAIR") if repair is None else repair
+    batch_size = batch_size or config.get("INVENTORY_RECONCILE_BATCH_SIZE")
+
+    drift = inventory_drift()
+    db.session.commit()
+
+    for row in drift:
+        logger.warning("Inventory drift of sku {}: {}".format(row["sku_id"], {
+            name: value for name, value in row.items()
+            if name not in ("sku_id", "in_flight")}))
+
+    repaired = _repair(drift, batch_size) if repair and drift else 0
+
+    if drift:
+        logger.info("Found {} drifting sku(s), repaired {} counter(s)".format(
+            len(drift), repaired))
+
+    return {"drift": drift, "repaired": repaired}
@@ -0,0 +1,73 @@
+"""Job lease renewal.
+
+The worker of project/api/worker.py runs a job after taking its lease for
+WORKER_LEASE_SECONDS. A job that may run longer calls job_heartbeat() after
+committing each batch: every third of the lease the lease is extended by
+another WORKER_LEASE_SECONDS, as long as this worker still owns it. If another
+node took the job over meanwhile, LeaseLost is raised and the job stops
+before its next batch instead of running twice.
+
+Outside of a worker job, e.g. from `manage.py archive-data`, job_heartbeat()
+does nothing.
+"""
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from project import db
+from project.models import JobLock
+
+_state = threading.local()
+
+
+class LeaseLost(Exception):
+    """Another worker took over the lease of the running job"""
+
+
+class Lease:
+    """Lease of a job held by a worker"""
+
+    def __init__(self, name: str, owner: str, seconds: int):
+        self.name = name
+        self.owner = owner
+        self.seconds = seconds
+        self.renewed_at = time.monotonic()
+
+    def renew(self, force: bool = False):
+        """Extend the lease if a third of it went by, committed. Raises
+        LeaseLost if the lease is no longer owned"""
+        if not force and time.monotonic() - self.renewed_at < self.seconds / 3:
+            return
+
+        result = db.session.execute(JobLock.__table__.update().where(
+            JobLock.name == self.name,
+            JobLock.owner == self.owner,
+            JobLock.locked_until != None
+        ).values(
+            locked_until=datetime.utcnow() + timedelta(seconds=self.seconds)
+        ))
+        db.session.commit()
+
+        if result.rowcount != 1:
+            raise LeaseLost("Lease of job {} lost by {}".format(self.name, self.owner))
+
+        self.renewed_at = time.monotonic()
+
+
+@contextmanager
+def holding(lease: Lease):
+    """Make the lease the one renewed by job_heartbeat() on this thread"""
+    _state.lease = lease
+    try:
+        yield lease
+    finally:
+        _state.lease = None
+
+
+def job_heartbeat():
+    """Renew the lease of the job running on this thread, call it between
+    batches, after a commit. Raises LeaseLost"""
+    lease = getattr(_state, "lease", None)
+    if lease is not None:
+        lease.renew()
@@ -1,12 +1,22 @@
 import os
 import logging
 from datetime import datetime
+from collections import Counter
 
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, current_app, jsonify, request
+from sqlalchemy import bindparam, func
+from sqlalchemy.exc import SQLAlchemyError
 
 from project import db
-from project.api.utils import refresh_campaigns
+from project.api.utils import refresh_touched_campaigns, touch_skus
+from project.api.archive import include_archived
 from project.api.authentications import authenticate
+from project.api.coupon_codes import generate_codes
+from project.api.idempotency import idempotent
+from project.api.inventory import record_stock, record_stock_changes
+from project.api.outbox import enqueue, outbox_handler
+from project.api.tickets import drop_ticket_index
+from project.exceptions import APIError
 from project.api.validators import field_type_validator, required_validator
 
 from project.models import (
@@ -19,8 +29,12 @@ from project.models import (
     Campaign,
     Coupon,
     Order,
-    Order_Sku
+    Order_Sku,
+    OrderArchive,
+    Order_SkuArchive,
+    CouponArchive
 )
+from project.models.archive_model import preload_archived
 
 order_blueprint = Blueprint('order', __name__, template_folder='templates')
 
@@ -29,6 +43,17 @@ logger = logging.getLogger(__name__)
 ORDER_STATUS_LIST = ['pending', 'paid', 'shipped',
                      'delivered', 'cancelled', 'returned']
 
+# status an order must have to be moved to a status
+ORDER_STATUS_TRANSITIONS = {
+    'paid': 'pending',
+    'shipped': 'paid',
+    'delivered': 'shipped',
+    'cancelled': 'pending',
+    'returned': 'delivered'
+}
+
+ORDER_RETURN_DAYS = 7
+
 
 @order_blueprint.route('/order/ping', methods=['GET'])
 def ping_pong():
@@ -38,8 +63,211 @@ def ping_pong():
     })
 
 
+def create_order_from_cart(user_id: int, shopping_cart: ShoppingCart,
+                           shipping_fee: float, location_id: int = None) -> Order:
+    """Create an order from a checked out cart, flushed but not committed.
+
+    Raises APIError when the cart or location is invalid."""
+    if not shopping_cart:
+        raise APIError('Cart does not exist')
+
+    if shopping_cart.user_id != user_id:
+        raise APIError('Cart does not belong to user')
+
+    # lock the items, then the cart, in the order of the cart_reaper job so
+    # that a cart is either reaped or ordered, and read them again after
+    # the lock
+    cart_items = CartItem.query.filter_by(
+        cart_id=shopping_cart.id).populate_existing().with_for_update().all()
+    shopping_cart = ShoppingCart.query.filter_by(
+        id=shopping_cart.id).populate_existing().with_for_update().one()
+
+    if not shopping_cart.is_active:
+        raise APIError('Cart is no longer active, please add item(s) to cart')
+
+    if not shopping_cart.checkedout_at:
+        raise APIError('Cart is not checked out yet')
+
+    if location_id:
+        location = Location.query.get(location_id)
+
+    else:
+        location = Location.query.filter_by(user_id=user_id).first()
+
+    if not location:
+        raise APIError('Location not found, please add one')
+
+    # the items of an abandoned cart are released by the cart_reaper job
+    if not cart_items:
+        raise APIError('Cart is empty, please add item(s) to cart')
+
+    order = Order(
+        user_id=user_id,
+        location_id=location.id,
+        total_quantity=0,
+        total_tax=0,
+        total_amount=0,
+        shipping_fee=shipping_fee,
+        booking_date=datetime.utcnow()
+    )
+    db.session.add(order)
+
+    campaigns = {campaign.id: campaign for campaign in Campaign.query.filter(
+        Campaign.id.in_({cart_item.campaign_id for cart_item in cart_items}))}
+    skus = {sku.id: sku for sku in Sku.query.filter(
+        Sku.id.in_({campaign.sku_id for campaign in campaigns.values()}))}
+
+    db.session.flush()
+
+    for cart_item in cart_items:
+        sku = skus[campaigns[cart_item.campaign_id].sku_id]
+
+        # create order item, its coupon is issued by the order_created event
+        order_sku = Order_Sku(
+            order_id=order.id,
+            quantity=cart_item.quantity,
+            total_price=sku.price * cart_item.quantity,
+            sales_tax=sku.sales_tax,
+            coupon_id=None,
+            campaign_id=cart_item.campaign_id,
+            sku_images_id=cart_item.sku_images_id,
+            sku_stock_id=cart_item.sku_stock_id,
+        )
+        db.session.add(order_sku)
+
+        # update order
+        order.total_quantity += order_sku.quantity
+        order.total_amount += order_sku.total_price
+        order.total_tax += order_sku.sales_tax
+
+    # the reservations become sales
+    record_stock_changes(
+        [(cart_item.sku_stock_id, cart_item.quantity, 'release', cart_item.id)
+         for cart_item in cart_items] +
+        [(cart_item.sku_stock_id, -cart_item.quantity, 'sale', order.id)
+         for cart_item in cart_items])
+
+    # update cart
+    shopping_cart.is_active = False
+
+    enqueue('order_created', {'order_id': order.id})
+    db.session.flush()
+
+    return order
+
+
+def order_pending(order_id: int) -> bool:
+    """Whether the order_created event of an order is not processed yet"""
+    return db.session.query(Order_Sku.id).filter(
+        Order_Sku.order_id == order_id, Order_Sku.coupon_id == None).first() is not None
+
+
+@outbox_handler('order_created')
+def issue_order_coupons(payload: dict):
+    """Issue the coupons of a new order and count its skus as sold"""
+    order = Order.query.get(payload['order_id'])
+    if not order:
+        return
+
+    # only items without a coupon, the event may be delivered again
+    order_skus = Order_Sku.query.filter_by(
+        order_id=order.id, coupon_id=None).all()
+    if not order_skus:
+        return
+
+    campaigns = {campaign.id: campaign for campaign in Campaign.query.filter(
+        Campaign.id.in_({order_sku.campaign_id for order_sku in order_skus}))}
+
+    coupons = [Coupon(
+        user_id=order.user_id,
+        campaign_id=order_sku.campaign_id,
+        sku_images_id=order_sku.sku_images_id,
+        sku_stock_id=order_sku.sku_stock_id,
+        create_date=order.booking_date,
+        amount_paid=order_sku.total_price,
+        code=code,
+    ) for order_sku, code in zip(order_skus, generate_codes(len(order_skus)))]
+
+    db.session.add_all(coupons)
+    db.session.flush()
+
+    sold = Counter()
+    for order_sku, coupon in zip(order_skus, coupons):
+        order_sku.coupon_id = coupon.id
+        sold[campaigns[order_sku.campaign_id].sku_id] += order_sku.quantity
+
+    # update skus in the database, concurrent orders may sell the same sku
+    for sku in Sku.query.filter(Sku.id.in_(sold.keys())):
+        sku.number_sold = Sku.number_sold + sold[sku.id]
+
+    db.session.flush()
+    refresh_touched_campaigns(commit=False)
+
+
+def adjust_order_stock(order_ids: list, status: str):
+    """Update stock and sku counters of orders moved to a status, with one
+    ledger entry per sku stock and one UPDATE row per sku. Not committed."""
+    rows = db.session.query(
+        Order_Sku.sku_stock_id, Sku_Stock.sku_id, func.sum(Order_Sku.quantity)).join(
+        Sku_Stock, Sku_Stock.id == Order_Sku.sku_stock_id).filter(
+        Order_Sku.order_id.in_(order_ids)).group_by(
+        Order_Sku.sku_stock_id, Sku_Stock.sku_id).all()
+
+    if not rows:
+        return
+
+    sku_quantities = Counter()
+    for _, sku_id, quantity in rows:
+        sku_quantities[sku_id] += int(quantity)
+
+    sku_table = Sku.__table__
+
+    if status in ('cancelled', 'returned'):
+        # put the items back in stock
+        record_stock_changes([
+            (sku_stock_id, int(quantity), 'return', None)
+            for sku_stock_id, _, quantity in rows])
+
+    values = {}
+    if status in ('cancelled', 'returned'):
+        values['number_sold'] = sku_table.c.number_sold - bindparam('delta')
+
+    if status == 'delivered':
+        values['number_delivered'] = sku_table.c.number_delivered + bindparam('delta')
+
+    if status == 'returned':
+        values['number_delivered'] = sku_table.c.number_delivered - bindparam('delta')
+
+    if values:
+        db.session.execute(sku_table.update().where(
+            sku_table.c.id == bindparam('row_id')).values(values), [
+            {'row_id': sku_id, 'delta': quantity}
+            for sku_id, quantity in sku_quantities.items()])
+
+        touch_skus(sku_quantities.keys())
+
+
+@outbox_handler('order_status_changed')
+def apply_order_status(payload: dict):
+    """Update stock and sku counters of orders after a status change"""
+    order_ids = payload.get('order_ids') or [payload['order_id']]
+    status = payload['status']
+
+    pending = db.session.query(Order_Sku.order_id).filter(
+        Order_Sku.order_id.in_(order_ids), Order_Sku.coupon_id == None).first()
+    if pending:
+        # retried after the order_created event
+        raise APIError('Order {} is not issued yet'.format(pending[0]))
+
+    adjust_order_stock(order_ids, status)
+
+    # one refresh for the campaigns of every sku changed
+    refresh_touched_campaigns(commit=False)
+
+
 @order_blueprint.route('/order/create', methods=['POST'])
 @authenticate
+@idempotent
 def create_order(user_id):
     """Create order"""
     response_object = {
@@ -57,93 +285,14 @@ def create_order(user_id):
         post_data = field_type_validator(post_data, field_types)
         required_validator(post_data, required_fields)
 
-        shipping_fee = post_data.get('shipping_fee')
-        location_id = post_data.get('location_id')
-
         shopping_cart = ShoppingCart.query.filter_by(
             user_id=user_id, is_active=True).first()
 
-        if not shopping_cart:
-            response_object['message'] = 'Cart does not exist'
-            return jsonify(response_object), 200
-
-        if shopping_cart.user_id != user_id:
-            response_object['message'] = 'Cart does not belong to user'
-            return jsonify(response_object), 200
-
-        if not shopping_cart.checkedout_at:
-            response_object['message'] = 'Cart is not checked out yet'
-            return jsonify(response_object), 200
-
-        if location_id:
-            location = Location.query.get(location_id)
-
-        else:
-            location = Location.query.filter_by(user_id=user_id).first()
+        order = create_order_from_cart(
+            user_id, shopping_cart, post_data.get('shipping_fee'),
+            post_data.get('location_id'))
 
-        if not location:
-            response_object['message'] = 'Location not found, please add one'
-            return jsonify(response_object), 200
-
-        order = Order(
-            user_id=user_id,
-            location_id=location.id,
-            total_quantity=0,
-            total_tax=0,
-            total_amount=0,
-            shipping_fee=shipping_fee,
-            booking_date=datetime.utcnow()
-        )
-
-        order.insert()
-
-        cart_items = CartItem.query.filter_by(cart_id=shopping_cart.id).all()
-        for cart_item in cart_items:
-            campaign = Campaign.query.get(cart_item.campaign_id)
-            sku = Sku.query.get(campaign.sku_id)
-
-            # create coupon
-            coupon = Coupon(
-                user_id=user_id,
-                campaign_id=campaign.id,
-                sku_images_id=cart_item.sku_images_id,
-                sku_stock_id=cart_item.sku_stock_id,
-                create_date=datetime.utcnow(),
-                amount_paid=(sku.price * cart_item.quantity),
-            )
-
-            coupon.insert()
-
-            # create order item
-            order_sku = Order_Sku(
-                order_id=order.id,
-                quantity=cart_item.quantity,
-                total_price=sku.price * cart_item.quantity,
-                sales_tax=sku.sales_tax,
-                coupon_id=coupon.id,
-                campaign_id=cart_item.campaign_id,
-                sku_images_id=cart_item.sku_images_id,
-                sku_stock_id=cart_item.sku_stock_id,
-            )
-
-            order_sku.insert()
-
-            # update sku
-            # sku.quantity -= order_sku.quantity
-            sku.number_sold += order_sku.quantity
-            sku.update()
-
-            # update order
-            order.total_quantity += order_sku.quantity
-            order.total_amount += order_sku.total_price
-            order.total_tax += order_sku.sales_tax
-            order.update()
-
-        # update cart
-        shopping_cart.is_active = False
-        shopping_cart.update()
-
-        refresh_campaigns()
+        db.session.commit()
 
         response_object['status'] = True
         response_object['message'] = 'Order created successfully'
@@ -190,6 +339,10 @@ def update_order(user_id, order_id):
             response_object['message'] = 'Order does not belong to user'
             return jsonify(response_object), 200
 
+        if order_pending(order.id):
+            response_object['message'] = 'Order is still being processed, please try again'
+            return jsonify(response_object), 200
+
         if location_id:
             location = Location.query.get(location_id)
 
@@ -210,7 +363,8 @@ def update_order(user_id, order_id):
                 response_object['message'] = 'Order sku not found'
                 return jsonify(response_object), 200
 
-            sku_stock = Sku_Stock.query.get(order_sku.sku_stock_id)
+            sku_stock = Sku_Stock.query.options(
+                db.undefer(Sku_Stock.stock_level)).get(order_sku.sku_stock_id)
             if not sku_stock:
                 response_object['message'] = 'Sku stock not found'
                 return jsonify(response_object), 200
@@ -221,8 +375,8 @@ def update_order(user_id, order_id):
                 return jsonify(response_object), 200
 
             if quantity < order_sku.quantity:
-                sku_stock.stock += order_sku.quantity - quantity
-                sku_stock.update()
+                record_stock(sku_stock.id, order_sku.quantity - quantity,
+                             'return', order.id)
 
                 sku.number_sold -= order_sku.quantity - quantity
                 sku.update()
@@ -234,12 +388,12 @@ def update_order(user_id, order_id):
                     (order_sku.quantity - quantity)
 
             elif quantity > order_sku.quantity:
-                if (quantity - order_sku.quantity) > sku_stock.stock:
+                if (quantity - order_sku.quantity) > sku_stock.stock_level:
                     response_object['message'] = 'Not enough stock'
                     return jsonify(response_object), 200
 
-                sku_stock.stock -= quantity - order_sku.quantity
-                sku_stock.update()
+                record_stock(sku_stock.id, order_sku.quantity - quantity,
+                             'sale', order.id)
 
                 sku.number_sold += quantity - order_sku.quantity
                 sku.update()
@@ -257,7 +411,9 @@ def update_order(user_id, order_id):
                 ).first()
 
                 order_sku.delete()
-                coupon.delete()
+                if coupon:
+                    drop_ticket_index(coupon.campaign_id)
+                    coupon.delete()
 
             else:
                 order_sku.quantity = quantity
@@ -269,7 +425,7 @@ def update_order(user_id, order_id):
         order.location_id = location_id or order.location_id
         order.update()
 
-        refresh_campaigns()
+        refresh_touched_campaigns()
 
         response_object['status'] = True
         response_object['message'] = 'Order updated successfully'
@@ -307,17 +463,21 @@ def delete_order(user_id, order_id):
             response_object['message'] = "You don't have permission to delete this order"
             return jsonify(response_object), 200
 
+        if order_pending(order.id):
+            response_object['message'] = 'Order is still being processed, please try again'
+            return jsonify(response_object), 200
+
         # delete order items
         order_items = Order_Sku.query.filter_by(order_id=order.id).all()
         for order_item in order_items:
-            # delete coupon
+            # delete coupon, the ticket index of its campaign is stale
             coupon = Coupon.query.get(order_item.coupon_id)
+            drop_ticket_index(coupon.campaign_id)
             coupon.delete()
 
             # update sku_stock
             sku_stock = Sku_Stock.query.get(order_item.sku_stock_id)
-            sku_stock.stock += order_item.quantity
-            sku_stock.update()
+            record_stock(sku_stock.id, order_item.quantity, 'return', order.id)
 
             # update sku
             sku = Sku.query.get(sku_stock.sku_id)
@@ -345,8 +505,10 @@ def delete_order(user_id, order_id):
 
 
 @order_blueprint.route('/order/status/<int:order_id>', methods=['GET', 'PUT'])
-def order_status(order_id):
-    """Get or update order status"""
+@authenticate
+def order_status(user_id, order_id):
+    """Get or update order status, users may only cancel or return their
+    own orders"""
     response_object = {
         'status': False,
         'message': 'Invalid payload.'
@@ -357,6 +519,11 @@ def order_status(order_id):
         response_object['message'] = 'Order does not exist'
         return jsonify(response_object), 200
 
+    user = User.query.get(user_id)
+    if order.user_id != int(user_id) and not user.is_admin:
+        response_object['message'] = "You don't have permission to access this order"
+        return jsonify(response_object), 200
+
     """Get order status"""
     if request.method == 'GET':
         response_object['status'] = True
@@ -383,6 +550,11 @@ def order_status(order_id):
 
     status = str(status).lower()
 
+    if status not in ('cancelled', 'returned') and not user.is_admin:
+        response_object['message'] = "You don't have permission to change this order to {}".format(
+            status)
+        return jsonify(response_object), 200
+
     response_object['message'] = 'Invalid status change from {} to {}'.format(
         order.status, status)
 
@@ -399,57 +571,26 @@ def order_status(order_id):
     if status == 'cancelled' and order.status != 'pending':
         return jsonify(response_object), 200
 
-    if status in 'returned' and order.status != 'delivered':
+    if status == 'returned' and order.status != 'delivered':
         return jsonify(response_object), 200
 
-    if status == 'cancelled':
-        for order_sku in Order_Sku.query.filter_by(order_id=order_id).all():
-            # update sku_stock
-            sku_stock = Sku_Stock.query.get(order_sku.sku_stock_id)
-            sku_stock.stock += order_sku.quantity
-            sku_stock.update()
-
-            # update sku number_sold
-            sku = Sku.query.get(sku_stock.sku_id)
-            sku.number_sold -= order_sku.quantity
-            sku.update()
-
     if status == 'delivered':
         # update booking_date
-        order.booking_date = datetime.now()
-
-        for order_sku in Order_Sku.query.filter_by(order_id=order_id).all():
-            sku_stock = Sku_Stock.query.get(order_sku.sku_stock_id)
-
-            # update sku number_delivered
-            sku = Sku.query.get(sku_stock.sku_id)
-            sku.number_delivered += order_sku.quantity
-            sku.update()
-
-            refresh_campaigns()
+        order.booking_date = datetime.utcnow()
 
     if status == 'returned':
-        # return within 7 days
-        if (datetime.now() - order.booking_date).days > 7:
-            response_object['message'] = 'Order cannot be returned after 7 days'
+        # return within ORDER_RETURN_DAYS
+        if (datetime.utcnow() - order.booking_date).days > ORDER_RETURN_DAYS:
+            response_object['message'] = 'Order cannot be returned after {} days'.format(
+                ORDER_RETURN_DAYS)
             return jsonify(response_object), 200
 
-        for order_sku in Order_Sku.query.filter_by(order_id=order_id).all():
-            # update sku_stock
-            sku_stock = Sku_Stock.query.get(order_sku.sku_stock_id)
-            sku_stock.stock += order_sku.quantity
-            sku_stock.update()
-
-            # update sku number_sold
-            sku = Sku.query.get(sku_stock.sku_id)
-            sku.number_sold -= order_sku.quantity
-            sku.number_delivered -= order_sku.quantity
-            sku.update()
+    order.status = status
 
-            refresh_campaigns()
+    if status in ('cancelled', 'delivered', 'returned'):
+        enqueue('order_status_changed', {'order_id': order.id, 'status': status})
 
-    order.status = status
-    order.update()
+    db.session.commit()
 
     response_object['status'] = True
     response_object['message'] = 'Order status updated successfully'
@@ -460,6 +601,105 @@ def order_status(order_id):
     return jsonify(response_object), 200
 
 
+@order_blueprint.route('/order/status', methods=['PUT'])
+@authenticate
+def bulk_order_status(user_id):
+    """Move a list of orders to a status, all or none of them"""
+    response_object = {
+        'status': False,
+        'message': 'Invalid payload.'
+    }
+
+    user = User.query.get(user_id)
+    if not user or not user.is_admin:
+        response_object['message'] = 'Unauthorized'
+        return jsonify(response_object), 200
+
+    try:
+        post_data = request.get_json()
+        field_types = {'order_ids': list, 'status': str}
+
+        required_fields = list(field_types.keys())
+
+        post_data = field_type_validator(post_data, field_types)
+        required_validator(post_data, required_fields)
+
+        order_ids = post_data.get('order_ids')
+        status = post_data.get('status').lower()
+
+        if not all(type(order_id) == int for order_id in order_ids):
+            raise APIError('order_ids should be a list of integer values')
+
+        order_ids = list(set(order_ids))
+
+        if len(order_ids) > current_app.config.get("ORDER_STATUS_BATCH_LIMIT"):
+            raise APIError('At most {} orders can be updated at once'.format(
+                current_app.config.get("ORDER_STATUS_BATCH_LIMIT")))
+
+        if status not in ORDER_STATUS_TRANSITIONS:
+            raise APIError('Invalid status {}'.format(status))
+
+        # validate every transition with one query
+        orders = db.session.query(Order.id, Order.status, Order.booking_date).filter(
+            Order.id.in_(order_ids)).all()
+
+        missing = set(order_ids) - {order.id for order in orders}
+        if missing:
+            raise APIError('Order(s) {} do not exist'.format(sorted(missing)))
+
+        invalid = sorted(order.id for order in orders
+                         if order.status != ORDER_STATUS_TRANSITIONS[status])
+        if invalid:
+            raise APIError('Invalid status change to {} for order(s) {}'.format(
+                status, invalid))
+
+        if status == 'returned':
+            expired = sorted(order.id for order in orders if (
+                datetime.utcnow() - order.booking_date).days > ORDER_RETURN_DAYS)
+            if expired:
+                raise APIError('Order(s) {} cannot be returned after {} days'.format(
+                    expired, ORDER_RETURN_DAYS))
+
+        values = {'status': status}
+        if status == 'delivered':
+            values['booking_date'] = datetime.utcnow()
+
+        # orders changed meanwhile no longer match
+        result = db.session.execute(Order.__table__.update().where(
+            Order.id.in_(order_ids),
+            Order.status == ORDER_STATUS_TRANSITIONS[status]).values(values))
+
+        if result.rowcount != len(order_ids):
+            db.session.rollback()
+            raise APIError('Orders were changed meanwhile, please try again')
+
+        if status in ('cancelled', 'delivered', 'returned'):
+            enqueue('order_status_changed', {'order_ids': order_ids, 'status': status})
+
+        db.session.commit()
+
+        response_object['status'] = True
+        response_object['message'] = '{} order(s) updated successfully'.format(
+            len(order_ids))
+        response_object['data'] = {
+            'order_ids': sorted(order_ids),
+            'status': status
+        }
+
+        return jsonify(response_object), 200
+
+    except APIError as e:
+        db.session.rollback()
+        response_object['message'] = str(e)
+        return jsonify(response_object), 200
+
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(e)
+        response_object['message'] = 'Orders could not be updated, please try again'
+        return jsonify(response_object), 200
+
+
 @order_blueprint.route('/order/get/<int:order_id>', methods=['GET'])
 @authenticate
 def get_order(user_id, order_id):
@@ -471,6 +711,12 @@ def get_order(user_id, order_id):
     }
 
     order = Order.query.get(order_id)
+    order_sku_model = Order_Sku
+
+    if not order and include_archived():
+        order = OrderArchive.query.get(order_id)
+        order_sku_model = Order_SkuArchive
+
     if not order:
         return jsonify(response_object), 200
 
@@ -479,13 +725,20 @@ def get_order(user_id, order_id):
         response_object['message'] = 'Order does not belong to user'
         return jsonify(response_object), 200
 
-    order_skus = Order_Sku.query.filter_by(order_id=order_id).all()
+    order_skus = order_sku_model.query.filter_by(order_id=order_id).all()
+
+    if order_sku_model is Order_SkuArchive:
+        # the campaigns, stocks, images and coupons of all items at once
+        preloaded = preload_archived(order_skus)
+        order_skus = [order_sku.to_json(preloaded) for order_sku in order_skus]
+    else:
+        order_skus = [order_sku.to_json() for order_sku in order_skus]
 
     response_object['status'] = True
     response_object['message'] = 'Order retrieved successfully'
     response_object['data'] = {
         'order': order.to_json(),
-        'order_skus': [order_sku.to_json() for order_sku in order_skus]
+        'order_skus': order_skus
     }
 
     return jsonify(response_object), 200
@@ -515,6 +768,13 @@ def get_orders(user_id):
     else:
         orders = Order.query.filter_by(user_id=user_id).all()
 
+    if include_archived():
+        archived_orders = OrderArchive.query.filter_by(user_id=user_id)
+        if status:
+            archived_orders = archived_orders.filter_by(status=status)
+
+        orders += archived_orders.all()
+
     response_object['status'] = True
     response_object['message'] = '{} order(s) found of {} status'.format(
         len(orders), status if status else 'any')
@@ -540,14 +800,28 @@ def list_orders():
         logger.info('status: {}'.format(status))
         orders = Order.query.filter_by(status=status).all()
 
+        if include_archived():
+            orders += OrderArchive.query.filter_by(status=status).all()
+
     else:
         orders = Order.query.all()
 
+        if include_archived():
+            orders += OrderArchive.query.all()
+
+    # the users and locations of all orders with two queries
+    users = {user.id: user for user in User.query.filter(
+        User.id.in_({order.user_id for order in orders}))}
+    locations = {location.id: location for location in Location.query.filter(
+        Location.id.in_({order.location_id for order in orders}))}
+
     response_object['status'] = True
     response_object['message'] = '{} order(s) found of {} status'.format(
         len(orders), status if status else 'any')
     response_object['data'] = {
-        'orders': [order.to_json() for order in orders]
+        'orders': [order.to_json(users.get(order.user_id),
+                                 locations.get(order.location_id))
+                   for order in orders]
     }
 
     return jsonify(response_object), 200
@@ -557,13 +831,19 @@ def list_orders():
 @authenticate
 def get_coupon(user_id):
     """Get coupon"""
-    coupons = Coupon.query.filter_by(user_id=int(user_id)).all()
+    coupons = [coupon.to_json() for coupon in Coupon.query.filter_by(
+        user_id=int(user_id)).all()]
+
+    if include_archived():
+        archived = CouponArchive.query.filter_by(user_id=int(user_id)).all()
+        preloaded = preload_archived(archived)
+        coupons += [coupon.to_json(preloaded) for coupon in archived]
 
     response_object = {
         'status': True,
         'message': '{} coupon(s) found'.format(len(coupons)),
         'data': {
-            'coupon': [coupon.to_json() for coupon in coupons]
+            'coupon': coupons
         }
     }
 
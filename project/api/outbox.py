@@ -0,0 +1,103 @@
+"""Transactional outbox.
+
+Endpoints write their state and enqueue() the follow-up work as an
+outbox_event row in the same transaction, so an event exists exactly when
+the change that caused it was committed. The worker dispatches pending
+events in id order, in batches of OUTBOX_BATCH_SIZE. Each event is claimed
+with a conditional UPDATE and its handler runs in the claiming transaction,
+so the database effects of a handler are applied once. A failed handler is
+retried with backoff and the event is marked failed after
+OUTBOX_MAX_ATTEMPTS. Handlers must be idempotent, delivery is at least once
+for anything outside the database.
+"""
+import json
+import logging
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func
+
+from project import db
+from project.models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_HANDLERS = {}
+
+
+def outbox_handler(event_type: str):
+    def decorator(func):
+        OUTBOX_HANDLERS[event_type] = func
+        return func
+
+    return decorator
+
+
+def enqueue(event_type: str, payload: dict) -> OutboxEvent:
+    """Add an event to the current transaction, not committed"""
+    event = OutboxEvent(event_type, payload)
+    db.session.add(event)
+    return event
+
+
+def pending_events() -> int:
+    return db.session.query(func.count(OutboxEvent.id)).filter(
+        OutboxEvent.status == 'pending').scalar()
+
+
+def dispatch_outbox() -> int:
+    """Process a batch of pending events, returns the number processed"""
+    config = current_app.config
+    now = datetime.utcnow()
+
+    events = db.session.query(
+        OutboxEvent.id, OutboxEvent.event_type, OutboxEvent.payload,
+        OutboxEvent.attempts).filter(
+        OutboxEvent.status == 'pending',
+        OutboxEvent.available_at <= now).order_by(
+        OutboxEvent.id).limit(config.get("OUTBOX_BATCH_SIZE")).all()
+    db.session.commit()
+
+    processed = 0
+    for event_id, event_type, payload, attempts in events:
+        # claim the event, processed by another worker otherwise
+        result = db.session.execute(OutboxEvent.__table__.update().where(
+            OutboxEvent.id == event_id,
+            OutboxEvent.status == 'pending'
+        ).values(status='done', processed_at=datetime.utcnow(),
+                 attempts=attempts + 1))
+        if not result.rowcount:
+            db.session.rollback()
+            continue
+
+        try:
+            OUTBOX_HANDLERS[event_type](json.loads(payload))
+            db.session.commit()
+            processed += 1
+
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Outbox event {} {} failed: {}".format(event_id, event_type, e))
+
+            failed = attempts + 1 >= config.get("OUTBOX_MAX_ATTEMPTS")
+            db.session.execute(OutboxEvent.__table__.update().where(
+                OutboxEvent.id == event_id).values(
+                status='failed' if failed else 'pending',
+                attempts=attempts + 1,
+                last_error=str(e),
+                available_at=datetime.utcnow() + timedelta(seconds=2 ** attempts)))
+            db.session.commit()
+
+    return processed
+
+
+def purge_outbox() -> int:
+    """Delete events processed before the retention window"""
+    cutoff = datetime.utcnow() - timedelta(
+        days=current_app.config.get("OUTBOX_RETENTION_DAYS"))
+
+    result = db.session.execute(OutboxEvent.__table__.delete().where(
+        OutboxEvent.status == 'done', OutboxEvent.processed_at < cutoff))
+    db.session.commit()
+
+    return result.rowcount
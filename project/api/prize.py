@@ -1,6 +1,11 @@
 from datetime import datetime
 from flask import Blueprint, jsonify, request
+from sqlalchemy import and_, or_
 
+from project import db
+from project.api.archive import include_archived
+from project.api.coupon_codes import is_valid_code
+from project.api.tickets import ticket_odds
 from project.api.authentications import authenticate
 from project.exceptions import APIError
 from project.api.validators import field_type_validator, required_validator
@@ -8,6 +13,7 @@ from project.api.validators import field_type_validator, required_validator
 from project.models.sku_model import Campaign, Coupon, Prize
 from project.models.draw_model import Draw
 from project.models.user_model import User
+from project.models.archive_model import CouponArchive, preload_archived
 
 prize_blueprint = Blueprint('prize', __name__, template_folder='templates')
 
@@ -214,21 +220,83 @@ def get_past_draws():
     return jsonify(response_object), 200
 
 
+def _load_coupons(model, coupon_ids: set, user_ids: set) -> dict:
+    """Coupons by id and the first coupon of each user, one query each"""
+    by_id = {coupon.id: coupon for coupon in model.query.filter(
+        model.id.in_(coupon_ids))} if coupon_ids else {}
+
+    first_ids = db.session.query(db.func.min(model.id)).filter(
+        model.user_id.in_(user_ids)).group_by(model.user_id)
+    by_user = {coupon.user_id: coupon for coupon in model.query.filter(
+        model.id.in_(first_ids))} if user_ids else {}
+
+    return {'ids': by_id, 'users': by_user}
+
+
 @prize_blueprint.route('/prize/winners', methods=['GET'])
 def get_winners():
     """Get all winners"""
     draws = Draw.query.filter(Draw.winner_id != None).all()
-    draws = [draw.to_json() for draw in draws]
 
+    # the winning coupons of all draws at once, draws recorded without their
+    # coupon show the first coupon of the winner
+    coupon_ids = {draw.winner_coupon_id for draw in draws if draw.winner_coupon_id}
+    user_ids = {draw.winner_id for draw in draws if not draw.winner_coupon_id}
+
+    coupons = _load_coupons(Coupon, coupon_ids, user_ids)
+    archived = _load_coupons(CouponArchive, coupon_ids - coupons['ids'].keys(),
+                             user_ids - coupons['users'].keys()) \
+        if include_archived() else {'ids': {}, 'users': {}}
+
+    archived_coupons = list(archived['ids'].values()) + list(archived['users'].values())
+    preloaded = preload_archived(archived_coupons) if archived_coupons else None
+
+    winners = []
     for draw in draws:
-        draw['coupon'] = Coupon.query.filter_by(
-            user_id=draw['winner']['id']).first().to_json()
+        if draw.winner_coupon_id:
+            coupon = coupons['ids'].get(draw.winner_coupon_id) or \
+                archived['ids'].get(draw.winner_coupon_id)
+        else:
+            coupon = coupons['users'].get(draw.winner_id) or \
+                archived['users'].get(draw.winner_id)
+
+        winner = draw.to_json()
+        if not coupon:
+            winner['coupon'] = None
+        elif isinstance(coupon, CouponArchive):
+            winner['coupon'] = coupon.to_json(preloaded)
+        else:
+            winner['coupon'] = coupon.to_json()
+        winners.append(winner)
+
+    response_object = {
+        'status': True,
+        'message': '{} winner(s) found'.format(len(winners)),
+        'data': {
+            'winners': winners
+        }
+    }
+
+    return jsonify(response_object), 200
+
+
+@prize_blueprint.route('/prize/odds/<int:campaign_id>', methods=['GET'])
+@authenticate
+def get_odds(user_id, campaign_id):
+    """Get the tickets and winning odds of the user in a campaign"""
+    campaign = Campaign.query.get(campaign_id)
+    if not campaign:
+        response_object = {
+            'status': False,
+            'message': 'Campaign does not exist',
+        }
+        return jsonify(response_object), 200
 
     response_object = {
         'status': True,
-        'message': '{} winner(s) found'.format(len(draws)),
+        'message': 'Odds are returned successfully',
         'data': {
-            'winners': draws
+            'odds': ticket_odds(campaign_id, int(user_id))
         }
     }
 
@@ -247,26 +315,52 @@ def redeem_coupon(user_id):
     post_data = field_type_validator(post_data, field_types)
     required_validator(post_data, required_fields)
 
-    coupon = Coupon.query.filter(
-        Coupon.code == post_data.get('coupon_code'),
-        Coupon.user_id == int(user_id)
-    ).first()
+    code = post_data.get('coupon_code')
+    response_object = {
+        'status': False,
+        'message': 'Coupon does not exist',
+    }
 
-    if not coupon:
-        response_object = {
-            'status': False,
-            'message': 'Coupon does not exist',
-        }
+    # forged and mistyped codes are rejected without a query
+    if not is_valid_code(code):
         return jsonify(response_object), 200
 
-    if coupon.is_redeemed:
-        response_object = {
-            'status': False,
-            'message': 'Coupon is already redeemed',
-        }
+    # a winning coupon may have been archived before it was redeemed, so the
+    # archive is always tried once the live table has no match
+    tables = [Coupon, CouponArchive]
+
+    # redeem atomically, a concurrent request for the same coupon matches
+    # no row
+    for table in tables:
+        result = db.session.execute(table.__table__.update().where(
+            table.code == code,
+            table.user_id == int(user_id),
+            table.is_redeemed == False
+        ).values(is_redeemed=True))
+
+        if result.rowcount:
+            break
+
+    db.session.commit()
+
+    if not result.rowcount:
+        redeemed = any(db.session.query(table.id).filter(
+            table.code == code, table.user_id == int(user_id)).first()
+            for table in tables)
+
+        if redeemed:
+            response_object['message'] = 'Coupon is already redeemed'
         return jsonify(response_object), 200
 
-    draw = Draw.query.filter_by(winner_id=user_id).first()
+    coupon_id, campaign_id = db.session.query(table.id, table.campaign_id).filter(
+        table.code == code).one()
+
+    # draws picked before winning coupons were recorded only know the winner
+    draw = Draw.query.filter(or_(
+        Draw.winner_coupon_id == coupon_id,
+        and_(Draw.campaign_id == campaign_id,
+             Draw.winner_coupon_id == None,
+             Draw.winner_id == int(user_id)))).first()
 
     if draw:
         campaign = Campaign.query.get(draw.campaign_id)
@@ -285,7 +379,4 @@ def redeem_coupon(user_id):
             'message': "Sorry, Try your luck next time!"
         }
 
-    coupon.is_redeemed = True
-    coupon.update()
-
     return jsonify(response_object), 200
@@ -0,0 +1,106 @@
+"""Per-request SQL statement counter.
+
+Every statement executed while handling a request is counted and
+fingerprinted. Repeated fingerprints are reported as N+1 candidates and the
+total is checked against the route's query budget (QUERY_BUDGETS /
+QUERY_BUDGET_DEFAULT). Budget overruns are logged, or raised when the app is
+TESTING or QUERY_BUDGET_RAISE is set.
+"""
+import re
+import logging
+from functools import lru_cache
+from collections import Counter
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from project.exceptions import QueryBudgetError
+
+logger = logging.getLogger(__name__)
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_RE = re.compile(r"%\(\w+\)s|%s|:\w+|\?")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+_listening = False
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(statement: str) -> str:
+    """Normalize a SQL statement so that calls differing only by literal
+    values or IN-list length share the same fingerprint"""
+    statement = _STRING_RE.sub("?", statement)
+    statement = _PLACEHOLDER_RE.sub("?", statement)
+    statement = _NUMBER_RE.sub("?", statement)
+    statement = _IN_LIST_RE.sub("(...)", statement)
+    return _WHITESPACE_RE.sub(" ", statement).strip()
+
+
+def get_query_stats():
+    """Return the statement stats of the current request"""
+    if "_query_stats" not in g:
+        g._query_stats = {"count": 0, "fingerprints": Counter()}
+
+    return g._query_stats
+
+
+def query_budget(endpoint: str):
+    """Return the query budget of the given endpoint or None if unlimited"""
+    budgets = current_app.config.get("QUERY_BUDGETS") or {}
+    return budgets.get(endpoint, current_app.config.get("QUERY_BUDGET_DEFAULT"))
+
+
+def _raise_on_budget():
+    return bool(current_app.config.get("TESTING") or
+                current_app.config.get("QUERY_BUDGET_RAISE"))
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if not has_request_context():
+        return
+
+    stats = get_query_stats()
+    stats["count"] += 1
+    stats["fingerprints"][fingerprint(statement)] += 1
+
+    budget = query_budget(request.endpoint)
+    if budget is not None and stats["count"] > budget and _raise_on_budget():
+        raise QueryBudgetError("Query budget of {} exceeded by {} ({} queries)".format(
+            budget, request.endpoint, stats["count"]))
+
+
+def _after_request(response):
+    stats = g.get("_query_stats")
+    if not stats:
+        return response
+
+    threshold = current_app.config.get("N_PLUS_ONE_THRESHOLD")
+    if threshold:
+        for statement, count in stats["fingerprints"].items():
+            if count >= threshold:
+                logger.warning("Possible N+1 in {}: {} calls of {}".format(
+                    request.endpoint, count, statement))
+
+    budget = query_budget(request.endpoint)
+    if budget is not None and stats["count"] > budget:
+        logger.warning("Query budget of {} exceeded by {}: {} queries".format(
+            budget, request.endpoint, stats["count"]))
+
+    if current_app.debug or current_app.config.get("QUERY_COUNT_HEADER"):
+        response.headers["X-Query-Count"] = str(stats["count"])
+
+    return response
+
+
+def init_query_budget(app):
+    """Register the statement counter and the per-request report"""
+    global _listening
+
+    if not _listening:
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        _listening = True
+
+    app.after_request(_after_request)
@@ -0,0 +1,107 @@
+"""Cart reservation expiry.
+
+Checkout reserves the stock of the cart items until the order is created.
+The cart_reaper job releases the reservations of abandoned carts, e.g. when
+creating the order failed: items of active carts reserved longer ago than
+their campaign's cart_hold_minutes (or CART_HOLD_MINUTES) are found through
+the cart_item.reservation_date index, one range per distinct hold window,
+and removed in batches of CART_REAPER_BATCH_SIZE. The stock of each batch is
+released with one ledger entry per sku stock and the carts left without
+items are deactivated, so that their users can check out again. Items being
+changed by a request are skipped and picked up by the next run.
+"""
+import logging
+from datetime import datetime, timedelta
+from collections import Counter
+
+from flask import current_app
+
+from project import db
+from project.api.inventory import record_stock_changes
+from project.api.leases import job_heartbeat
+from project.models import Campaign, CartItem, ShoppingCart
+
+logger = logging.getLogger(__name__)
+
+
+def _hold_windows() -> list:
+    """Distinct hold windows of campaigns, None for the default one"""
+    return [minutes for (minutes,) in db.session.query(
+        Campaign.cart_hold_minutes).distinct()]
+
+
+def _release_batch(minutes, cutoff: datetime, batch_size: int) -> int:
+    """Remove a batch of expired items of campaigns holding items for the
+    given minutes, returns the number removed"""
+    hold = Campaign.cart_hold_minutes == minutes if minutes is not None \
+        else Campaign.cart_hold_minutes == None
+
+    items = db.session.query(
+        CartItem.id, CartItem.cart_id, CartItem.sku_stock_id, CartItem.quantity).join(
+        ShoppingCart, ShoppingCart.id == CartItem.cart_id).join(
+        Campaign, Campaign.id == CartItem.campaign_id).filter(
+        CartItem.reservation_date < cutoff,
+        ShoppingCart.is_active == True,
+        hold).order_by(CartItem.reservation_date).limit(batch_size).with_for_update(
+        skip_locked=True, of=CartItem).all()
+
+    if not items:
+        db.session.commit()
+        return 0
+
+    released = Counter()
+    for _, _, sku_stock_id, quantity in items:
+        released[sku_stock_id] += quantity
+
+    db.session.execute(CartItem.__table__.delete().where(
+        CartItem.id.in_([item[0] for item in items])))
+    record_stock_changes([(sku_stock_id, quantity, 'release', None)
+                          for sku_stock_id, quantity in released.items()])
+
+    # checked out carts would otherwise block the next checkout
+    remaining = db.session.query(CartItem.id).filter(
+        CartItem.cart_id == ShoppingCart.id).exists()
+    db.session.execute(ShoppingCart.__table__.update().where(
+        ShoppingCart.id.in_({item[1] for item in items}),
+        ShoppingCart.is_active == True,
+        ~remaining).values(is_active=False))
+    db.session.commit()
+
+    return len(items)
+
+
+def release_expired_reservations(batch_size: int = None) -> int:
+    """Release the stock of cart items held past their campaign's hold
+    window, returns the number of items removed"""
+    config = current_app.config
+    batch_size = batch_size or config.get("CART_REAPER_BATCH_SIZE")
+    now = datetime.utcnow()
+
+    removed = 0
+    for minutes in _hold_windows():
+        cutoff = now - timedelta(minutes=minutes if minutes is not None
+                                 else config.get("CART_HOLD_MINUTES"))
+
+        while True:
+            count = _release_batch(minutes, cutoff, batch_size)
+            removed += count
+            job_heartbeat()
+
+            if count < batch_size:
+                break
+
+    if removed:
+        logger.info("Released {} expired cart reservation(s)".format(removed))
+
+    return removed
+
+
+def expired_reservations() -> int:
+    """Cart items past the default hold window"""
+    cutoff = datetime.utcnow() - timedelta(
+        minutes=current_app.config.get("CART_HOLD_MINUTES"))
+
+    return db.session.query(CartItem.id).join(
+        ShoppingCart, ShoppingCart.id == CartItem.cart_id).filter(
+        CartItem.reservation_date < cutoff,
+        ShoppingCart.is_active == True).count()
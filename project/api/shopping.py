@@ -1,12 +1,26 @@
 import os
 import logging
-import requests
 from datetime import datetime
+from collections import Counter
 
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, current_app, jsonify, request
 
 from project import db
+from project.api.admission import (
+    admission_required,
+    leave_waiting_rooms,
+    poll_token,
+    waiting_rooms
+)
 from project.api.authentications import authenticate
+from project.api.cart_store import cart_store
+from project.api.idempotency import idempotent
+from project.api.inventory import (
+    locked_stock_levels,
+    record_stock_changes,
+    stock_levels
+)
+from project.api.order import create_order_from_cart
 from project.exceptions import APIError
 from project.api.validators import field_type_validator, required_validator
 
@@ -16,6 +30,7 @@ from project.models import (
     ShoppingCart,
     CartItem,
     Sku,
+    Sku_Images,
     Sku_Stock,
     Campaign,
     Coupon,
@@ -37,49 +52,124 @@ def ping_pong():
     })
 
 
-@shopping_blueprint.route('/shopping/get_cart', methods=['GET'])
-@authenticate
-def get_cart(user_id):
-    """Get cart"""
+def persist_cart(user_id: int, items: list) -> ShoppingCart:
+    """Persist the items of a stored cart to the active cart of a user and
+    reserve their stock, flushed but not committed.
+
+    Raises APIError when a stock does not exist or is short."""
+    # lock the stocks, concurrent checkouts of the same stock wait and then
+    # see the reservations committed meanwhile
+    levels = locked_stock_levels({item['sku_stock_id'] for item in items})
 
     shopping_cart = ShoppingCart.query.filter_by(
         user_id=user_id, is_active=True).first()
 
     if not shopping_cart:
-
-        # create a new cart
         shopping_cart = ShoppingCart(user_id=user_id)
-        shopping_cart.insert()
+        db.session.add(shopping_cart)
+        db.session.flush()
 
         logger.info('New cart created for user: {}'.format(user_id))
 
-    logger.info('Cart id: {}'.format(shopping_cart.id))
-    cart_items = CartItem.query.filter_by(cart_id=shopping_cart.id).all()
+    cart_items = []
+    for item in items:
+        if item['sku_stock_id'] not in levels:
+            raise APIError('Stock does not exist')
 
-    cart_length = len(cart_items)
+        if levels[item['sku_stock_id']] < item['quantity']:
+            sku = Sku.query.join(Sku_Stock, Sku_Stock.sku_id == Sku.id).filter(
+                Sku_Stock.id == item['sku_stock_id']).first()
+            raise APIError('Not enough stock for {}'.format(sku.name))
 
-    total_amount = 0
-    for cart_item in cart_items:
-        campaign = Campaign.query.get(cart_item.campaign_id)
-        sku = Sku.query.get(campaign.sku_id)
+        cart_item = CartItem(
+            cart_id=shopping_cart.id,
+            campaign_id=item['campaign_id'],
+            sku_stock_id=item['sku_stock_id'],
+            sku_images_id=item['sku_images_id'],
+            quantity=item['quantity']
+        )
+        db.session.add(cart_item)
+        cart_items.append(cart_item)
+
+    db.session.flush()
+
+    # reserve stock
+    record_stock_changes([
+        (cart_item.sku_stock_id, -cart_item.quantity, 'reserve', cart_item.id)
+        for cart_item in cart_items])
+
+    return shopping_cart
+
+
+def stored_cart_item(item: dict) -> CartItem:
+    """Transient CartItem of a stored cart item, its id is the sku stock's"""
+    cart_item = CartItem(
+        cart_id=None,
+        campaign_id=item['campaign_id'],
+        sku_stock_id=item['sku_stock_id'],
+        sku_images_id=item['sku_images_id'],
+        quantity=item['quantity']
+    )
+    cart_item.id = item['sku_stock_id']
+    cart_item.reservation_date = datetime.fromisoformat(item['reservation_date'])
+
+    return cart_item
+
+
+def cart_summary(user_id: int, items: list = None) -> dict:
+    """Item count, total quantity and amount of a stored cart, the prices
+    are read with one query"""
+    if items is None:
+        items = cart_store().items(user_id)
 
-        total_amount += (sku.price * cart_item.quantity)
+    prices = dict(db.session.query(Campaign.id, Sku.price).join(
+        Sku, Sku.id == Campaign.sku_id).filter(
+        Campaign.id.in_({item['campaign_id'] for item in items})).all()) if items else {}
+
+    return {
+        'cart_length': len(items),
+        'total_quantity': sum(item['quantity'] for item in items),
+        'total_amount': round(sum(prices.get(item['campaign_id'], 0) * item['quantity']
+                                  for item in items), 2)
+    }
+
+
+@shopping_blueprint.route('/shopping/get_cart', methods=['GET'])
+@authenticate
+def get_cart(user_id):
+    """Get cart"""
+    items = cart_store().items(user_id)
+    summary = cart_summary(user_id, items)
 
     response_object = {
         'status': True,
-        'message': '{} item(s) found in cart'.format(len(cart_items)),
+        'message': '{} item(s) found in cart'.format(len(items)),
         'data': {
-            'cart': [cart_item.to_json() for cart_item in cart_items],
-            'total_amount': round(total_amount, 2),
-            'cart_length': cart_length
+            'cart': [stored_cart_item(item).to_json() for item in items],
+            'total_amount': summary['total_amount'],
+            'cart_length': summary['cart_length']
         }
     }
 
     return jsonify(response_object), 200
 
 
+@shopping_blueprint.route('/shopping/cart_summary', methods=['GET'])
+@authenticate
+def get_cart_summary(user_id):
+    """Get item count, total quantity and amount of cart"""
+    response_object = {
+        'status': True,
+        'message': 'Cart summary retrieved successfully',
+        'data': cart_summary(user_id)
+    }
+
+    return jsonify(response_object), 200
+
+
 @shopping_blueprint.route('/shopping/add_to_cart', methods=['POST'])
 @authenticate
+@idempotent
 def add_to_cart(user_id):
     """Add item to cart"""
     response_object = {
@@ -103,6 +193,10 @@ def add_to_cart(user_id):
         sku_stock_id = post_data.get('sku_stock_id')
         quantity = post_data.get('quantity')
 
+        if quantity < 1:
+            response_object['message'] = 'Quantity should be positive'
+            return jsonify(response_object), 200
+
         # check if campaign exists
         campaign = Campaign.query.filter_by(id=campaign_id).first()
         if not campaign:
@@ -114,57 +208,166 @@ def add_to_cart(user_id):
             response_object['message'] = 'SKU does not exist'
             return jsonify(response_object), 200
 
+        # flash sales admit a bounded number of buyers at once
+        admission = admission_required(user_id, [campaign_id])
+        if admission:
+            response_object['message'] = 'Waiting for your turn'
+            response_object['admission'] = admission
+            return jsonify(response_object), 200
+
         # check available stock
-        sku_stock = Sku_Stock.query.get(sku_stock_id)
+        sku_stock = Sku_Stock.query.options(db.undefer(Sku_Stock.stock_level)).get(sku_stock_id)
         if not sku_stock:
             response_object['message'] = 'Stock does not exist'
             return jsonify(response_object), 200
 
-        # check if user has already added this item to cart
-        shopping_cart = ShoppingCart.query.filter_by(
-            user_id=user_id, is_active=True).first()
+        if sku_stock.stock_level < quantity:
+            response_object['message'] = 'Not enough stock'
+            return jsonify(response_object), 200
+
+        # stock is reserved at checkout
+        store = cart_store()
+        if not store.add_item(user_id, campaign_id, sku_stock_id, sku_images_id, quantity):
+            response_object['message'] = 'Item already in cart, please update quantity instead'
+            return jsonify(response_object), 200
+
+        response_object['status'] = True
+        response_object['message'] = 'Item added to cart'
+        response_object['id'] = sku_stock_id
+        response_object['cart_length'] = store.count(user_id)
+
+        return jsonify(response_object), 200
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error(e)
+        response_object['message'] = str(e)
+        return jsonify(response_object), 200
+
+
+def validate_cart_items(items: list) -> list:
+    """Validate items to add to a cart with one IN query per table, returns
+    an error message or None per item"""
+    campaigns = {campaign.id: campaign for campaign in Campaign.query.filter(
+        Campaign.id.in_({item['campaign_id'] for item in items})).all()}
+    stocks = dict(db.session.query(Sku_Stock.id, Sku_Stock.sku_id).filter(
+        Sku_Stock.id.in_({item['sku_stock_id'] for item in items})).all())
+    images = dict(db.session.query(Sku_Images.id, Sku_Images.sku_id).filter(
+        Sku_Images.id.in_({item['sku_images_id'] for item in items})).all())
+    levels = stock_levels({item['sku_stock_id'] for item in items})
+
+    requested = Counter(item['sku_stock_id'] for item in items)
 
-        if not shopping_cart:
-            # create a new cart
-            shopping_cart = ShoppingCart(user_id=user_id)
-            shopping_cart.insert()
+    errors = []
+    for item in items:
+        campaign = campaigns.get(item['campaign_id'])
 
-            logger.info('New cart created for user: {}'.format(user_id))
+        if not campaign:
+            errors.append('Campaign does not exist')
+
+        elif stocks.get(item['sku_stock_id']) != campaign.sku_id:
+            errors.append('Stock does not exist')
+
+        elif images.get(item['sku_images_id']) != campaign.sku_id:
+            errors.append('Image does not exist')
+
+        elif requested[item['sku_stock_id']] > 1:
+            errors.append('Item is repeated')
+
+        elif item['quantity'] <= 0:
+            errors.append('Quantity should be positive')
+
+        elif levels[item['sku_stock_id']] < item['quantity']:
+            errors.append('Not enough stock')
 
         else:
-            cart_item = CartItem.query.filter_by(
-                cart_id=shopping_cart.id, sku_stock_id=sku_stock_id).first()
+            errors.append(None)
 
-            if cart_item:
-                response_object['message'] = 'Item already in cart, please update quantity instead'
-                return jsonify(response_object), 200
+    return errors
 
-        if sku_stock.stock < quantity:
-            response_object['message'] = 'Not enough stock'
-            return jsonify(response_object), 200
 
-        # add item to cart
-        cart_item = CartItem(
-            cart_id=shopping_cart.id,
-            campaign_id=campaign_id,
-            sku_stock_id=sku_stock_id,
-            sku_images_id=sku_images_id,
-            quantity=quantity
-        )
+@shopping_blueprint.route('/shopping/add_to_cart/batch', methods=['POST'])
+@authenticate
+@idempotent
+def add_to_cart_batch(user_id):
+    """Add items to cart, all of them or each valid one
+
+    Like add_to_cart, the items go to the cart store and their stock is only
+    checked here: it is reserved through the inventory ledger at checkout,
+    so a cart being filled holds no stock and nothing is written to the
+    database. With all_or_nothing, items stored before a failing one are
+    removed again."""
+    response_object = {
+        'status': False,
+        'message': 'Invalid payload.'
+    }
 
-        cart_item.insert()
+    try:
+        post_data = request.get_json()
 
-        cart_length = len(CartItem.query.filter_by(
-            cart_id=shopping_cart.id).all())
+        field_types = {'items': list, 'all_or_nothing': bool}
 
-        # update stock
-        sku_stock.stock -= quantity
-        sku_stock.update()
+        post_data = field_type_validator(post_data, field_types)
+        required_validator(post_data, ['items'])
 
-        response_object['status'] = True
-        response_object['message'] = 'Item added to cart'
-        response_object['id'] = cart_item.id
-        response_object['cart_length'] = cart_length
+        items = post_data.get('items')
+        all_or_nothing = post_data.get('all_or_nothing') is not False
+
+        limit = current_app.config.get("CART_BATCH_LIMIT")
+        if len(items) > limit:
+            raise APIError('At most {} items can be added at once'.format(limit))
+
+        item_types = {'campaign_id': int, 'sku_images_id': int,
+                      'sku_stock_id': int, 'quantity': int}
+
+        for position, item in enumerate(items, start=1):
+            if type(item) != dict:
+                raise APIError('Item {} should be dict value'.format(position))
+
+            items[position - 1] = field_type_validator(
+                item, item_types, prefix='Item {}'.format(position))
+            required_validator(items[position - 1], list(item_types.keys()),
+                               prefix='Item {}'.format(position))
+
+        admission = admission_required(user_id, {item['campaign_id'] for item in items})
+        if admission:
+            response_object['message'] = 'Waiting for your turn'
+            response_object['admission'] = admission
+            return jsonify(response_object), 200
+
+        store = cart_store()
+        errors = validate_cart_items(items)
+
+        # stock is reserved at checkout, see persist_cart()
+        added = []
+        for position, item in enumerate(items):
+            if errors[position] or (all_or_nothing and any(errors)):
+                continue
+
+            if store.add_item(user_id, item['campaign_id'], item['sku_stock_id'],
+                              item['sku_images_id'], item['quantity']):
+                added.append(item['sku_stock_id'])
+                continue
+
+            errors[position] = 'Item already in cart, please update quantity instead'
+
+            if all_or_nothing:
+                # take back the items added so far
+                for sku_stock_id in added:
+                    store.remove_item(user_id, sku_stock_id)
+                added = []
+                break
+
+        response_object['status'] = bool(added)
+        response_object['message'] = '{} of {} item(s) added to cart'.format(
+            len(added), len(items))
+        response_object['results'] = [{
+            'sku_stock_id': item['sku_stock_id'],
+            'status': item['sku_stock_id'] in added,
+            'message': error or ('Item added to cart' if item['sku_stock_id'] in added
+                                 else 'Item not added, another item failed')
+        } for item, error in zip(items, errors)]
+        response_object['cart_length'] = store.count(user_id)
 
         return jsonify(response_object), 200
 
@@ -175,10 +378,11 @@ def add_to_cart(user_id):
         return jsonify(response_object), 200
 
 
-@shopping_blueprint.route('/shopping/update_cart/<int:cart_item_id>', methods=['PUT'])
+@shopping_blueprint.route('/shopping/update_cart/<int:sku_stock_id>', methods=['PUT'])
 @authenticate
-def update_cart(user_id, cart_item_id):
-    """Update item in cart"""
+def update_cart(user_id, sku_stock_id):
+    """Update item in cart, items are identified by their sku_stock_id (the
+    id of get_cart and add_to_cart) since they are no longer rows"""
     response_object = {
         'status': False,
         'message': 'Invalid payload.'
@@ -196,59 +400,34 @@ def update_cart(user_id, cart_item_id):
 
         quantity = post_data.get('quantity')
 
-        # check if cart exists
-        shopping_cart = ShoppingCart.query.filter_by(user_id=user_id, is_active=True).first()
-        if not shopping_cart:
-            response_object['message'] = 'Cart does not exist'
+        if quantity < 1:
+            response_object['message'] = 'Quantity should be positive'
             return jsonify(response_object), 200
 
-        cart_item = CartItem.query.get(cart_item_id)
+        store = cart_store()
+
         # check if cart item exists
+        cart_item = store.get_item(user_id, sku_stock_id)
         if not cart_item:
             response_object['message'] = 'Cart item does not exist'
             return jsonify(response_object), 200
 
-        sku_stock = Sku_Stock.query.get(cart_item.sku_stock_id)
+        sku_stock = Sku_Stock.query.options(
+            db.undefer(Sku_Stock.stock_level)).get(cart_item['sku_stock_id'])
         # check available stock
         if not sku_stock:
             response_object['message'] = 'Stock does not exist'
             return jsonify(response_object), 200
 
-        sku = Sku.query.get(sku_stock.sku_id)
-        # if not shopping_cart.is_active:
-        #     response_object['message'] = 'Cart containing item {} already checked out'.format(
-        #         sku.name)
-        #     return jsonify(response_object), 200
-
-        if quantity < cart_item.quantity:
-            # add stock
-            sku_stock.stock += (cart_item.quantity - quantity)
-
-        elif quantity > cart_item.quantity:
-            if sku_stock.stock <= (quantity - cart_item.quantity):
-                response_object['message'] = 'Not enough stock'
-                return jsonify(response_object), 200
-
-            # remove stock
-            sku_stock.stock -= (quantity - cart_item.quantity)
-
-        # update or remove cart item
-        if quantity == 0:
-            cart_item.delete()
-
-        else:
-            cart_item.quantity = quantity
-            cart_item.update()
-
-        cart_length = len(CartItem.query.filter_by(
-            cart_id=shopping_cart.id).all())
+        if quantity > cart_item['quantity'] and sku_stock.stock_level < quantity:
+            response_object['message'] = 'Not enough stock'
+            return jsonify(response_object), 200
 
-        # update stock
-        sku_stock.update()
+        store.set_quantity(user_id, cart_item, quantity)
 
         response_object['status'] = True
         response_object['message'] = 'Cart item updated'
-        response_object['cart_length'] = cart_length
+        response_object['cart_length'] = store.count(user_id)
 
         return jsonify(response_object), 200
 
@@ -259,46 +438,30 @@ def update_cart(user_id, cart_item_id):
         return jsonify(response_object), 200
 
 
-@shopping_blueprint.route('/shopping/remove_from_cart/<int:cart_item_id>', methods=['DELETE'])
+@shopping_blueprint.route('/shopping/remove_from_cart/<int:sku_stock_id>', methods=['DELETE'])
 @authenticate
-def remove_from_cart(user_id, cart_item_id):
-    """Remove item from cart"""
+def remove_from_cart(user_id, sku_stock_id):
+    """Remove item from cart, items are identified by their sku_stock_id"""
     response_object = {
         'status': False,
         'message': 'Invalid payload.'
     }
 
     try:
+        store = cart_store()
+
         # check if cart item exists
-        cart_item = CartItem.query.get(cart_item_id)
-        if not cart_item:
+        if not store.remove_item(user_id, sku_stock_id):
             response_object['message'] = 'Cart item does not exist'
             return jsonify(response_object), 200
 
-        # check available stock
-        sku_stock = Sku_Stock.query.get(cart_item.sku_stock_id)
-        if not sku_stock:
-            response_object['message'] = 'Cart item does not match any stock'
-            return jsonify(response_object), 200
-
-        # update stock
-        sku_stock.stock += cart_item.quantity
-        sku_stock.update()
-
-        # remove cart item
-        cart_item.delete()
-
-        cart_length = len(CartItem.query.filter_by(
-            cart_id=cart_item.cart_id).all())
-
         response_object['status'] = True
         response_object['message'] = 'Cart item removed'
-        response_object['cart_length'] = cart_length
+        response_object['cart_length'] = store.count(user_id)
 
         return jsonify(response_object), 200
 
     except Exception as e:
-        db.session.rollback()
         logger.error(e)
         response_object['message'] = str(e)
         return jsonify(response_object), 200
@@ -306,74 +469,67 @@ def remove_from_cart(user_id, cart_item_id):
 
 @shopping_blueprint.route('/shopping/checkout', methods=['POST'])
 @authenticate
+@idempotent
 def checkout(user_id):
     """Checkout cart"""
-    # Make user cart inactive and add checkedout date to cart
+    # Persist the stored cart, make it inactive and add checkedout date
     response_object = {
         'status': False,
         'message': 'Invalid payload.'
     }
 
     try:
-        # check if cart exists
+        store = cart_store()
+
+        # check if cart is already checked out
         shopping_cart = ShoppingCart.query.filter_by(
             user_id=user_id, is_active=True).first()
 
-        if not shopping_cart:
-            response_object['message'] = 'Cart does not exist'
-            return jsonify(response_object), 200
-
-        # check if cart is already checked out
-        if shopping_cart.checkedout_at:
+        if shopping_cart and shopping_cart.checkedout_at:
             response_object['message'] = 'Cart already checked out'
             return jsonify(response_object), 200
 
         # check if cart is empty
-        cart_items = CartItem.query.filter_by(cart_id=shopping_cart.id).all()
-        if not cart_items:
+        items = store.items(user_id)
+        if not items:
             response_object['message'] = 'Cart is empty, please add item(s) to cart'
             return jsonify(response_object), 200
 
-        shopping_cart.checkedout_at = datetime.utcnow()
-        shopping_cart.update()
-
-        # call create order api to create order
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': request.headers.get('Authorization')
-        }
+        campaign_ids = {item['campaign_id'] for item in items}
+        admission = admission_required(user_id, campaign_ids)
+        if admission:
+            response_object['message'] = 'Waiting for your turn'
+            response_object['admission'] = admission
+            return jsonify(response_object), 200
 
-        json_data = request.get_json()
+        shopping_cart = persist_cart(user_id, items)
+        shopping_cart.checkedout_at = datetime.utcnow()
 
-        data = {
-            'shipping_fee': json_data.get('shipping_fee', 0.0),
-        }
+        json_data = request.get_json(silent=True) or {}
 
-        order_url = 'http://localhost:5000/order/create'
-        response = requests.post(url=order_url, json=data, headers=headers)
+        # create the order in the same transaction, the cart stays checked
+        # out if it fails
+        try:
+            with db.session.begin_nested():
+                order = create_order_from_cart(
+                    user_id, shopping_cart, json_data.get('shipping_fee', 0.0))
 
-        if response.status_code != 200:
             response_object['order'] = {
-                'status': False,
-                'message': 'Order creation failed',
+                'status': True,
+                'message': 'Order created successfully',
+                'order_id': order.id
             }
 
-        elif not response.json()['status']:
-            response = response.json()
-            logger.info(response)
+        except APIError as e:
+            logger.info(e)
             response_object['order'] = {
                 'status': False,
-                'message': response['message']
+                'message': str(e)
             }
 
-        else:
-            response = response.json()
-            logger.info(response)
-            response_object['order'] = {
-                'status': True,
-                'message': response['message'],
-                'order_id': response['data']['order_id']
-            }
+        db.session.commit()
+        store.clear(user_id)
+        leave_waiting_rooms(user_id, campaign_ids)
 
         response_object['status'] = True
         response_object['message'] = 'Cart checked out at {}'.format(
@@ -386,3 +542,62 @@ def checkout(user_id):
         logger.error(e)
         response_object['message'] = str(e)
         return jsonify(response_object), 200
+
+
+@shopping_blueprint.route('/shopping/admission/<int:campaign_id>', methods=['POST'])
+@authenticate
+def join_waiting_room(user_id, campaign_id):
+    """Join the waiting room of a flash sale"""
+    response_object = {
+        'status': False,
+        'message': 'Invalid payload.'
+    }
+
+    try:
+        rooms = waiting_rooms([campaign_id])
+        if not rooms:
+            response_object['message'] = 'Campaign has no waiting room'
+            return jsonify(response_object), 200
+
+        room, limit = rooms[0]
+        room.open(limit)
+        admission = room.join(user_id)
+
+        response_object['status'] = admission['admitted']
+        response_object['message'] = admission.pop('message', None) or (
+            'Admitted' if admission['admitted'] else 'Waiting for your turn')
+        response_object['admission'] = admission
+
+        return jsonify(response_object), 200
+
+    except Exception as e:
+        logger.error(e)
+        response_object['message'] = str(e)
+        return jsonify(response_object), 200
+
+
+@shopping_blueprint.route('/shopping/admission/poll', methods=['GET'])
+def poll_waiting_room():
+    """Poll the waiting room of a flash sale with a polling token, no auth
+    token needed"""
+    response_object = {
+        'status': False,
+        'message': 'Invalid polling token'
+    }
+
+    try:
+        admission = poll_token(request.args.get('token', ''))
+        if admission is None:
+            return jsonify(response_object), 200
+
+        response_object['status'] = admission['admitted']
+        response_object['message'] = admission.pop('message', None) or (
+            'Admitted' if admission['admitted'] else 'Waiting for your turn')
+        response_object['admission'] = admission
+
+        return jsonify(response_object), 200
+
+    except Exception as e:
+        logger.error(e)
+        response_object['message'] = str(e)
+        return jsonify(response_object), 200
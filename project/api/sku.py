@@ -4,6 +4,7 @@ from datetime import datetime
 from flask import Blueprint, jsonify, request
 
 from project.api.authentications import authenticate
+from project.api.inventory import record_stock
 from project.exceptions import APIError
 from project.api.validators import field_type_validator, required_validator
 
@@ -133,12 +134,15 @@ def add_sku(user_id):
             raise APIError('Please provide at least one stock')
 
         for stock in sku_stocks:
-            Sku_Stock(
+            sku_stock = Sku_Stock(
                 sku_id=sku.id,
                 size=stock.get('size'),
                 color=stock.get('color'),
-                stock=stock.get('stock')
-            ).insert()
+                stock=0
+            )
+            sku_stock.insert()
+
+            record_stock(sku_stock.id, stock.get('stock'), 'restock')
 
             sku.quantity += stock.get('stock')
 
@@ -220,12 +224,15 @@ def update_sku(user_id, sku_id):
             Sku_Stock.query.filter_by(sku_id=sku.id).delete()
             sku.quantity = 0
             for stock in sku_stocks:
-                Sku_Stock(
+                sku_stock = Sku_Stock(
                     sku_id=sku.id,
                     size=stock.get('size'),
                     color=stock.get('color'),
-                    stock=stock.get('stock')
-                ).insert()
+                    stock=0
+                )
+                sku_stock.insert()
+
+                record_stock(sku_stock.id, stock.get('stock'), 'restock')
 
                 sku.quantity += stock.get('stock')
 
@@ -0,0 +1,279 @@
+"""In-process SQL statement statistics.
+
+Statements are grouped by fingerprint (see query_budget.fingerprint) and
+aggregated per fingerprint and per endpoint: calls and total/mean/p95/max
+time. Statements slower than SQL_SLOW_QUERY_MS get their EXPLAIN output
+captured on a separate connection.
+
+Collecting is off unless SQL_STATS_ENABLED is set. With SQL_STATS_PATH set a
+daemon thread of each app process writes its snapshot every
+SQL_STATS_DUMP_SECONDS, requests never wait on the file. Every process writes
+a file of its own, e.g. sql_stats.<pid>.json for sql_stats.json, and
+load_snapshot() merges them.
+"""
+import os
+import glob
+import json
+import time
+import atexit
+import logging
+import threading
+from collections import Counter, deque
+
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from project.api.query_budget import fingerprint
+
+logger = logging.getLogger(__name__)
+
+_explaining = threading.local()
+
+
+class _Entry:
+    """Aggregated timings of one statement fingerprint or endpoint"""
+
+    def __init__(self, sample_size: int):
+        self.calls = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.samples = deque(maxlen=sample_size)
+        self.endpoints = Counter()
+        self.explain = None
+
+    def add(self, duration_ms: float):
+        self.calls += 1
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+        self.samples.append(duration_ms)
+
+    def merge(self, item: dict):
+        """Add the entry of another process, as dumped with its samples"""
+        self.calls += item["calls"]
+        self.total_ms += item["total_ms"]
+        self.max_ms = max(self.max_ms, item["max_ms"])
+        self.samples.extend(item["samples"])
+        self.endpoints.update(item.get("endpoints", {}))
+        self.explain = self.explain or item.get("explain")
+
+    def to_json(self):
+        samples = sorted(self.samples)
+        p95 = samples[int(0.95 * (len(samples) - 1))] if samples else 0.0
+
+        return {
+            "calls": self.calls,
+            "total_ms": round(self.total_ms, 3),
+            "mean_ms": round(self.total_ms / self.calls, 3) if self.calls else 0.0,
+            "p95_ms": round(p95, 3),
+            "max_ms": round(self.max_ms, 3)
+        }
+
+
+class StatementStats:
+    """Thread-safe collector of statement statistics"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.enabled = False
+        self.slow_query_ms = None
+        self.sample_size = 500
+        self.path = None
+        self.dump_seconds = 60
+        self._dumper_pid = None
+        self.reset()
+
+    def configure(self, config):
+        self.enabled = config.get("SQL_STATS_ENABLED", False)
+        self.slow_query_ms = config.get("SQL_SLOW_QUERY_MS")
+        self.sample_size = config.get("SQL_STATS_SAMPLE_SIZE", 500)
+        self.path = config.get("SQL_STATS_PATH")
+        self.dump_seconds = config.get("SQL_STATS_DUMP_SECONDS", 60)
+
+    def reset(self):
+        with self._lock:
+            self._statements = {}
+            self._endpoints = {}
+
+    def record(self, statement: str, endpoint: str, duration_ms: float,
+               explain: list = None):
+        key = fingerprint(statement)
+
+        with self._lock:
+            entry = self._statements.get(key)
+            if entry is None:
+                entry = self._statements[key] = _Entry(self.sample_size)
+
+            entry.add(duration_ms)
+            entry.endpoints[endpoint] += 1
+            if explain is not None:
+                entry.explain = explain
+
+            endpoint_entry = self._endpoints.get(endpoint)
+            if endpoint_entry is None:
+                endpoint_entry = self._endpoints[endpoint] = _Entry(
+                    self.sample_size)
+
+            endpoint_entry.add(duration_ms)
+
+        # a forked app process needs its own dump thread
+        if self.path and self._dumper_pid != os.getpid():
+            self._start_dumper()
+
+    def _start_dumper(self):
+        with self._lock:
+            if self._dumper_pid == os.getpid():
+                return
+            self._dumper_pid = os.getpid()
+
+        threading.Thread(target=self._dump_forever, name="sql-stats-dump",
+                         daemon=True).start()
+
+    def _dump_forever(self):
+        while True:
+            time.sleep(self.dump_seconds)
+            self.dump()
+
+    def snapshot(self, limit: int = None, sort: str = "total_ms",
+                 samples: bool = False) -> dict:
+        with self._lock:
+            return _snapshot(self._statements, self._endpoints, limit, sort, samples)
+
+    def dump(self):
+        """Write the snapshot of this process next to SQL_STATS_PATH"""
+        if not self.path:
+            return
+
+        path = dump_path(self.path, os.getpid())
+        try:
+            # replaced at once, a report never reads half a file
+            with open(path + ".tmp", "w") as f:
+                json.dump(self.snapshot(samples=True), f)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            logger.error("Error writing sql stats to {}: {}".format(path, e))
+
+
+def _snapshot(statements: dict, endpoints: dict, limit: int, sort: str,
+              samples: bool) -> dict:
+    statement_items = []
+    for key, entry in statements.items():
+        item = entry.to_json()
+        item["statement"] = key
+        item["endpoints"] = dict(entry.endpoints)
+        item["explain"] = entry.explain
+        if samples:
+            item["samples"] = list(entry.samples)
+        statement_items.append(item)
+
+    endpoint_items = []
+    for key, entry in endpoints.items():
+        item = entry.to_json()
+        item["endpoint"] = key
+        if samples:
+            item["samples"] = list(entry.samples)
+        endpoint_items.append(item)
+
+    statement_items.sort(key=lambda item: item[sort], reverse=True)
+    endpoint_items.sort(key=lambda item: item[sort], reverse=True)
+
+    return {
+        "statements": statement_items[:limit] if limit else statement_items,
+        "endpoints": endpoint_items[:limit] if limit else endpoint_items
+    }
+
+
+statement_stats = StatementStats()
+
+
+def dump_path(path: str, pid: int) -> str:
+    """File of one process for SQL_STATS_PATH, sql_stats.<pid>.json"""
+    root, ext = os.path.splitext(path)
+    return "{}.{}{}".format(root, pid, ext)
+
+
+def load_snapshot(path: str, limit: int = None, sort: str = "total_ms") -> dict:
+    """Merge the snapshots dumped by every process for SQL_STATS_PATH,
+    files that cannot be read are skipped. Returns None without files"""
+    root, ext = os.path.splitext(path)
+    paths = [dumped for dumped in glob.glob(glob.escape(root) + ".*" + ext)
+             if dumped[len(root) + 1:len(dumped) - len(ext)].isdigit()]
+    if not paths:
+        return None
+
+    statements = {}
+    endpoints = {}
+    for dumped in paths:
+        try:
+            with open(dumped) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error("Error reading sql stats from {}: {}".format(dumped, e))
+            continue
+
+        for item in snapshot["statements"]:
+            statements.setdefault(item["statement"], _Entry(None)).merge(item)
+        for item in snapshot["endpoints"]:
+            endpoints.setdefault(item["endpoint"], _Entry(None)).merge(item)
+
+    return _snapshot(statements, endpoints, limit, sort, False)
+
+
+def explain(conn, statement: str, parameters):
+    """Return the query plan of a statement, run on a separate connection"""
+    if conn.dialect.name == "sqlite":
+        prefix = "EXPLAIN QUERY PLAN "
+    else:
+        prefix = "EXPLAIN "
+
+    _explaining.active = True
+    try:
+        with conn.engine.connect() as explain_conn:
+            result = explain_conn.exec_driver_sql(prefix + statement, parameters)
+            return [[str(value) for value in row] for row in result]
+
+    except Exception as e:
+        logger.error("Error explaining statement: {}".format(e))
+        return None
+
+    finally:
+        _explaining.active = False
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if not statement_stats.enabled or getattr(_explaining, "active", False):
+        return
+
+    # kept on the execution context, which is dropped with a failed statement
+    context._sql_stats_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if not statement_stats.enabled or getattr(_explaining, "active", False):
+        return
+
+    started = getattr(context, "_sql_stats_start", None)
+    if started is None:
+        return
+
+    duration_ms = (time.perf_counter() - started) * 1000
+    endpoint = request.endpoint if has_request_context() else None
+    plan = None
+    slow_query_ms = statement_stats.slow_query_ms
+    if (slow_query_ms is not None and duration_ms >= slow_query_ms and
+            not executemany and statement.lstrip().upper().startswith("SELECT")):
+        plan = explain(conn, statement, parameters)
+
+    statement_stats.record(statement, endpoint or "<no request>",
+                           duration_ms, plan)
+
+
+def init_sql_stats(app):
+    """Configure the collector and register the cursor hooks"""
+    statement_stats.configure(app.config)
+
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+        atexit.register(statement_stats.dump)
@@ -0,0 +1,158 @@
+"""Ticket-range index of closed campaigns.
+
+Every coupon is one ticket. When a campaign closes, its coupons are grouped
+by user and the prefix sums of the per-user counts are stored in
+ticket_range, so user u holds tickets [ticket_end - ticket_count, ticket_end).
+A draw picks a random ticket and finds its holder by seeking the
+(campaign_id, ticket_end) index, the ticket's offset in the holder's range
+being its coupon, and a user's odds are a primary key lookup.
+A campaign closed without coupons gets an index of 0 tickets, so that it is
+not rebuilt on every run. The index is dropped when a campaign reopens or
+loses coupons, e.g. when an order is deleted, and built again by the
+ticket_index job or the next draw.
+"""
+import secrets
+import logging
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from project import db
+from project.api.leases import job_heartbeat
+from project.models import Campaign, Coupon, TicketIndex, TicketRange
+
+logger = logging.getLogger(__name__)
+
+
+def build_ticket_index(campaign_id: int, commit=True):
+    """Build the ticket index of a campaign, returns the TicketIndex.
+
+    With commit=False the index is only flushed and an index built meanwhile
+    by another worker raises IntegrityError, the caller rolls back."""
+    rows = db.session.query(Coupon.user_id, func.count(Coupon.id)).filter(
+        Coupon.campaign_id == campaign_id).group_by(
+        Coupon.user_id).order_by(Coupon.user_id).all()
+
+    user_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    counts = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+    ends = np.cumsum(counts)
+
+    batch_size = current_app.config.get("TICKET_INDEX_BATCH_SIZE")
+    try:
+        db.session.execute(TicketRange.__table__.delete().where(
+            TicketRange.campaign_id == campaign_id))
+
+        for start in range(0, len(rows), batch_size):
+            db.session.execute(TicketRange.__table__.insert(), [{
+                "campaign_id": campaign_id,
+                "user_id": int(user_id),
+                "ticket_count": int(count),
+                "ticket_end": int(end)
+            } for user_id, count, end in zip(
+                user_ids[start:start + batch_size],
+                counts[start:start + batch_size],
+                ends[start:start + batch_size])])
+
+        index = TicketIndex(campaign_id, int(ends[-1]) if rows else 0)
+        db.session.add(index)
+
+        if commit:
+            db.session.commit()
+        else:
+            db.session.flush()
+
+    except IntegrityError:
+        if not commit:
+            raise
+
+        # built by another worker meanwhile
+        db.session.rollback()
+        return TicketIndex.query.get(campaign_id)
+
+    logger.info("Built ticket index of campaign {}: {} ticket(s), {} holder(s)".format(
+        campaign_id, index.tickets, len(rows)))
+
+    return index
+
+
+def drop_ticket_index(campaign_id: int):
+    """Drop the ticket index of a campaign reopened or losing coupons, not
+    committed"""
+    db.session.execute(TicketRange.__table__.delete().where(
+        TicketRange.campaign_id == campaign_id))
+    # through the session, a loaded index must not linger in the identity map
+    TicketIndex.query.filter_by(campaign_id=campaign_id).delete(
+        synchronize_session='fetch')
+
+
+def get_ticket_index(campaign_id: int, commit=True):
+    return TicketIndex.query.get(campaign_id) or build_ticket_index(campaign_id, commit)
+
+
+def pick_ticket_holder(index: TicketIndex) -> tuple:
+    """Draw a random ticket of an indexed campaign, returns its holder and
+    the coupon it stands for, the holder's coupons being numbered by id.
+    The coupon is None if the index is stale."""
+    ticket = secrets.randbelow(index.tickets)
+
+    user_id, ticket_count, ticket_end = db.session.query(
+        TicketRange.user_id, TicketRange.ticket_count, TicketRange.ticket_end).filter(
+        TicketRange.campaign_id == index.campaign_id,
+        TicketRange.ticket_end > ticket).order_by(
+        TicketRange.ticket_end).limit(1).one()
+
+    coupon_id = db.session.query(Coupon.id).filter(
+        Coupon.campaign_id == index.campaign_id,
+        Coupon.user_id == user_id).order_by(Coupon.id).offset(
+        ticket - (ticket_end - ticket_count)).limit(1).scalar()
+
+    return user_id, coupon_id
+
+
+def ticket_odds(campaign_id: int, user_id: int) -> dict:
+    """Tickets held by a user in a campaign and their chance of winning"""
+    index = TicketIndex.query.get(campaign_id)
+
+    if index:
+        tickets = db.session.query(TicketRange.ticket_count).filter(
+            TicketRange.campaign_id == campaign_id,
+            TicketRange.user_id == user_id).scalar() or 0
+        total = index.tickets
+
+    else:
+        # campaign still open, count the live coupons
+        tickets = db.session.query(func.count(Coupon.id)).filter(
+            Coupon.campaign_id == campaign_id,
+            Coupon.user_id == user_id).scalar()
+        total = db.session.query(func.count(Coupon.id)).filter(
+            Coupon.campaign_id == campaign_id).scalar()
+
+    return {
+        "campaign_id": campaign_id,
+        "tickets": tickets,
+        "total_tickets": total,
+        "odds": tickets / total if total else 0.0,
+        "final": index is not None
+    }
+
+
+def unindexed_campaigns() -> list:
+    """Closed campaigns without a ticket index"""
+    return [campaign_id for (campaign_id,) in db.session.query(Campaign.id).outerjoin(
+        TicketIndex, TicketIndex.campaign_id == Campaign.id).filter(
+        Campaign.is_active == False,
+        Campaign.end_date != None,
+        TicketIndex.campaign_id == None)]
+
+
+def build_ticket_indexes() -> int:
+    """Build the ticket index of every closed campaign missing one"""
+    built = 0
+    for campaign_id in unindexed_campaigns():
+        build_ticket_index(campaign_id)
+        built += 1
+        job_heartbeat()
+
+    return built
@@ -0,0 +1,181 @@
+"""Persistent timers for campaign and draw transitions.
+
+Setting Campaign.start_date, Campaign.end_date or Draw.end_date schedules a
+row in scheduled_task for that instant (clearing the date cancels it), in
+the same transaction as the change. The worker fires due timers at least
+once a second: a timer is claimed by deleting its row, and the handler runs
+in the same transaction, so a failed handler puts the timer back. It is then
+retried with backoff up to TIMER_MAX_ATTEMPTS times. Handlers must not
+commit, fire_due_timers() commits each timer once with its effects.
+
+- campaign_start: activates a campaign at its start date
+- campaign_end: builds the ticket index of a campaign closed at its end date
+- draw_end: picks the winner of a draw at its end date
+
+Dates are naive UTC, like every timestamp the worker compares.
+"""
+import logging
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from project import db
+from project.api.tickets import build_ticket_index
+from project.api.utils import draw_winner
+from project.models import Campaign, Draw, Sku, ScheduledTask, TicketIndex
+
+logger = logging.getLogger(__name__)
+
+TIMER_HANDLERS = {}
+
+# (model, date attribute) -> timer kind
+TIMED_ATTRIBUTES = {
+    (Campaign, "start_date"): "campaign_start",
+    (Campaign, "end_date"): "campaign_end",
+    (Draw, "end_date"): "draw_end",
+}
+
+
+def timer_handler(kind: str):
+    def decorator(func):
+        TIMER_HANDLERS[kind] = func
+        return func
+
+    return decorator
+
+
+def _as_datetime(value):
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            return None
+
+    return value
+
+
+def schedule_timer(kind: str, ref_id: int, run_at: datetime, session=None):
+    """Schedule or reschedule a timer, not committed"""
+    session = session or db.session
+
+    cancel_timer(kind, ref_id, session)
+    session.execute(ScheduledTask.__table__.insert().values(
+        kind=kind, ref_id=ref_id, run_at=run_at, attempts=0))
+
+
+def cancel_timer(kind: str, ref_id: int, session=None):
+    """Cancel a pending timer, not committed"""
+    (session or db.session).execute(ScheduledTask.__table__.delete().where(
+        ScheduledTask.kind == kind, ScheduledTask.ref_id == ref_id))
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_timed_changes(session, flush_context, instances):
+    changes = session.info.setdefault("timer_changes", [])
+
+    for instance in list(session.new) + list(session.dirty):
+        for (model, attribute), kind in TIMED_ATTRIBUTES.items():
+            if not isinstance(instance, model):
+                continue
+
+            history = db.inspect(instance).attrs[attribute].history
+            if history.added or (history.deleted and instance not in session.new):
+                changes.append((instance, attribute, kind))
+
+
+@event.listens_for(Session, "after_flush_postexec")
+def _schedule_timed_changes(session, flush_context):
+    changes = session.info.pop("timer_changes", None)
+
+    for instance, attribute, kind in changes or ():
+        run_at = _as_datetime(getattr(instance, attribute))
+
+        if run_at:
+            schedule_timer(kind, instance.id, run_at, session)
+        else:
+            cancel_timer(kind, instance.id, session)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_timed_changes(session, previous_transaction):
+    session.info.pop("timer_changes", None)
+
+
+@timer_handler("campaign_start")
+def start_campaign(campaign_id: int):
+    campaign = Campaign.query.get(campaign_id)
+    if not campaign or campaign.is_active or not campaign.start_date:
+        return
+
+    sku = Sku.query.get(campaign.sku_id)
+    if sku.quantity != sku.number_sold:
+        campaign.is_active = True
+
+
+@timer_handler("campaign_end")
+def end_campaign(campaign_id: int):
+    # campaigns close when sold out, the end date is the closing instant
+    campaign = Campaign.query.get(campaign_id)
+    if not campaign or campaign.is_active:
+        return
+
+    if not TicketIndex.query.get(campaign_id):
+        build_ticket_index(campaign_id, commit=False)
+
+
+@timer_handler("draw_end")
+def end_draw(draw_id: int):
+    draw = Draw.query.get(draw_id)
+    if draw and draw.winner_id is None:
+        draw_winner(draw_id, commit=False)
+
+
+def next_timer_at():
+    """Deadline of the earliest pending timer or None"""
+    return db.session.query(func.min(ScheduledTask.run_at)).scalar()
+
+
+def fire_due_timers() -> int:
+    """Run the handlers of every due timer, returns the number fired"""
+    config = current_app.config
+    now = datetime.utcnow()
+
+    due = db.session.query(
+        ScheduledTask.id, ScheduledTask.kind, ScheduledTask.ref_id,
+        ScheduledTask.run_at, ScheduledTask.attempts).filter(
+        ScheduledTask.run_at <= now).order_by(
+        ScheduledTask.run_at).limit(config.get("TIMER_BATCH_SIZE")).all()
+    db.session.commit()
+
+    fired = 0
+    for task_id, kind, ref_id, run_at, attempts in due:
+        # claim the timer, rescheduled or fired by another worker otherwise
+        result = db.session.execute(ScheduledTask.__table__.delete().where(
+            ScheduledTask.id == task_id, ScheduledTask.run_at == run_at))
+        if not result.rowcount:
+            db.session.rollback()
+            continue
+
+        try:
+            TIMER_HANDLERS[kind](ref_id)
+            db.session.commit()
+            fired += 1
+
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Timer {} {} {} failed: {}".format(task_id, kind, ref_id, e))
+
+            if attempts + 1 >= config.get("TIMER_MAX_ATTEMPTS"):
+                db.session.execute(ScheduledTask.__table__.delete().where(
+                    ScheduledTask.id == task_id))
+            else:
+                db.session.execute(ScheduledTask.__table__.update().where(
+                    ScheduledTask.id == task_id).values(
+                    attempts=attempts + 1,
+                    last_error=str(e),
+                    run_at=datetime.utcnow() + timedelta(seconds=2 ** attempts)))
+            db.session.commit()
+
+    return fired
@@ -1,23 +1,22 @@
 import logging
 
 from flask import Blueprint, jsonify, request
-from flask import current_app
 
 from project.models import (
     User,
     Location,
     Campaign,
     Sku,
-    Banners,
-    ShoppingCart,
-    CartItem
+    Banners
 )
 
 from project.api.utils import upload_file
 from project.api.authentications import authenticate
+from project.api.cart_store import cart_store
 
-from project import db, bcrypt
+from project import db
 from project.api.validators import email_validator, field_type_validator, required_validator
+from project.passwords import hash_password
 
 
 user_blueprint = Blueprint('user', __name__, template_folder='templates')
@@ -181,8 +180,7 @@ def update_user_info(user_id):
         file_obj = request.files.get('file')
 
         if password:
-            user.password = bcrypt.generate_password_hash(
-                password, current_app.config.get("BCRYPT_LOG_ROUNDS")).decode()
+            user.password = hash_password(password)
 
         if file_obj:
             response = upload_file(file_obj)
@@ -347,11 +345,7 @@ def get_user_mobile_home(user_id):
                 carousal.append(campaign.to_json())
 
         # get total carts
-        cart = ShoppingCart.query.filter_by(
-            user_id=user_id, is_active=True).first()
-
-        cart_length = len(CartItem.query.filter_by(
-            cart_id=cart.id).all()) if cart else 0
+        cart_length = cart_store().count(user_id)
 
         response_object['data']['carousal'] = carousal
         response_object['data']['closing'] = closing
@@ -0,0 +1,265 @@
+"""Bulk user import.
+
+`manage.py import-users` and POST /admin/users/import read a CSV file (one
+header row, location columns address, city, state, country and zipcode
+inline) or NDJSON (one object per line, the location flat or as a nested
+object) as a stream and create the users in batches of
+USER_IMPORT_BATCH_SIZE:
+
+- each record is validated like /users/auth/register, its email is stored
+  in the normalized form of email_validator,
+- emails (case-insensitively) and mobile numbers are checked against the
+  rest of the file with in-memory sets and against the database with one IN
+  query per batch, on lower(email) for the emails,
+- the passwords of a batch are hashed across all cores by the pool of
+  project/passwords.py,
+- users and their locations are inserted with one multi-row INSERT each and
+  committed per batch. A batch conflicting with users registered meanwhile
+  is inserted again one user at a time, each in a savepoint, and the
+  conflicting records are rejected.
+
+A record without a password gets an unusable one, the user signs in with
+Google or resets it. Rejected records are reported with their line number,
+at most USER_IMPORT_MAX_ERRORS of them.
+"""
+import csv
+import json
+import logging
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from project import db
+from project.api.validators import email_validator
+from project.exceptions import APIError
+from project.models import User, Location
+from project.passwords import UNUSABLE_PASSWORD, hash_passwords
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'ndjson')
+
+USER_FIELDS = ('firstname', 'lastname', 'email', 'mobile_no', 'password',
+               'dob', 'gender', 'profile_pic')
+LOCATION_FIELDS = ('address', 'city', 'state', 'country', 'zipcode')
+
+
+def read_records(stream, fmt: str):
+    """(line number, record) of a text stream, record is None if the line
+    cannot be parsed"""
+    if fmt not in FORMATS:
+        raise APIError('Format should be one of {}'.format(', '.join(FORMATS)))
+
+    if fmt == 'csv':
+        # line 1 is the header
+        for line, row in enumerate(csv.DictReader(stream), start=2):
+            yield line, row
+        return
+
+    for line, text in enumerate(stream, start=1):
+        if not text.strip():
+            continue
+
+        try:
+            yield line, json.loads(text)
+        except ValueError:
+            yield line, None
+
+
+def _value(record: dict, field: str):
+    value = record.get(field)
+    if value is None:
+        return None
+
+    value = str(value).strip()
+    return value or None
+
+
+def clean_record(record) -> tuple:
+    """Validated user row, location row or None and password of a record,
+    raises APIError"""
+    if not isinstance(record, dict):
+        raise APIError('Record should be an object')
+
+    user = {field: _value(record, field) for field in USER_FIELDS}
+
+    for field in ('firstname', 'lastname', 'email'):
+        if not user[field]:
+            raise APIError('{} is required'.format(field))
+
+    user['email'] = email_validator(user['email'])
+
+    if user['dob']:
+        try:
+            user['dob'] = datetime.strptime(user['dob'], '%Y-%m-%d')
+        except ValueError:
+            raise APIError('dob should be YYYY-MM-DD')
+
+    nested = record.get('location')
+    location = {field: _value(nested if isinstance(nested, dict) else record, field)
+                for field in LOCATION_FIELDS}
+
+    if not any(location.values()):
+        location = None
+    else:
+        for field in LOCATION_FIELDS:
+            if not location[field]:
+                raise APIError('location {} is required'.format(field))
+
+    password = user.pop('password')
+    user['profile_picture'] = user.pop('profile_pic')
+
+    return user, location, password
+
+
+class UserImport:
+    """Imports validated records in batches"""
+
+    def __init__(self, batch_size: int = None, max_errors: int = None):
+        config = current_app.config
+        self.batch_size = batch_size or config.get("USER_IMPORT_BATCH_SIZE")
+        self.max_errors = max_errors or config.get("USER_IMPORT_MAX_ERRORS")
+
+        self.batch = []
+        self.emails = set()
+        self.mobiles = set()
+
+        self.imported = 0
+        self.rejected = 0
+        self.errors = []
+
+    def reject(self, line: int, message: str):
+        self.rejected += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': line, 'message': message})
+
+    def add(self, line: int, record):
+        if record is None:
+            self.reject(line, 'Invalid JSON')
+            return
+
+        try:
+            user, location, password = clean_record(record)
+        except APIError as e:
+            self.reject(line, str(e))
+            return
+
+        # duplicates within the file
+        email = user['email'].lower()
+        if email in self.emails:
+            self.reject(line, 'Email is repeated in the file')
+            return
+
+        if user['mobile_no'] and user['mobile_no'] in self.mobiles:
+            self.reject(line, 'Mobile number is repeated in the file')
+            return
+
+        self.emails.add(email)
+        if user['mobile_no']:
+            self.mobiles.add(user['mobile_no'])
+
+        self.batch.append((line, user, location, password))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def _existing(self, batch: list) -> tuple:
+        """Emails and mobile numbers of the batch already registered"""
+        emails = {email.lower() for (email,) in db.session.query(User.email).filter(
+            func.lower(User.email).in_([user['email'].lower() for _, user, _, _ in batch]))}
+
+        mobiles = [user['mobile_no'] for _, user, _, _ in batch if user['mobile_no']]
+        mobiles = {mobile for (mobile,) in db.session.query(User.mobile_no).filter(
+            User.mobile_no.in_(mobiles))} if mobiles else set()
+
+        return emails, mobiles
+
+    def _insert_users(self, users: list, locations: list):
+        """Insert user rows and the location rows of their emails"""
+        db.session.execute(User.__table__.insert(), users)
+
+        if any(locations):
+            user_ids = dict(db.session.query(User.email, User.id).filter(
+                User.email.in_([user['email'] for user in users])))
+            db.session.execute(Location.__table__.insert(), [
+                dict(location, user_id=user_ids[user['email']])
+                for user, location in zip(users, locations) if location])
+
+    def _insert(self, batch: list, one_by_one: bool = False) -> tuple:
+        """Insert the new users of a batch, returns the records inserted and
+        (line, message) of the ones already registered"""
+        emails, mobiles = self._existing(batch)
+
+        accepted, rejected = [], []
+        for line, user, location, password in batch:
+            if user['email'].lower() in emails:
+                rejected.append((line, 'Email already exists'))
+            elif user['mobile_no'] and user['mobile_no'] in mobiles:
+                rejected.append((line, 'Mobile number already exists'))
+            else:
+                accepted.append((line, user, location, password))
+
+        if not accepted:
+            db.session.commit()
+            return accepted, rejected
+
+        hashes = iter(hash_passwords([password for _, _, _, password in accepted
+                                      if password]))
+        users = [dict(user, password=next(hashes) if password else UNUSABLE_PASSWORD)
+                 for _, user, _, password in accepted]
+        locations = [location for _, _, location, _ in accepted]
+
+        if not one_by_one:
+            self._insert_users(users, locations)
+            db.session.commit()
+            return accepted, rejected
+
+        inserted = []
+        for record, user, location in zip(accepted, users, locations):
+            try:
+                with db.session.begin_nested():
+                    self._insert_users([user], [location])
+                inserted.append(record)
+            except IntegrityError:
+                rejected.append((record[0], 'Email or mobile number already exists'))
+
+        db.session.commit()
+        return inserted, rejected
+
+    def flush(self):
+        batch, self.batch = self.batch, []
+        if not batch:
+            return
+
+        try:
+            accepted, rejected = self._insert(batch)
+        except IntegrityError:
+            # registered meanwhile, check the batch again and insert it user
+            # by user so that new conflicts only reject their own record
+            db.session.rollback()
+            accepted, rejected = self._insert(batch, one_by_one=True)
+
+        for line, message in rejected:
+            self.reject(line, message)
+
+        self.imported += len(accepted)
+        logger.info("Imported {} user(s)".format(self.imported))
+
+    def result(self) -> dict:
+        return {
+            'imported': self.imported,
+            'rejected': self.rejected,
+            'errors': self.errors
+        }
+
+
+def import_users(stream, fmt: str, batch_size: int = None) -> dict:
+    """Import the users of a CSV or NDJSON text stream"""
+    user_import = UserImport(batch_size)
+
+    for line, record in read_records(stream, fmt):
+        user_import.add(line, record)
+    user_import.flush()
+
+    return user_import.result()
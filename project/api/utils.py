@@ -1,14 +1,20 @@
 import os
 import base64
-import random
 import logging
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from werkzeug.utils import secure_filename
 from imagekitio.client import ImageKit
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
 
-# from project import scheduler
+from project import db
 from project.exceptions import APIError
-from project.models import Sku, User, Coupon, Campaign, Draw
+from project.api.tickets import (
+    build_ticket_index, drop_ticket_index, get_ticket_index, pick_ticket_holder
+)
+from project.models import Sku, Coupon, Campaign, Draw
 
 logger = logging.getLogger(__name__)
 
@@ -70,82 +76,143 @@ def secure_file(file) -> dict:
     }
 
 
-def refresh_campaigns():
-    # get all active campaigns
-    campaigns = Campaign.query.filter(Campaign.start_date != None).all()
+def touch_skus(sku_ids):
+    """Mark skus whose counters were changed outside of the ORM"""
+    db.session.info.setdefault("touched_sku_ids", set()).update(sku_ids)
+
+
+@event.listens_for(Session, "before_flush")
+def _track_touched_skus(session, flush_context, instances):
+    sku_ids = [sku.id for sku in session.dirty
+               if isinstance(sku, Sku) and session.is_modified(sku)]
+
+    if sku_ids:
+        session.info.setdefault("touched_sku_ids", set()).update(sku_ids)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_touched_skus(session, previous_transaction):
+    session.info.pop("touched_sku_ids", None)
+
+
+def refresh_touched_campaigns(commit=True):
+    """Refresh the campaigns of skus changed by the current session"""
+    sku_ids = db.session.info.pop("touched_sku_ids", None)
 
-    for campaign in campaigns:
-        # get sku for campaign
-        sku = Sku.query.get(campaign.sku_id)
-        # get draw for campaign
-        draw = Draw.query.filter_by(campaign_id=campaign.id).first()
+    if sku_ids:
+        refresh_campaigns(sku_ids, commit=commit)
 
+
+def refresh_campaigns(sku_ids=None, commit=True):
+    """Re-evaluate campaign and draw state from sku counters.
+
+    Only campaigns of the given skus are refreshed when sku_ids is given,
+    otherwise every started campaign is (periodic reconciliation).
+    """
+    query = db.session.query(Campaign, Sku, Draw).join(
+        Sku, Sku.id == Campaign.sku_id).outerjoin(
+        Draw, Draw.campaign_id == Campaign.id).filter(
+        Campaign.start_date != None)
+
+    if sku_ids is not None:
+        query = query.filter(Campaign.sku_id.in_(list(sku_ids)))
+
+    for campaign, sku, draw in query.all():
         if sku.quantity != sku.number_sold and not campaign.is_active:
             # set campaign as inactive
             campaign.end_date = None
             campaign.is_active = True
-            campaign.update()
 
-            # set draw as inactive
-            draw.start_date = None
-            draw.end_date = None
-            draw.update()
+            # coupons may still change
+            drop_ticket_index(campaign.id)
+
+            if draw:
+                # set draw as inactive
+                draw.start_date = None
+                draw.end_date = None
 
         elif campaign.is_active:
             if sku.quantity == sku.number_delivered or sku.quantity == sku.number_sold:
                 # set campaign as inactive
-                campaign.end_date = datetime.now()
+                campaign.end_date = datetime.utcnow()
                 campaign.is_active = False
-                campaign.update()
+
+            if not draw:
+                continue
 
             if sku.quantity == sku.number_delivered:
                 # set draw as active
-                draw.start_date = datetime.now()
+                draw.start_date = datetime.utcnow()
                 draw.end_date = draw.start_date + timedelta(days=7)
-                draw.update()
 
             elif sku.quantity == sku.number_sold:
                 # set draw as inactive
                 draw.start_date = None
                 draw.end_date = None
-                draw.update()
+
+    if commit:
+        db.session.commit()
 
     # with open('cronjob.log', 'a') as f:
     #     f.write(
     #         f"Cronjob:refresh_campaigns[{datetime.now()}]:campaigns refreshed!\n")
 
 
-def lucky_draw():
-    draws = Draw.query.filter(
-        Draw.end_date >= datetime.now(), Draw.winner_id == None).all()
+def draw_winner(draw_id: int, commit=True):
+    """Pick the winner of a draw, every coupon of the campaign being one
+    ticket. Returns the winner's user id or None."""
+    draw = Draw.query.get(draw_id)
 
-    # with open('cronjob.log', 'a') as f:
-    #     f.write(
-    #         f"Cronjob:refresh_campaigns[{datetime.now()}]:Processing {len(draws)} draws!\n")
+    index = get_ticket_index(draw.campaign_id, commit)
+    if not index.tickets:
+        return None
 
-    for draw in draws:
-        campaign = Campaign.query.get(draw.campaign_id)
+    winner_id, coupon_id = pick_ticket_holder(index)
+    if coupon_id is None:
+        # coupons were deleted since the index was built
+        drop_ticket_index(draw.campaign_id)
+        index = build_ticket_index(draw.campaign_id, commit)
+        if not index.tickets:
+            return None
 
-        # get all users who have entered the campaign
-        users = User.query.join(
-            Coupon, User.id == Coupon.user_id).filter(
-            Coupon.campaign_id == campaign.id).all()
+        winner_id, coupon_id = pick_ticket_holder(index)
 
-        # get random user
-        winner = random.choice(users)
+    # another worker may have drawn it meanwhile
+    result = db.session.execute(Draw.__table__.update().where(
+        Draw.id == draw_id, Draw.winner_id == None).values(
+        winner_id=winner_id, winner_coupon_id=coupon_id))
 
-        # set winner
-        draw.winner_id = winner.id
-        draw.update()
+    if commit:
+        db.session.commit()
 
-        return winner
+    return winner_id if result.rowcount else None
 
-    # with open('cronjob.log', 'a') as f:
-    #     f.write(
-    #         f"Cronjob:refresh_campaigns[{datetime.now()}]:draws updated!\n")
 
-# @scheduler.task("interval", id="lucky_draw_task", seconds=0)
-# def lucky_draw_task():
-#     print("running task")
-#     refresh_campaigns()
-#     lucky_draw()
+def _draw_winner(app, draw_id: int):
+    with app.app_context():
+        try:
+            return draw_winner(draw_id)
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Draw {} failed: {}".format(draw_id, e))
+
+
+def lucky_draw() -> dict:
+    """Pick the winners of every draw past its end date, returns a
+    {draw_id: winner_id} dict"""
+    draw_ids = [draw_id for (draw_id,) in db.session.query(Draw.id).filter(
+        Draw.end_date <= datetime.utcnow(), Draw.winner_id == None)]
+
+    if not draw_ids:
+        return {}
+
+    app = current_app._get_current_object()
+    workers = min(len(draw_ids), app.config.get("LUCKY_DRAW_WORKERS") or 1)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        winners = dict(zip(draw_ids, executor.map(
+            lambda draw_id: _draw_winner(app, draw_id), draw_ids)))
+
+    logger.info("Processed {} draw(s)".format(len(draw_ids)))
+
+    return winners
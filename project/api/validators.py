@@ -58,7 +58,7 @@ def required_validator(request_data={}, required_fields=[], prefix=""):
 
 def email_validator(email:str):
     """
-    Validate email
+    Validate email, returns its normalized form
     """
     try:
         deliverability = bool(int(check_deliverability)) if check_deliverability else False
@@ -68,3 +68,5 @@ def email_validator(email:str):
 
     except Exception as e:        
         raise APIError(f"Invalid email: {email}, {str(e)}")
+
+    return email
@@ -0,0 +1,285 @@
+"""Background job worker.
+
+`manage.py worker` runs the maintenance jobs (campaign reconciliation, ticket
+indexes, lucky draws, archiving, inventory reconciliation, ledger compaction,
+expired cart reservations, waiting room tickets) on intervals outside of the
+request workers. Every job has a row in job_lock and a node runs a job only
+after taking its lease with a conditional UPDATE, so with several workers each
+run happens on one node and a crashed node's lease simply expires. Long jobs
+renew the lease between batches and stop once they lose it, see
+project/api/leases.py. Duration, errors and the backlog the job reports are
+stored on the row, see `manage.py jobs` and /admin/jobs.
+
+A dispatcher thread fires the campaign and draw timers of
+project/api/timers.py and dispatches the outbox events of
+project/api/outbox.py, waking up at least every TIMER_RESOLUTION_SECONDS
+whatever job is running. With --job only the named jobs run, run one worker
+without it for the timers and the outbox. A failing step is logged and
+rolled back like a failing job, the loops go on. Leases, timers, outbox
+events and campaign and draw dates are all in UTC (datetime.utcnow()).
+"""
+import os
+import time
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+from project import db
+from project.api.admission import sweep_waiting_rooms
+from project.api.archive import archive_data
+from project.api.idempotency import purge_idempotency_keys
+from project.api.inventory import compact_inventory, reconcile_inventory
+from project.api.leases import Lease, LeaseLost, holding
+from project.api.outbox import dispatch_outbox, pending_events, purge_outbox
+from project.api.reservations import expired_reservations, release_expired_reservations
+from project.api.tickets import build_ticket_indexes, unindexed_campaigns
+from project.api.timers import fire_due_timers, next_timer_at
+from project.api.utils import refresh_campaigns, lucky_draw
+from project.models import JobLock, Campaign, Draw, Sku
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """A named maintenance job and an optional backlog counter"""
+
+    def __init__(self, name: str, func, backlog=None):
+        self.name = name
+        self.func = func
+        self.backlog = backlog
+
+    def __repr__(self):
+        return f"Job {self.name}"
+
+
+def closing_campaigns() -> int:
+    """Active campaigns whose sku is sold out or delivered"""
+    return Campaign.query.join(Sku, Sku.id == Campaign.sku_id).filter(
+        Campaign.is_active == True,
+        or_(Sku.number_sold == Sku.quantity,
+            Sku.number_delivered == Sku.quantity)).count()
+
+
+def due_draws() -> int:
+    """Draws past their end date without a winner"""
+    return Draw.query.filter(Draw.end_date <= datetime.utcnow(),
+                             Draw.winner_id == None).count()
+
+
+JOBS = {job.name: job for job in (
+    Job("refresh_campaigns", refresh_campaigns, closing_campaigns),
+    Job("ticket_index", build_ticket_indexes, lambda: len(unindexed_campaigns())),
+    Job("lucky_draw", lucky_draw, due_draws),
+    Job("archive_data", archive_data),
+    Job("idempotency_keys", purge_idempotency_keys),
+    Job("outbox_purge", purge_outbox, pending_events),
+    Job("reconcile_inventory", reconcile_inventory),
+    Job("inventory_ledger", compact_inventory),
+    Job("cart_reaper", release_expired_reservations, expired_reservations),
+    Job("waiting_rooms", sweep_waiting_rooms),
+)}
+
+
+class Worker:
+    """Runs due jobs, one node per job run, and without a list of jobs the
+    timers and the outbox"""
+
+    def __init__(self, jobs: list = None, owner: str = None):
+        config = current_app.config
+        intervals = config.get("WORKER_JOB_INTERVALS") or {}
+
+        unknown = sorted(set(jobs or ()) - set(JOBS))
+        if unknown:
+            raise ValueError("Unknown job(s) {}, jobs are {}".format(
+                ", ".join(unknown), ", ".join(sorted(JOBS))))
+
+        disabled = sorted(name for name in jobs or () if not intervals.get(name))
+        if disabled:
+            raise ValueError("Job(s) {} have no interval in WORKER_JOB_INTERVALS".format(
+                ", ".join(disabled)))
+
+        self.jobs = [JOBS[name] for name in (jobs or JOBS)
+                     if intervals.get(name)]
+        self.dispatch = not jobs
+        self.intervals = intervals
+        self.lease = config.get("WORKER_LEASE_SECONDS")
+        self.poll = config.get("WORKER_POLL_SECONDS")
+        self.resolution = config.get("TIMER_RESOLUTION_SECONDS")
+        self.outbox_batch = config.get("OUTBOX_BATCH_SIZE")
+        self.owner = owner or "{}:{}".format(socket.gethostname(), os.getpid())
+        self.next_run = {}
+
+    def register(self):
+        """Create the job_lock rows of jobs run for the first time"""
+        for job in self.jobs:
+            if JobLock.query.get(job.name):
+                continue
+
+            try:
+                JobLock(job.name).insert()
+            except IntegrityError:
+                # registered by another node meanwhile
+                db.session.rollback()
+
+    def acquire(self, job: Job) -> bool:
+        """Take the lease of a job if it is due and not held by another node"""
+        now = datetime.utcnow()
+        interval = timedelta(seconds=self.intervals[job.name])
+
+        result = db.session.execute(JobLock.__table__.update().where(
+            JobLock.name == job.name,
+            or_(JobLock.locked_until == None, JobLock.locked_until < now),
+            or_(JobLock.last_started_at == None,
+                JobLock.last_started_at <= now - interval)
+        ).values(
+            owner=self.owner,
+            locked_until=now + timedelta(seconds=self.lease),
+            last_started_at=now
+        ))
+        db.session.commit()
+
+        return result.rowcount == 1
+
+    def release(self, job: Job, duration: float, error: str, backlog: int):
+        db.session.execute(JobLock.__table__.update().where(
+            JobLock.name == job.name,
+            JobLock.owner == self.owner
+        ).values(
+            locked_until=None,
+            last_finished_at=datetime.utcnow(),
+            last_duration=duration,
+            last_error=error,
+            backlog=backlog,
+            runs=JobLock.runs + 1
+        ))
+        db.session.commit()
+
+    def run_job(self, job: Job) -> bool:
+        """Run a job if this node wins its lease, returns whether it ran"""
+        if not self.acquire(job):
+            return False
+
+        error = None
+        started = time.perf_counter()
+        try:
+            with holding(Lease(job.name, self.owner, self.lease)):
+                job.func()
+        except LeaseLost as e:
+            # another node runs the job now, its report is not ours to write
+            db.session.rollback()
+            logger.warning(e)
+            return True
+        except Exception as e:
+            db.session.rollback()
+            logger.exception("Job {} failed".format(job.name))
+            error = str(e)
+        duration = time.perf_counter() - started
+
+        backlog = None
+        if job.backlog:
+            try:
+                backlog = job.backlog()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(e)
+
+        self.release(job, duration, error, backlog)
+        logger.info("Job {} finished in {:.3f}s, backlog {}".format(
+            job.name, duration, backlog))
+
+        return True
+
+    def run_pending(self) -> int:
+        """Run every job due on this node, returns the number of jobs run"""
+        ran = 0
+        for job in self.jobs:
+            now = time.monotonic()
+            if self.next_run.get(job.name, 0) > now:
+                continue
+
+            if self.run_job(job):
+                ran += 1
+                self.next_run[job.name] = now + self.intervals[job.name]
+            else:
+                self.next_run[job.name] = now + self.poll
+
+        return ran
+
+    def sleep_seconds(self) -> float:
+        """Sleep until the next timer, waking up at least every
+        TIMER_RESOLUTION_SECONDS"""
+        next_at = next_timer_at()
+        if not next_at:
+            return self.resolution
+
+        delay = (next_at - datetime.utcnow()).total_seconds()
+        return max(0, min(self.resolution, delay))
+
+    def run_step(self, name: str, func, default=0):
+        """Run a step of the loop, a failure is logged and rolled back"""
+        try:
+            return func()
+        except Exception:
+            db.session.rollback()
+            logger.exception("Worker step {} failed".format(name))
+            return default
+
+    def dispatch_once(self) -> float:
+        """Fire due timers and dispatch outbox events, returns the seconds
+        to sleep before the next round"""
+        self.run_step("timers", fire_due_timers)
+        dispatched = self.run_step("outbox", dispatch_outbox)
+
+        # keep draining a full outbox batch
+        if dispatched >= self.outbox_batch:
+            return 0
+        return self.run_step("sleep", self.sleep_seconds, self.resolution)
+
+    def dispatch_forever(self, app):
+        with app.app_context():
+            while True:
+                delay = self.dispatch_once()
+
+                # do not keep a transaction open while sleeping
+                db.session.remove()
+                time.sleep(delay)
+
+    def run_once(self) -> dict:
+        """Fire due timers, dispatch the outbox unless running named jobs
+        and run the due jobs once"""
+        self.register()
+
+        ran = {"timers": 0, "events": 0}
+        if self.dispatch:
+            ran["timers"] = self.run_step("timers", fire_due_timers)
+            ran["events"] = self.run_step("outbox", dispatch_outbox)
+        ran["jobs"] = self.run_step("jobs", self.run_pending)
+
+        return ran
+
+    def run_forever(self):
+        self.register()
+        logger.info("Worker {} running {}".format(
+            self.owner, ", ".join(job.name for job in self.jobs)))
+
+        # timers and outbox events are not held up by a long job
+        if self.dispatch:
+            threading.Thread(target=self.dispatch_forever, daemon=True,
+                             name="dispatcher",
+                             args=(current_app._get_current_object(),)).start()
+
+        while True:
+            self.run_step("jobs", self.run_pending)
+
+            db.session.remove()
+            time.sleep(self.poll)
+
+
+def job_status() -> list:
+    """Lease and last run report of every job"""
+    return [lock.to_json() for lock in JobLock.query.order_by(JobLock.name).all()]
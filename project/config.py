@@ -5,8 +5,8 @@ database_username = os.getenv("DATABASE_USERNAME")
 database_password = os.getenv("DATABASE_PASSWORD")
 host = os.getenv("HOST")
 
-# set database url
-database_path = "mysql://{}:{}@{}/{}".format(
+# set database url, DATABASE_URL overrides the mysql settings
+database_path = os.getenv("DATABASE_URL") or "mysql://{}:{}@{}/{}".format(
     database_username, database_password, host, database_name
 )
 # database_path = "sqlite:///db.sqlite3"
@@ -24,3 +24,126 @@ class Config:
     BCRYPT_LOG_ROUNDS = 13
     TOKEN_EXPIRATION_DAYS = 1
     TOKEN_EXPIRATION_SECONDS = 0
+
+    # password hashing, see project/passwords.py
+    BCRYPT_TARGET_MS = 250
+    BCRYPT_MIN_LOG_ROUNDS = 10
+    BCRYPT_MAX_LOG_ROUNDS = 15
+    PASSWORD_HASH_WORKERS = None
+    PASSWORD_HASH_QUEUE_DEPTH = 64
+    PASSWORD_HASH_TIMEOUT_SECONDS = 30
+
+    # bulk user import, see project/api/user_import.py
+    USER_IMPORT_BATCH_SIZE = 1000
+    USER_IMPORT_MAX_ERRORS = 1000
+
+    # per-request query budgets, see project/api/query_budget.py
+    QUERY_BUDGET_DEFAULT = 100
+    QUERY_BUDGETS = {
+        # a few statements per batch of USER_IMPORT_BATCH_SIZE users
+        "admin.import_users": None,
+    }
+    QUERY_BUDGET_RAISE = False
+    N_PLUS_ONE_THRESHOLD = 10
+    QUERY_COUNT_HEADER = False
+
+    # statement statistics, see project/api/sql_stats.py
+    SQL_STATS_ENABLED = os.getenv("SQL_STATS_ENABLED") == "1"
+    SQL_SLOW_QUERY_MS = 200
+    SQL_STATS_SAMPLE_SIZE = 500
+    SQL_STATS_PATH = os.getenv("SQL_STATS_PATH")
+    SQL_STATS_DUMP_SECONDS = 60
+
+    # archive tier, see project/api/archive.py
+    ARCHIVE_RETENTION_DAYS = 90
+    ARCHIVE_BATCH_SIZE = 1000
+
+    # background worker, see project/api/worker.py
+    WORKER_POLL_SECONDS = 5
+    WORKER_LEASE_SECONDS = 600
+    WORKER_JOB_INTERVALS = {
+        "refresh_campaigns": 300,
+        "ticket_index": 3600,
+        "lucky_draw": 3600,
+        "archive_data": 86400,
+        "idempotency_keys": 3600,
+        "outbox_purge": 86400,
+        "reconcile_inventory": 3600,
+        "inventory_ledger": 300,
+        "cart_reaper": 60,
+        "waiting_rooms": 10,
+    }
+    LUCKY_DRAW_WORKERS = 4
+
+    # Idempotency-Key header, see project/api/idempotency.py
+    IDEMPOTENCY_TTL_SECONDS = 86400
+    IDEMPOTENCY_WAIT_SECONDS = 10
+    # a claim older than this is left by a crashed request and taken over
+    IDEMPOTENCY_PROCESSING_TIMEOUT_SECONDS = 60
+
+    # transactional outbox, see project/api/outbox.py
+    OUTBOX_BATCH_SIZE = 100
+    OUTBOX_MAX_ATTEMPTS = 10
+    OUTBOX_RETENTION_DAYS = 7
+
+    # bulk order status changes, see project/api/order.py
+    ORDER_STATUS_BATCH_LIMIT = 1000
+
+    # carts being filled, see project/api/cart_store.py
+    CART_STORE_URL = os.getenv("CART_STORE_URL")
+    # allow the in-process store without debug mode, single process only
+    CART_STORE_LOCAL = False
+    CART_STORE_TTL_SECONDS = 7 * 86400
+    CART_BATCH_LIMIT = 50
+
+    # flash sale waiting rooms, see project/api/admission.py
+    ADMISSION_TTL_SECONDS = 600
+    ADMISSION_POLL_SECONDS = 5
+    ADMISSION_POLL_TIMEOUT_SECONDS = 30
+
+    # cart reservations, see project/api/reservations.py
+    CART_HOLD_MINUTES = 30
+    CART_REAPER_BATCH_SIZE = 500
+
+    # inventory ledger and reconciliation, see project/api/inventory.py
+    INVENTORY_LEDGER_BATCH_SIZE = 1000
+    INVENTORY_RECONCILE_REPAIR = False
+    INVENTORY_RECONCILE_BATCH_SIZE = 500
+
+    # coupon codes, see project/api/coupon_codes.py
+    COUPON_CODE_SECRET = os.getenv("COUPON_CODE_SECRET")
+    COUPON_CODE_BLOCK_SIZE = 1000
+
+    # campaign and draw timers, see project/api/timers.py
+    TIMER_RESOLUTION_SECONDS = 1
+    TIMER_BATCH_SIZE = 100
+    TIMER_MAX_ATTEMPTS = 5
+
+    # campaign ticket index, see project/api/tickets.py
+    TICKET_INDEX_BATCH_SIZE = 5000
+
+
+class BenchmarkConfig(Config):
+    """Configuration used by benchmarks/endpoints.py"""
+    SQLALCHEMY_DATABASE_URI = os.getenv(
+        "BENCHMARK_DATABASE_URL", "sqlite:///{}".format(os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            "benchmark.sqlite3")))
+    BCRYPT_LOG_ROUNDS = 4
+    BCRYPT_TARGET_MS = None
+    PASSWORD_HASH_WORKERS = 0
+    QUERY_COUNT_HEADER = True
+    SQL_STATS_ENABLED = False
+    COUPON_CODE_SECRET = "benchmark_secret"
+    CART_STORE_LOCAL = True
+
+
+class TestingConfig(Config):
+    """Configuration used by the test suite in tests/"""
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    BCRYPT_LOG_ROUNDS = 4
+    BCRYPT_TARGET_MS = None
+    PASSWORD_HASH_WORKERS = 0
+    SQL_STATS_ENABLED = False
+    COUPON_CODE_SECRET = "test_secret"
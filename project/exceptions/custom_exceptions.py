@@ -6,3 +6,7 @@ All other exceptions are properly managed by exception handlers
 
 class APIError(Exception):
 	pass
+
+
+class QueryBudgetError(Exception):
+	pass
@@ -1,6 +1,18 @@
-from .sku_model import Sku, Sku_Images, Sku_Stock, Prize, Campaign, Coupon
+from .sku_model import Sku, Sku_Images, Sku_Stock, Prize, Campaign, Coupon, CouponSequence
 from .user_model import User, Location, BlacklistToken
 from .cart_model import ShoppingCart, CartItem
 from .order_model import Order, Order_Sku
-from .draw_model import Draw
+from .draw_model import Draw, TicketIndex, TicketRange
 from .banner_model import Banners
+from .job_model import JobLock
+from .timer_model import ScheduledTask
+from .idempotency_model import IdempotencyKey
+from .outbox_model import OutboxEvent
+from .inventory_model import InventoryEntry
+from .archive_model import (
+    OrderArchive,
+    Order_SkuArchive,
+    CouponArchive,
+    ShoppingCartArchive,
+    CartItemArchive
+)
@@ -0,0 +1,251 @@
+import datetime
+from project import db
+from project.models.user_model import User, Location
+from project.models.sku_model import Campaign, Sku_Images, Sku_Stock
+
+
+class OrderArchive(db.Model):
+    """
+    OrderArchive Model: archived copy of Order
+    - id: int (id of the archived order)
+    - status: str
+
+    - total_quantity: int
+    - total_tax: float
+    - shipping_fee: float
+    - total_amount: float
+
+    - booking_date: datetime
+    - archived_at: datetime
+
+    - user_id: int
+    - location_id: int
+    """
+    __tablename__ = 'order_archive'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    status = db.Column(db.String(20), nullable=False)
+
+    total_quantity = db.Column(db.Integer, nullable=False, default=0)
+    total_tax = db.Column(db.Float, nullable=False, default=0.0)
+    shipping_fee = db.Column(db.Float, nullable=False, default=0.0)
+    total_amount = db.Column(db.Float, nullable=False, default=0.0)
+
+    booking_date = db.Column(db.DateTime, nullable=False)
+    archived_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'),
+                        nullable=False, index=True)
+    location_id = db.Column(db.Integer, db.ForeignKey(
+        'location.id'), nullable=False)
+
+    def __repr__(self):
+        return f"OrderArchive {self.id} {self.status} {self.booking_date} {self.user_id}"
+
+    def to_json(self, user: User = None, location: Location = None):
+        """user and location may be passed in when loaded in bulk"""
+        user = user or User.query.get(self.user_id)
+        location = location or Location.query.get(self.location_id)
+
+        return {
+            "id": self.id,
+            "user": user.to_json(),
+            "status": self.status,
+            "location": location.to_json() if location else None,
+            "booking_date": self.booking_date.strftime("%Y-%m-%d") if self.booking_date else None,
+            "total_tax": self.total_tax,
+            "shipping_fee": self.shipping_fee,
+            "total_amount": self.total_amount,
+            "total_quantity": self.total_quantity,
+            "archived": True
+        }
+
+
+class Order_SkuArchive(db.Model):
+    """
+    Order_SkuArchive Model: archived copy of Order_Sku
+    - id: int (id of the archived order sku)
+    - order_id: int
+    - quantity: int
+    - total_price: float
+    - sales_tax: float
+
+    - coupon_id: int
+    - campaign_id: int
+    - sku_stock_id: int
+    - sku_images_id: int
+
+    - archived_at: datetime
+    """
+    __tablename__ = 'order_sku_archive'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    sales_tax = db.Column(db.Float, nullable=False, default=0.0)
+    total_price = db.Column(db.Float, nullable=False, default=0.0)
+
+    order_id = db.Column(db.Integer, db.ForeignKey(
+        'order_archive.id'), nullable=False, index=True)
+    coupon_id = db.Column(db.Integer, db.ForeignKey(
+        'coupon_archive.id'), nullable=True)
+    campaign_id = db.Column(db.Integer, db.ForeignKey(
+        'campaign.id'), nullable=False)
+    sku_stock_id = db.Column(db.Integer, db.ForeignKey(
+        'sku_stock.id'), nullable=False)
+    sku_images_id = db.Column(db.Integer, db.ForeignKey(
+        'sku_images.id'), nullable=False)
+
+    archived_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+    def __repr__(self):
+        return f"Order_SkuArchive {self.id} {self.order_id} {self.quantity} {self.coupon_id}"
+
+    def to_json(self, preloaded: dict = None):
+        """preloaded, see preload_archived(), when serializing in bulk"""
+        preloaded = preloaded or preload_archived([self])
+
+        campaign = dict(preloaded['campaigns'][self.campaign_id])
+        campaign.pop('user')
+        campaign['sku'] = dict(campaign['sku'])
+        campaign['sku'].pop('sku_images')
+        campaign['sku'].pop('sku_stock')
+
+        campaign['sku']['sku_stock'] = preloaded['sku_stocks'][self.sku_stock_id].to_json()
+        campaign['sku']['sku_image'] = preloaded['sku_images'][self.sku_images_id].to_json()
+
+        coupon = preloaded['coupons'].get(self.coupon_id)
+
+        return {
+            "id": self.id,
+            "order_id": self.order_id,
+            "quantity": self.quantity,
+            "total_price": self.total_price,
+            "sales_tax": self.sales_tax,
+            "coupon": coupon.to_json(preloaded) if coupon else None,
+            "campaign": campaign
+        }
+
+
+class CouponArchive(db.Model):
+    """
+    CouponArchive Model: archived copy of Coupon
+    - id: int (id of the archived coupon)
+    - user_id: int
+    - campaign_id: int
+    - sku_images_id: int
+    - sku_stock_id: int
+
+    - code: str
+    - create_date: datetime
+    - amount_paid: float
+    - is_redeemed: bool
+    - archived_at: datetime
+    """
+    __tablename__ = 'coupon_archive'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'),
+                        nullable=False, index=True)
+    campaign_id = db.Column(db.Integer, db.ForeignKey(
+        'campaign.id'), nullable=False)
+    sku_images_id = db.Column(db.Integer, db.ForeignKey(
+        'sku_images.id'), nullable=False)
+    sku_stock_id = db.Column(db.Integer, db.ForeignKey(
+        'sku_stock.id'), nullable=False)
+
+    code = db.Column(db.String(128), unique=True, nullable=False)
+    create_date = db.Column(db.DateTime, nullable=False)
+    amount_paid = db.Column(db.Float, nullable=False)
+    is_redeemed = db.Column(db.Boolean, nullable=False, default=False)
+    archived_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+    def __repr__(self):
+        return f"CouponArchive {self.id} {self.code}"
+
+    def update(self):
+        db.session.commit()
+
+    def to_json(self, preloaded: dict = None):
+        """preloaded, see preload_archived(), when serializing in bulk"""
+        preloaded = preloaded or preload_archived([self])
+        campaign = preloaded['campaigns'][self.campaign_id]
+
+        return {
+            "id": self.id,
+            "sku_name": campaign['sku']['name'],
+            "amount_paid": self.amount_paid,
+            "sku_image": preloaded['sku_images'][self.sku_images_id].to_json(),
+            "sku_stock": preloaded['sku_stocks'][self.sku_stock_id].to_json(),
+            "coupon_code": self.code,
+            "is_redeemed": self.is_redeemed,
+            "purchased on": self.create_date.strftime("%d %b, %Y %I:%M%p"),
+            "archived": True
+        }
+
+
+class ShoppingCartArchive(db.Model):
+    """
+    ShoppingCartArchive Model: archived copy of an inactive ShoppingCart
+    """
+    __tablename__ = 'shopping_cart_archive'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    is_active = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    checkedout_at = db.Column(db.DateTime, nullable=True)
+    archived_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+    def __repr__(self):
+        return f"ShoppingCartArchive {self.id} {self.user_id}"
+
+
+class CartItemArchive(db.Model):
+    """
+    CartItemArchive Model: archived copy of a CartItem of an inactive cart
+    """
+    __tablename__ = 'cart_item_archive'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    cart_id = db.Column(db.Integer, db.ForeignKey(
+        'shopping_cart_archive.id'), nullable=False, index=True)
+    campaign_id = db.Column(db.Integer, db.ForeignKey(
+        'campaign.id'), nullable=False)
+    sku_stock_id = db.Column(db.Integer, db.ForeignKey(
+        'sku_stock.id'), nullable=False)
+    sku_images_id = db.Column(db.Integer, db.ForeignKey(
+        'sku_images.id'), nullable=False)
+
+    quantity = db.Column(db.Integer, nullable=False)
+    reservation_date = db.Column(db.DateTime, nullable=False)
+    archived_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+    def __repr__(self):
+        return f"CartItemArchive {self.id} {self.cart_id} {self.campaign_id} {self.quantity}"
+
+
+def preload_archived(rows) -> dict:
+    """Campaigns as json, sku stocks, sku images and coupons of archived
+    order items or coupons, with one query each and one Campaign.to_json per
+    campaign instead of per row"""
+    coupon_ids = {row.coupon_id for row in rows if getattr(row, 'coupon_id', None)}
+    coupons = {coupon.id: coupon for coupon in CouponArchive.query.filter(
+        CouponArchive.id.in_(coupon_ids))} if coupon_ids else {}
+
+    rows = list(rows) + list(coupons.values())
+
+    return {
+        'campaigns': {campaign.id: campaign.to_json() for campaign in Campaign.query.filter(
+            Campaign.id.in_({row.campaign_id for row in rows}))},
+        'sku_stocks': {sku_stock.id: sku_stock for sku_stock in Sku_Stock.query.options(
+            db.undefer(Sku_Stock.stock_level)).filter(
+            Sku_Stock.id.in_({row.sku_stock_id for row in rows}))},
+        'sku_images': {sku_image.id: sku_image for sku_image in Sku_Images.query.filter(
+            Sku_Images.id.in_({row.sku_images_id for row in rows}))},
+        'coupons': coupons
+    }
@@ -57,7 +57,7 @@ class CartItem(db.Model):
     quantity = db.Column(db.Integer, nullable=False)
 
     reservation_date = db.Column(
-        db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+        db.DateTime, nullable=False, default=datetime.datetime.utcnow, index=True)
 
     def __init__(self, cart_id: int, campaign_id: int, sku_stock_id: int, sku_images_id: int, quantity: int):
         self.cart_id = cart_id
@@ -86,7 +86,7 @@ class CartItem(db.Model):
         campaign['sku'].pop('sku_images')
         campaign.pop('user')
 
-        campaign['sku']['sku_stock'] = Sku_Stock.query.get(
+        campaign['sku']['sku_stock'] = Sku_Stock.query.options(db.undefer(Sku_Stock.stock_level)).get(
             self.sku_stock_id).to_json()
         campaign['sku']['sku_image'] = Sku_Images.query.get(
             self.sku_images_id).to_json()
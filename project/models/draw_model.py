@@ -12,6 +12,7 @@ class Draw(db.Model):
     - start_date: datetime
     - end_date: datetime
     - winner_id: int
+    - winner_coupon_id: int (id of the winning coupon, kept when archived)
     - campaign_id: int
     """
 
@@ -23,9 +24,11 @@ class Draw(db.Model):
     end_date = db.Column(db.DateTime, nullable=True)
 
     campaign_id = db.Column(db.Integer,
-                            db.ForeignKey('campaign.id'), nullable=False)
+                            db.ForeignKey('campaign.id'), nullable=False, index=True)
     winner_id = db.Column(db.Integer,
                           db.ForeignKey('user.id'), nullable=True)
+    # no foreign key, coupons move to coupon_archive
+    winner_coupon_id = db.Column(db.Integer, nullable=True, index=True)
 
     def __init__(self, campaign_id: int, video_url: str = None):
         self.campaign_id = campaign_id
@@ -61,3 +64,54 @@ class Draw(db.Model):
             "winner": winner.to_json() if winner else None,
             "campaign": campaign
         }
+
+
+class TicketIndex(db.Model):
+    """
+    TicketIndex Model: ticket total of a closed campaign, see TicketRange
+    - campaign_id: int
+    - tickets: int (number of coupons, 0 if it closed without any)
+    - created_at: datetime
+    """
+
+    __tablename__ = 'ticket_index'
+
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaign.id'),
+                            primary_key=True, autoincrement=False)
+    tickets = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.datetime.utcnow)
+
+    def __init__(self, campaign_id: int, tickets: int):
+        self.campaign_id = campaign_id
+        self.tickets = tickets
+
+    def __repr__(self):
+        return f"TicketIndex {self.campaign_id} {self.tickets}"
+
+
+class TicketRange(db.Model):
+    """
+    TicketRange Model: tickets held by a user in a closed campaign, the
+    user holds tickets [ticket_end - ticket_count, ticket_end)
+    - campaign_id: int
+    - user_id: int
+    - ticket_count: int
+    - ticket_end: int (prefix sum of ticket_count ordered by user_id)
+    """
+
+    __tablename__ = 'ticket_range'
+    __table_args__ = (
+        db.Index('ix_ticket_range_campaign_id_ticket_end',
+                 'campaign_id', 'ticket_end'),
+    )
+
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaign.id'),
+                            primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'),
+                        primary_key=True, autoincrement=False)
+    ticket_count = db.Column(db.Integer, nullable=False)
+    ticket_end = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f"TicketRange {self.campaign_id} {self.user_id} {self.ticket_end}"
@@ -0,0 +1,61 @@
+import datetime
+from project import db
+
+
+class IdempotencyKey(db.Model):
+    """
+    IdempotencyKey Model: response stored for an Idempotency-Key header
+    - id: int
+    - key: str
+    - user_id: int
+    - request_hash: str (sha256 of method, path and body)
+
+    - status: str (processing, done)
+    - response_status: int
+    - response_body: str
+
+    - created_at: datetime
+    - claimed_at: datetime (when the request now processing it started)
+    - expires_at: datetime
+    """
+    __tablename__ = 'idempotency_key'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'key', name='uq_idempotency_key_user_id_key'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    key = db.Column(db.String(128), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    request_hash = db.Column(db.String(64), nullable=False)
+
+    status = db.Column(db.String(20), nullable=False, default='processing')
+    response_status = db.Column(db.Integer, nullable=True)
+    response_body = db.Column(db.Text, nullable=True)
+
+    created_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.datetime.utcnow)
+    claimed_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __init__(self, key: str, user_id: int, request_hash: str,
+                 expires_at: datetime.datetime):
+        self.key = key
+        self.user_id = user_id
+        self.request_hash = request_hash
+        self.expires_at = expires_at
+        self.status = 'processing'
+
+    def __repr__(self):
+        return f"IdempotencyKey {self.id} {self.user_id} {self.key} {self.status}"
+
+    def insert(self):
+        db.session.add(self)
+        db.session.commit()
+
+    def update(self):
+        db.session.commit()
+
+    def delete(self):
+        db.session.delete(self)
+        db.session.commit()
@@ -0,0 +1,54 @@
+import datetime
+from project import db
+
+
+class InventoryEntry(db.Model):
+    """
+    InventoryEntry Model: immutable stock change of a Sku_Stock, see
+    project/api/inventory.py
+    - id: int
+    - sku_stock_id: int
+    - kind: str (reserve, release, sale, return, restock)
+    - quantity: int (signed change of the stock)
+    - ref_id: int (id of the cart item or order)
+    - applied: bool (folded into Sku_Stock.stock)
+    - created_at: datetime
+    """
+    __tablename__ = 'inventory_entry'
+    __table_args__ = (
+        db.Index('ix_inventory_entry_sku_stock_id_applied_id',
+                 'sku_stock_id', 'applied', 'id'),
+        db.Index('ix_inventory_entry_applied_id', 'applied', 'id'),
+    )
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'),
+                   primary_key=True, autoincrement=True)
+    # no foreign key, entries outlive the stocks replaced by a sku update
+    sku_stock_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(20), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    ref_id = db.Column(db.Integer, nullable=True)
+    applied = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.datetime.utcnow, index=True)
+
+    def __init__(self, sku_stock_id: int, quantity: int, kind: str, ref_id: int = None):
+        self.sku_stock_id = sku_stock_id
+        self.quantity = quantity
+        self.kind = kind
+        self.ref_id = ref_id
+        self.applied = False
+
+    def __repr__(self):
+        return f"InventoryEntry {self.id} {self.sku_stock_id} {self.kind} {self.quantity}"
+
+    def to_json(self):
+        return {
+            "id": self.id,
+            "sku_stock_id": self.sku_stock_id,
+            "kind": self.kind,
+            "quantity": self.quantity,
+            "ref_id": self.ref_id,
+            "applied": self.applied,
+            "created_at": self.created_at.isoformat() if self.created_at else None
+        }
@@ -0,0 +1,56 @@
+from project import db
+
+
+class JobLock(db.Model):
+    """
+    JobLock Model: lease and run report of a background job
+    - name: str (job name)
+    - owner: str (worker holding the lease)
+    - locked_until: datetime (lease expiry)
+
+    - last_started_at: datetime
+    - last_finished_at: datetime
+    - last_duration: float (seconds)
+    - last_error: str
+    - backlog: int (pending items reported by the job)
+    - runs: int
+    """
+    __tablename__ = 'job_lock'
+
+    name = db.Column(db.String(64), primary_key=True)
+    owner = db.Column(db.String(128), nullable=True)
+    locked_until = db.Column(db.DateTime, nullable=True)
+
+    last_started_at = db.Column(db.DateTime, nullable=True)
+    last_finished_at = db.Column(db.DateTime, nullable=True)
+    last_duration = db.Column(db.Float, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    backlog = db.Column(db.Integer, nullable=True)
+    runs = db.Column(db.Integer, nullable=False, default=0)
+
+    def __init__(self, name: str):
+        self.name = name
+        self.runs = 0
+
+    def __repr__(self):
+        return f"JobLock {self.name} {self.owner} {self.locked_until}"
+
+    def insert(self):
+        db.session.add(self)
+        db.session.commit()
+
+    def update(self):
+        db.session.commit()
+
+    def to_json(self):
+        return {
+            "name": self.name,
+            "owner": self.owner,
+            "locked_until": self.locked_until.isoformat() if self.locked_until else None,
+            "last_started_at": self.last_started_at.isoformat() if self.last_started_at else None,
+            "last_finished_at": self.last_finished_at.isoformat() if self.last_finished_at else None,
+            "last_duration": self.last_duration,
+            "last_error": self.last_error,
+            "backlog": self.backlog,
+            "runs": self.runs
+        }
@@ -62,9 +62,10 @@ class Order(db.Model):
         db.session.delete(self)
         db.session.commit()
 
-    def to_json(self):
-        user = User.query.get(self.user_id)
-        location = Location.query.get(self.location_id)
+    def to_json(self, user: User = None, location: Location = None):
+        """user and location may be passed in when loaded in bulk"""
+        user = user or User.query.get(self.user_id)
+        location = location or Location.query.get(self.location_id)
 
         return {
             "id": self.id,
@@ -88,7 +89,7 @@ class Order_Sku(db.Model):
     - total_price: float
     - sales_tax: float
 
-    - coupon_id: int
+    - coupon_id: int (set once the order_created event is processed)
     - campaign_id: int
     - sku_stock_id: int
     - sku_images_id: int
@@ -104,7 +105,7 @@ class Order_Sku(db.Model):
     order_id = db.Column(db.Integer, db.ForeignKey(
         'order.id'), nullable=False)
     coupon_id = db.Column(db.Integer, db.ForeignKey(
-        'coupon.id'), nullable=False)
+        'coupon.id'), nullable=True)
     campaign_id = db.Column(db.Integer, db.ForeignKey(
         'campaign.id'), nullable=False)
     sku_stock_id = db.Column(db.Integer, db.ForeignKey(
@@ -143,7 +144,7 @@ class Order_Sku(db.Model):
         campaign['sku'].pop('sku_images')
         campaign['sku'].pop('sku_stock')
 
-        campaign['sku']['sku_stock'] = Sku_Stock.query.get(
+        campaign['sku']['sku_stock'] = Sku_Stock.query.options(db.undefer(Sku_Stock.stock_level)).get(
             self.sku_stock_id).to_json()
         campaign['sku']['sku_image'] = Sku_Images.query.get(
             self.sku_images_id).to_json()
@@ -154,6 +155,6 @@ class Order_Sku(db.Model):
             "quantity": self.quantity,
             "total_price": self.total_price,
             "sales_tax": self.sales_tax,
-            "coupon": Coupon.query.get(self.coupon_id).to_json(),
+            "coupon": Coupon.query.get(self.coupon_id).to_json() if self.coupon_id else None,
             "campaign": campaign
         }
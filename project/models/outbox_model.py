@@ -0,0 +1,60 @@
+import json
+import datetime
+from project import db
+
+
+class OutboxEvent(db.Model):
+    """
+    OutboxEvent Model: side effect enqueued with the transaction that caused
+    it, see project/api/outbox.py
+    - id: int
+    - event_type: str
+    - payload: str (json)
+    - status: str (pending, done, failed)
+
+    - attempts: int
+    - last_error: str
+
+    - created_at: datetime
+    - available_at: datetime
+    - processed_at: datetime
+    """
+    __tablename__ = 'outbox_event'
+    __table_args__ = (
+        db.Index('ix_outbox_event_status_available_at', 'status', 'available_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    event_type = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')
+
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+
+    created_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.datetime.utcnow)
+    available_at = db.Column(db.DateTime, nullable=False,
+                             default=datetime.datetime.utcnow)
+    processed_at = db.Column(db.DateTime, nullable=True)
+
+    def __init__(self, event_type: str, payload: dict):
+        self.event_type = event_type
+        self.payload = json.dumps(payload)
+        self.status = 'pending'
+        self.attempts = 0
+
+    def __repr__(self):
+        return f"OutboxEvent {self.id} {self.event_type} {self.status}"
+
+    def to_json(self):
+        return {
+            "id": self.id,
+            "event_type": self.event_type,
+            "payload": json.loads(self.payload),
+            "status": self.status,
+            "attempts": self.attempts,
+            "last_error": self.last_error,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "processed_at": self.processed_at.isoformat() if self.processed_at else None
+        }
@@ -1,6 +1,7 @@
 import datetime
 from project import db
 from project.models.user_model import User
+from project.models.inventory_model import InventoryEntry
 
 
 class Sku(db.Model):
@@ -94,7 +95,8 @@ class Sku(db.Model):
             "number_delivered": self.number_delivered,
             "size_chart": self.size_chart,
             "sku_images": [image.to_json() for image in Sku_Images.query.filter_by(sku_id=self.id).all()],
-            "sku_stock": [stock.to_json() for stock in Sku_Stock.query.filter_by(sku_id=self.id).all()],
+            "sku_stock": [stock.to_json() for stock in Sku_Stock.query.options(
+                db.undefer(Sku_Stock.stock_level)).filter_by(sku_id=self.id).all()],
         }
 
 
@@ -143,7 +145,9 @@ class Sku_Stock(db.Model):
     Sku_Stock Model
         - id: int
         - size: str
-        - stock: int
+        - stock: int (snapshot of the applied inventory entries)
+        - stock_level: int (stock plus the unapplied inventory entries,
+          deferred, undefer it where the live level is needed)
         - color: str
         - sku_id: int
     """
@@ -155,6 +159,13 @@ class Sku_Stock(db.Model):
     stock = db.Column(db.Integer, nullable=False)
     color = db.Column(db.String(128), nullable=False)
 
+    stock_level = db.column_property(
+        stock + db.select(db.func.coalesce(db.func.sum(InventoryEntry.quantity), 0)).where(
+            InventoryEntry.sku_stock_id == id,
+            InventoryEntry.applied == False).correlate_except(
+            InventoryEntry).scalar_subquery(),
+        deferred=True)
+
     def __repr__(self):
         return f"Sku_Stock {self.id} {self.size} {self.stock} {self.color}"
 
@@ -179,7 +190,7 @@ class Sku_Stock(db.Model):
         return {
             "id": self.id,
             "size": self.size,
-            "stock": self.stock,
+            "stock": self.stock_level,
             "color": self.color,
             "sku_id": self.sku_id
         }
@@ -245,6 +256,8 @@ class Campaign(db.Model):
         - description: str
         - image (url): str
         - threshold: int
+        - cart_hold_minutes: int (CART_HOLD_MINUTES if not set)
+        - admission_limit: int (concurrent purchasers of a flash sale, none if not set)
 
         - start_date: datetime
         - end_date: datetime
@@ -267,6 +280,10 @@ class Campaign(db.Model):
     description = db.Column(db.Text, nullable=True)
     image = db.Column(db.String(128), nullable=False)
     threshold = db.Column(db.Integer, nullable=False)
+    # how long cart items hold their stock, see project/api/reservations.py
+    cart_hold_minutes = db.Column(db.Integer, nullable=True)
+    # flash sale waiting room, see project/api/admission.py
+    admission_limit = db.Column(db.Integer, nullable=True)
 
     is_active = db.Column(db.Boolean, nullable=False, default=False)
 
@@ -318,6 +335,8 @@ class Campaign(db.Model):
             "description": self.description,
             "image": self.image,
             "threshold": self.threshold,
+            "cart_hold_minutes": self.cart_hold_minutes,
+            "admission_limit": self.admission_limit,
             "is_active": self.is_active,
             "start_date": self.start_date.strftime("%Y-%m-%d") if self.start_date else None,
             "end_date": self.end_date.strftime("%Y-%m-%d") if self.end_date else None
@@ -344,7 +363,7 @@ class Coupon(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
     campaign_id = db.Column(db.Integer, db.ForeignKey(
-        "campaign.id"), nullable=False)
+        "campaign.id"), nullable=False, index=True)
     sku_images_id = db.Column(db.Integer, db.ForeignKey(
         "sku_images.id"), nullable=False)
     sku_stock_id = db.Column(db.Integer, db.ForeignKey(
@@ -359,7 +378,7 @@ class Coupon(db.Model):
         return f"Coupon {self.id} {self.code}"
 
     def __init__(self, user_id: int, campaign_id: int, sku_images_id: int,
-                 sku_stock_id: int, create_date: str, amount_paid: float):
+                 sku_stock_id: int, create_date: str, amount_paid: float, code: str):
 
         self.user_id = user_id
         self.campaign_id = campaign_id
@@ -367,8 +386,7 @@ class Coupon(db.Model):
         self.sku_stock_id = sku_stock_id
         self.create_date = create_date
         self.amount_paid = amount_paid
-        self.code = Coupon.generate_code(
-            user_id, campaign_id, sku_stock_id, sku_images_id, create_date)
+        self.code = code
 
     def insert(self):
         db.session.add(self)
@@ -392,21 +410,24 @@ class Coupon(db.Model):
             "sku_name": campaign['sku']['name'],
             "amount_paid": self.amount_paid,
             "sku_image": Sku_Images.query.get(self.sku_images_id).to_json(),
-            "sku_stock": Sku_Stock.query.get(self.sku_stock_id).to_json(),
+            "sku_stock": Sku_Stock.query.options(db.undefer(Sku_Stock.stock_level)).get(
+                self.sku_stock_id).to_json(),
             "coupon_code": self.code,
             "is_redeemed": self.is_redeemed,
             "purchased on": self.create_date.strftime("%d %b, %Y %I:%M%p")
         }
 
-    @staticmethod
-    def generate_code(user_id: int, campaign_id: int, sku_stock_id: int, sku_images_id: int, create_date: str):
-        upper_case_letters = [chr(i) for i in range(65, 91)]
 
-        letters = upper_case_letters[campaign_id % 26] + \
-            upper_case_letters[sku_stock_id % 26] + \
-            upper_case_letters[sku_images_id % 26]
+class CouponSequence(db.Model):
+    """
+    CouponSequence Model: next coupon serial, see project/api/coupon_codes.py
+        - name: str
+        - next_value: int
+    """
+    __tablename__ = "coupon_sequence"
 
-        digits = str(user_id) + str(campaign_id % 10) + \
-            str(sku_images_id % 10) + str(sku_stock_id % 10)
+    name = db.Column(db.String(32), primary_key=True)
+    next_value = db.Column(db.BigInteger, nullable=False, default=1)
 
-        return f"{letters}-{digits}-{create_date.strftime('%m%d')}-{create_date.strftime('%M%S')}"
+    def __repr__(self):
+        return f"CouponSequence {self.name} {self.next_value}"
@@ -0,0 +1,39 @@
+from project import db
+
+
+class ScheduledTask(db.Model):
+    """
+    ScheduledTask Model: pending timer, see project/api/timers.py
+    - id: int
+    - kind: str (handler name)
+    - ref_id: int (id of the campaign or draw)
+    - run_at: datetime
+
+    - attempts: int
+    - last_error: str
+    """
+    __tablename__ = 'scheduled_task'
+    __table_args__ = (
+        db.UniqueConstraint('kind', 'ref_id', name='uq_scheduled_task_kind_ref_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String(32), nullable=False)
+    ref_id = db.Column(db.Integer, nullable=False)
+    run_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+
+    def __repr__(self):
+        return f"ScheduledTask {self.id} {self.kind} {self.ref_id} {self.run_at}"
+
+    def to_json(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "ref_id": self.ref_id,
+            "run_at": self.run_at.isoformat(),
+            "attempts": self.attempts,
+            "last_error": self.last_error
+        }
@@ -2,7 +2,8 @@ import jwt
 import datetime
 from flask import current_app
 
-from project import db, bcrypt
+from project import db
+from project.passwords import UNUSABLE_PASSWORD, hash_password
 
 """
     Create Models
@@ -34,14 +35,14 @@ class User(db.Model):
         return f"User {self.id} {self.username}"
 
     def __init__(self, firstname: str, lastname: str, email: str,
-                 mobile_no: str, password: str,
+                 mobile_no: str, password: str = None,
                  role: str = "user", is_admin: bool = False):
         self.firstname = firstname
         self.lastname = lastname
         self.email = email
         self.mobile_no = mobile_no
-        self.password = bcrypt.generate_password_hash(
-            password, current_app.config.get("BCRYPT_LOG_ROUNDS")).decode()
+        # accounts without a password (Google sign-ups) cannot log in with one
+        self.password = hash_password(password) if password else UNUSABLE_PASSWORD
         self.role = role
         self.is_admin = is_admin
 
@@ -104,6 +105,10 @@ class User(db.Model):
             return 'Invalid token. Please log in again.'
 
 
+# case-insensitive email lookups, e.g. the duplicate check of the user import
+db.Index('ix_user_email_lower', db.func.lower(User.email))
+
+
 class Location(db.Model):
     __tablename__ = "location"
 
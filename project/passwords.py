@@ -0,0 +1,188 @@
+"""Password hashing off the request threads.
+
+bcrypt hashes and checks run in a process pool of PASSWORD_HASH_WORKERS
+processes (all cores if not set, 0 runs them in the calling thread) so that
+a burst of logins cannot starve the other requests of the app process of
+CPU. At most PASSWORD_HASH_QUEUE_DEPTH calls of a process may be queued or
+running, further ones fail at once with an APIError instead of piling up.
+Bulk hashing with hash_passwords() spreads a list over the pool and is not
+bounded, it is meant for admin imports.
+
+With BCRYPT_TARGET_MS set the cost factor is calibrated when the app starts:
+the highest cost whose hash takes at most that long on this machine, kept
+between BCRYPT_MIN_LOG_ROUNDS and BCRYPT_MAX_LOG_ROUNDS, replaces
+BCRYPT_LOG_ROUNDS. A hash whose cost is below the current one or more than
+one above it is rehashed on the next successful login, the slack keeps
+nodes calibrating one apart from rehashing every login.
+
+Hashes are compatible with the ones of flask_bcrypt.
+"""
+import os
+import time
+import hmac
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import bcrypt
+from flask import current_app
+
+from project.exceptions import APIError
+
+logger = logging.getLogger(__name__)
+
+# stored for accounts without a password (Google sign-ups), matches nothing
+UNUSABLE_PASSWORD = "!"
+
+# cost of the calibration sample
+CALIBRATION_ROUNDS = 8
+
+
+def _hash(password: bytes, rounds: int) -> str:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode()
+
+
+def _check(hashed: bytes, password: bytes) -> bool:
+    return hmac.compare_digest(bcrypt.hashpw(password, hashed), hashed)
+
+
+class PasswordPool:
+    """Process pool with a bounded number of pending calls"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.executor = None
+        self.workers = None
+        self.slots = None
+
+    def _start(self, workers, depth: int):
+        with self.lock:
+            # a forked app process needs its own pool
+            if self.pid != os.getpid():
+                self.workers = workers or os.cpu_count() or 1
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+                self.slots = threading.BoundedSemaphore(depth)
+                self.pid = os.getpid()
+
+    def run(self, func, *args):
+        config = current_app.config
+        workers = config.get("PASSWORD_HASH_WORKERS")
+        if workers == 0:
+            return func(*args)
+
+        if self.pid != os.getpid():
+            self._start(workers, config.get("PASSWORD_HASH_QUEUE_DEPTH"))
+
+        if not self.slots.acquire(blocking=False):
+            raise APIError("Server is busy, please try again")
+
+        try:
+            future = self.executor.submit(func, *args)
+        except Exception:
+            self.slots.release()
+            raise
+
+        future.add_done_callback(lambda _: self.slots.release())
+        try:
+            return future.result(timeout=config.get("PASSWORD_HASH_TIMEOUT_SECONDS"))
+        except FutureTimeoutError:
+            # a call still queued gives its slot back
+            future.cancel()
+            raise APIError("Server is busy, please try again")
+
+    def map(self, func, *iterables) -> list:
+        config = current_app.config
+        workers = config.get("PASSWORD_HASH_WORKERS")
+        if workers == 0:
+            return list(map(func, *iterables))
+
+        if self.pid != os.getpid():
+            self._start(workers, config.get("PASSWORD_HASH_QUEUE_DEPTH"))
+
+        # a few chunks per process, sending items one by one costs more
+        # than hashing cheap ones
+        iterables = [list(iterable) for iterable in iterables]
+        chunksize = max(1, len(iterables[0]) // (self.workers * 4))
+        return list(self.executor.map(func, *iterables, chunksize=chunksize))
+
+
+pool = PasswordPool()
+
+
+def _bytes(value) -> bytes:
+    return value.encode("utf-8") if isinstance(value, str) else value
+
+
+def log_rounds() -> int:
+    return current_app.config.get("BCRYPT_LOG_ROUNDS")
+
+
+def hash_password(password: str, rounds: int = None) -> str:
+    """bcrypt hash of a password"""
+    if not password:
+        raise ValueError("Password must be non-empty.")
+
+    return pool.run(_hash, _bytes(password), rounds or log_rounds())
+
+
+def hash_passwords(passwords: list, rounds: int = None) -> list:
+    """bcrypt hashes of many passwords, spread over all pool processes"""
+    rounds = rounds or log_rounds()
+    return pool.map(_hash, [_bytes(password) for password in passwords],
+                    [rounds] * len(passwords))
+
+
+def check_password(hashed: str, password: str) -> bool:
+    """Whether a password matches its stored hash"""
+    if not hashed or not hashed.startswith("$2") or not password:
+        return False
+
+    return pool.run(_check, _bytes(hashed), _bytes(password))
+
+
+def hash_rounds(hashed: str):
+    """Cost factor of a hash, None if it is not a bcrypt hash"""
+    try:
+        return int(hashed.split("$")[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def needs_rehash(hashed: str) -> bool:
+    rounds = hash_rounds(hashed)
+    return rounds is not None and not log_rounds() <= rounds <= log_rounds() + 1
+
+
+def calibrate_rounds(target_ms: float, min_rounds: int, max_rounds: int) -> int:
+    """Highest cost factor hashing within target_ms on this machine"""
+    password = os.urandom(16).hex().encode()
+    elapsed = min(_timed(password) for _ in range(3))
+
+    rounds = CALIBRATION_ROUNDS
+    # every extra round doubles the time
+    while rounds < max_rounds and elapsed * 2 <= target_ms / 1000.0:
+        elapsed *= 2
+        rounds += 1
+
+    return max(min_rounds, rounds)
+
+
+def _timed(password: bytes) -> float:
+    start = time.perf_counter()
+    _hash(password, CALIBRATION_ROUNDS)
+    return time.perf_counter() - start
+
+
+def init_passwords(app):
+    """Calibrate the cost factor of the app if BCRYPT_TARGET_MS is set"""
+    target_ms = app.config.get("BCRYPT_TARGET_MS")
+    if not target_ms:
+        return
+
+    rounds = calibrate_rounds(target_ms, app.config.get("BCRYPT_MIN_LOG_ROUNDS"),
+                              app.config.get("BCRYPT_MAX_LOG_ROUNDS"))
+    app.config["BCRYPT_LOG_ROUNDS"] = rounds
+    app.logger.info("bcrypt cost factor calibrated to {} for {} ms".format(
+        rounds, target_ms))
@@ -0,0 +1,143 @@
+import os
+
+os.environ["APP_SETTINGS"] = "project.config.TestingConfig"
+for name in ("IMAGEKIT_PRIVATE_KEY", "IMAGEKIT_PUBLIC_KEY"):
+    os.environ.setdefault(name, "test")
+os.environ.setdefault("IMAGEKIT_URL_ENDPOINT", "https://imagekit.test/")
+
+from datetime import datetime  # noqa: E402
+
+import pytest  # noqa: E402
+
+from project import create_app, db  # noqa: E402
+from project.api.coupon_codes import generate_codes  # noqa: E402
+from project.models import (  # noqa: E402
+    User, Location, Sku, Sku_Images, Sku_Stock, Prize, Campaign, Draw,
+    Coupon, Order, Order_Sku
+)
+
+PASSWORD = "greaterthaneight"
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "file_database: run on a database file, for tests of concurrent threads")
+
+
+@pytest.fixture
+def app(request, tmp_path):
+    app = create_app()
+    if request.node.get_closest_marker("file_database"):
+        # every thread shares the one connection of the in-memory database
+        app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///{}".format(tmp_path / "test.db")
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def auth_headers(user: User) -> dict:
+    token = user.encode_auth_token(user.id)
+    if isinstance(token, bytes):
+        token = token.decode()
+
+    return {"Authorization": "Bearer {}".format(token)}
+
+
+@pytest.fixture
+def make_user(app):
+    """Create a user with a location, returns (user, auth headers)"""
+    count = [0]
+
+    def make(email=None, mobile_no=None, is_admin=False):
+        count[0] += 1
+        user = User(firstname="Test", lastname="User",
+                    email=email or "user{}@example.com".format(count[0]),
+                    mobile_no=mobile_no or str(3000000000 + count[0]),
+                    password=PASSWORD, is_admin=is_admin)
+        user.insert()
+
+        Location(address="1 Main Street", city="City", state="State",
+                 country="Country", zipcode="12345", user_id=user.id).insert()
+
+        return user, auth_headers(user)
+
+    return make
+
+
+@pytest.fixture
+def make_campaign(app):
+    """Create an active campaign with one sku variant, returns (campaign,
+    sku, sku image, sku stock)"""
+
+    def make(owner, quantity=10, price=5.0, **fields):
+        sku = Sku(name="Sku", description="Sku", category="category",
+                  price=price, quantity=quantity, size_chart="chart",
+                  number_sold=0, number_delivered=0, user_id=owner.id)
+        sku.insert()
+
+        image = Sku_Images(image="image", sku_id=sku.id)
+        image.insert()
+        stock = Sku_Stock(size="M", stock=quantity, color="red", sku_id=sku.id)
+        stock.insert()
+
+        prize = Prize(name="Prize", description="Prize", image="image",
+                      user_id=owner.id)
+        prize.insert()
+
+        campaign = Campaign(user_id=owner.id, sku_id=sku.id, prize_id=prize.id,
+                            threshold=80, name="Campaign {}".format(sku.id),
+                            description="Campaign", image="image",
+                            start_date=None, end_date=None)
+        campaign.is_active = True
+        for name, value in fields.items():
+            setattr(campaign, name, value)
+        campaign.insert()
+
+        Draw(campaign_id=campaign.id).insert()
+
+        return campaign, sku, image, stock
+
+    return make
+
+
+@pytest.fixture
+def make_order(app):
+    """Create an issued order of one item and its coupon, returns the order"""
+
+    def make(user, campaign, image, stock, quantity=1, status="pending"):
+        location = Location.query.filter_by(user_id=user.id).first()
+        order = Order(user_id=user.id, location_id=location.id,
+                      total_quantity=quantity, total_tax=0.0, shipping_fee=0.0,
+                      total_amount=5.0 * quantity, booking_date=datetime.utcnow())
+        order.status = status
+        db.session.add(order)
+
+        coupon = Coupon(user_id=user.id, campaign_id=campaign.id,
+                        sku_images_id=image.id, sku_stock_id=stock.id,
+                        create_date=datetime.utcnow(), amount_paid=5.0 * quantity,
+                        code=generate_codes(1)[0])
+        db.session.add(coupon)
+        db.session.flush()
+
+        db.session.add(Order_Sku(order_id=order.id, quantity=quantity,
+                                 total_price=5.0 * quantity, sales_tax=0.0,
+                                 coupon_id=coupon.id, campaign_id=campaign.id,
+                                 sku_stock_id=stock.id, sku_images_id=image.id))
+        db.session.commit()
+
+        return order
+
+    return make
+
+
+def cart_item(campaign, image, stock, quantity=1) -> dict:
+    return {"campaign_id": campaign.id, "sku_images_id": image.id,
+            "sku_stock_id": stock.id, "quantity": quantity}
@@ -0,0 +1,35 @@
+from project.api.admission import WaitingRoom
+from project.api.cart_store import kv_backend
+
+
+def admitted(room) -> int:
+    return len(kv_backend().hgetall(room.admitted_key))
+
+
+def test_abandoned_tickets_do_not_admit_past_the_limit(app):
+    room = WaitingRoom(kv_backend(), 1)
+    room.open(2)
+
+    assert room.join(1)["admitted"]
+    assert room.join(2)["admitted"]
+    for user_id in range(3, 8):
+        assert not room.join(user_id)["admitted"]
+
+    # users 5 to 7 stop polling
+    for user_id in range(5, 8):
+        kv_backend().hset(room.polls_key, str(user_id), "0")
+    assert room.sweep() == 3
+
+    # their tickets left, but no admitted user did
+    assert not room.join(3)["admitted"]
+    assert not room.join(4)["admitted"]
+    assert admitted(room) == 2
+
+    assert room.leave(1)
+    assert room.join(3)["admitted"]
+    assert not room.join(4)["admitted"]
+    assert admitted(room) == 2
+
+    assert room.leave(2)
+    assert room.join(4)["admitted"]
+    assert admitted(room) == 2
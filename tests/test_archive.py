@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta
+
+from flask import g
+
+from project import db
+from project.api.archive import archive_orders
+from project.api.coupon_codes import generate_codes
+from project.models import Coupon, Draw, Order_Sku, OrderArchive
+
+
+def add_item(order, campaign, image, stock):
+    """Another item and coupon in an order made by make_order"""
+    extra = Coupon(user_id=order.user_id, campaign_id=campaign.id,
+                   sku_images_id=image.id, sku_stock_id=stock.id,
+                   create_date=datetime.utcnow(), amount_paid=5.0,
+                   code=generate_codes(1)[0])
+    db.session.add(extra)
+    db.session.flush()
+    db.session.add(Order_Sku(order_id=order.id, quantity=1, total_price=5.0,
+                             sales_tax=0.0, coupon_id=extra.id, campaign_id=campaign.id,
+                             sku_stock_id=stock.id, sku_images_id=image.id))
+    db.session.commit()
+
+
+def archive(campaign, winner):
+    """Close the campaign and draw it, then archive its delivered orders"""
+    campaign.is_active = False
+    campaign.end_date = datetime.utcnow() - timedelta(days=1)
+    Draw.query.filter_by(campaign_id=campaign.id).one().winner_id = winner.id
+    db.session.commit()
+
+    return archive_orders(datetime.utcnow() + timedelta(days=1), 100)
+
+
+def query_count(client, path, headers) -> tuple:
+    # the requests share the test's app context, its counter and session
+    g.pop("_query_stats", None)
+    db.session.remove()
+    response = client.get(path, headers=headers)
+    return response, int(response.headers["X-Query-Count"])
+
+
+def test_archived_items_are_serialized_without_a_query_each(app, client, make_user,
+                                                            make_campaign, make_order):
+    app.config["QUERY_COUNT_HEADER"] = True
+    owner, _ = make_user(is_admin=True)
+    campaign, _, image, stock = make_campaign(owner)
+    small, small_headers = make_user()
+    large, large_headers = make_user()
+    small_order = make_order(small, campaign, image, stock, status="delivered")
+    large_order = make_order(large, campaign, image, stock, status="delivered")
+    for _ in range(3):
+        add_item(large_order, campaign, image, stock)
+    small_order_id, large_order_id, stock_id = small_order.id, large_order.id, stock.id
+
+    assert archive(campaign, small) == 2
+    assert OrderArchive.query.count() == 2
+
+    response, small_queries = query_count(
+        client, "/order/get/{}?include_archived=1".format(small_order_id), small_headers)
+    assert len(response.json["data"]["order_skus"]) == 1
+
+    response, large_queries = query_count(
+        client, "/order/get/{}?include_archived=1".format(large_order_id), large_headers)
+    items = response.json["data"]["order_skus"]
+    assert len(items) == 4
+    assert {item["campaign"]["sku"]["sku_stock"]["id"] for item in items} == {stock_id}
+    assert all(item["coupon"]["archived"] for item in items)
+    assert large_queries == small_queries
+
+    response, small_queries = query_count(
+        client, "/order/get_coupon?include_archived=1", small_headers)
+    assert len(response.json["data"]["coupon"]) == 1
+
+    response, large_queries = query_count(
+        client, "/order/get_coupon?include_archived=1", large_headers)
+    assert len(response.json["data"]["coupon"]) == 4
+    assert large_queries == small_queries
@@ -0,0 +1,60 @@
+from datetime import datetime
+
+from project import db
+from project.api.order import adjust_order_stock, create_order_from_cart
+from project.api.outbox import dispatch_outbox
+from project.api.shopping import persist_cart
+from project.api.utils import refresh_touched_campaigns
+from project.models import Campaign, Sku
+
+from tests.conftest import cart_item
+
+
+def set_sold(sku, number_sold: int, active: bool):
+    """Change a sku behind the session's back, its campaign not refreshed"""
+    db.session.execute(Sku.__table__.update().where(
+        Sku.id == sku.id).values(number_sold=number_sold))
+    db.session.execute(Campaign.__table__.update().where(
+        Campaign.sku_id == sku.id).values(is_active=active))
+    db.session.commit()
+
+
+def test_an_order_refreshes_the_campaigns_of_its_skus_only(make_user, make_campaign):
+    owner, _ = make_user(is_admin=True)
+    ordered, _, image, stock = make_campaign(owner, quantity=1, start_date=datetime.utcnow())
+    other, other_sku, _, _ = make_campaign(owner, quantity=1, start_date=datetime.utcnow())
+    set_sold(other_sku, 1, active=True)
+    user, _ = make_user()
+
+    shopping_cart = persist_cart(user.id, [cart_item(ordered, image, stock)])
+    shopping_cart.checkedout_at = datetime.utcnow()
+    create_order_from_cart(user.id, shopping_cart, 0.0)
+    db.session.commit()
+
+    # the order_created handler changes the sold counter through the ORM
+    assert dispatch_outbox() == 1
+
+    assert Campaign.query.get(ordered.id).is_active is False
+    assert Campaign.query.get(ordered.id).end_date is not None
+    assert Campaign.query.get(other.id).is_active is True
+    assert "touched_sku_ids" not in db.session.info
+
+
+def test_a_cancelled_order_reopens_the_campaign_of_its_sku_only(make_user, make_campaign,
+                                                                make_order):
+    owner, _ = make_user(is_admin=True)
+    ordered, ordered_sku, image, stock = make_campaign(
+        owner, quantity=1, start_date=datetime.utcnow())
+    other, other_sku, _, _ = make_campaign(owner, quantity=1, start_date=datetime.utcnow())
+    user, _ = make_user()
+    order = make_order(user, ordered, image, stock)
+    set_sold(ordered_sku, 1, active=False)
+    set_sold(other_sku, 0, active=False)
+
+    # the sold counter is changed with a core UPDATE and touch_skus()
+    adjust_order_stock([order.id], "cancelled")
+    refresh_touched_campaigns()
+
+    assert Sku.query.get(ordered_sku.id).number_sold == 0
+    assert Campaign.query.get(ordered.id).is_active is True
+    assert Campaign.query.get(other.id).is_active is False
@@ -0,0 +1,50 @@
+import pytest
+from flask import Flask
+
+from project import db
+from project.api.cart_store import cart_store, init_cart_store, move_carts_to_store
+from project.api.inventory import record_stock
+from project.models import CartItem, ShoppingCart, Sku_Stock
+
+
+def test_store_url_is_required_outside_testing_and_debug():
+    app = Flask(__name__)
+    app.config.update(TESTING=False, DEBUG=False, CART_STORE_URL=None)
+
+    with pytest.raises(RuntimeError, match="CART_STORE_URL"):
+        init_cart_store(app)
+
+    app.config["DEBUG"] = True
+    init_cart_store(app)
+
+    app.config.update(DEBUG=False, CART_STORE_LOCAL=True)
+    init_cart_store(app)
+
+    app.config.update(CART_STORE_LOCAL=False, CART_STORE_URL="redis://localhost:6379/0")
+    init_cart_store(app)
+
+
+def test_relational_carts_are_moved_to_the_store(client, make_user, make_campaign):
+    owner, _ = make_user(is_admin=True)
+    campaign, _, image, stock = make_campaign(owner, quantity=5)
+    user, headers = make_user()
+
+    # a cart filled before the store, its items held their stock
+    shopping_cart = ShoppingCart(user_id=user.id)
+    db.session.add(shopping_cart)
+    db.session.flush()
+    db.session.add(CartItem(cart_id=shopping_cart.id, campaign_id=campaign.id,
+                            sku_stock_id=stock.id, sku_images_id=image.id, quantity=2))
+    record_stock(stock.id, -2, "reserve")
+    db.session.commit()
+
+    assert move_carts_to_store(batch_size=1) == 1
+
+    assert ShoppingCart.query.count() == 0
+    assert Sku_Stock.query.get(stock.id).stock_level == 5
+    assert [item["quantity"] for item in cart_store().items(user.id)] == [2]
+
+    response = client.put("/shopping/update_cart/{}".format(stock.id),
+                          json={"quantity": 3}, headers=headers)
+    assert response.json["status"] is True
+    assert cart_store().get_item(user.id, stock.id)["quantity"] == 3
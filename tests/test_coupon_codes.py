@@ -0,0 +1,46 @@
+import pytest
+from flask import Flask
+
+from project.api.coupon_codes import (
+    encode_code, generate_codes, init_coupon_codes, is_valid_code, verify_code
+)
+
+
+def test_codes_are_unique_and_signed(app):
+    codes = generate_codes(50)
+
+    assert len(set(codes)) == 50
+    assert all(verify_code(code) for code in codes)
+
+
+def test_forged_and_legacy_codes(app):
+    code = encode_code(12345)
+    forged = code[:-1] + ("A" if code[-1] != "A" else "B")
+
+    assert verify_code(code)
+    assert not verify_code(forged)
+    assert not verify_code(encode_code(12345, b"another secret"))
+    assert is_valid_code("GEN-42")
+    assert not is_valid_code("not a code")
+
+
+def test_secret_is_required_outside_testing_and_debug():
+    app = Flask(__name__)
+    app.config.update(TESTING=False, DEBUG=False, SECRET_KEY="app_secret",
+                      COUPON_CODE_SECRET=None)
+
+    with pytest.raises(RuntimeError, match="COUPON_CODE_SECRET"):
+        init_coupon_codes(app)
+
+    app.config["DEBUG"] = True
+    init_coupon_codes(app)
+
+    app.config.update(DEBUG=False, COUPON_CODE_SECRET="secret")
+    init_coupon_codes(app)
+
+
+def test_codes_are_not_signed_without_a_secret(app):
+    app.config.update(TESTING=False, COUPON_CODE_SECRET=None)
+
+    with pytest.raises(RuntimeError):
+        generate_codes(1)
@@ -0,0 +1,26 @@
+from sqlalchemy import func
+
+from project import db
+from project.api.cart_store import cart_store
+from project.api.coupon_codes import verify_code
+from project.api.data_generator import DataGenerator
+from project.models import Coupon, InventoryEntry, ShoppingCart, Sku_Stock
+
+
+def test_generated_data_matches_the_app(app):
+    generator = DataGenerator(seed=1, batch_size=50)
+    generator.generate(users=20, skus=3, campaigns=2, orders=40, carts=5)
+
+    assert all(verify_code(code) for (code,) in db.session.query(Coupon.code))
+
+    # the snapshots include the whole ledger
+    ledger = dict(db.session.query(InventoryEntry.sku_stock_id,
+                                   func.sum(InventoryEntry.quantity)).group_by(
+        InventoryEntry.sku_stock_id))
+    for stock in Sku_Stock.query.all():
+        assert stock.stock == ledger[stock.id]
+        assert stock.stock_level == stock.stock
+
+    assert ShoppingCart.query.count() == 0
+    carts = [user_id for user_id in generator.user_ids if cart_store().count(user_id)]
+    assert len(carts) == 5
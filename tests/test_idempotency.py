@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta
+
+import pytest
+from flask import jsonify, request
+
+from project import db
+from project.api.authentications import authenticate
+from project.api.idempotency import _reclaim, idempotent, request_hash
+from project.models import IdempotencyKey
+
+
+@pytest.fixture
+def calls(app):
+    """An idempotent endpoint echoing its payload, returns the calls made"""
+    calls = []
+
+    @authenticate
+    @idempotent
+    def echo(user_id):
+        calls.append(request.get_json())
+        return jsonify({'status': True, 'call': len(calls)}), 200
+
+    app.add_url_rule("/test/echo", "echo", echo, methods=["POST"])
+    return calls
+
+
+def claim(app, user, key, payload, claimed_at):
+    """Leave a claim processing as a request still running, or crashed"""
+    with app.test_request_context("/test/echo", method="POST", json=payload):
+        hashed = request_hash()
+
+    stored = IdempotencyKey(key, user.id, hashed, datetime.utcnow() + timedelta(days=1))
+    stored.claimed_at = claimed_at
+    stored.insert()
+
+
+def test_a_retry_gets_the_stored_response(client, make_user, calls):
+    _, headers = make_user()
+    headers["Idempotency-Key"] = "retry"
+
+    first = client.post("/test/echo", json={"quantity": 1}, headers=headers)
+    second = client.post("/test/echo", json={"quantity": 1}, headers=headers)
+
+    assert len(calls) == 1
+    assert second.status_code == 200
+    assert second.json == first.json
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+
+
+def test_a_key_reused_for_another_request_is_rejected(client, make_user, calls):
+    _, headers = make_user()
+    headers["Idempotency-Key"] = "reused"
+
+    client.post("/test/echo", json={"quantity": 1}, headers=headers)
+    response = client.post("/test/echo", json={"quantity": 2}, headers=headers)
+
+    assert response.status_code == 422
+    assert response.json["status"] is False
+    assert calls == [{"quantity": 1}]
+
+
+def test_a_request_in_progress_is_not_run_twice(app, client, make_user, calls):
+    user, headers = make_user()
+    headers["Idempotency-Key"] = "in-progress"
+    app.config["IDEMPOTENCY_WAIT_SECONDS"] = 0.2
+    claim(app, user, "in-progress", {"quantity": 1}, datetime.utcnow())
+
+    response = client.post("/test/echo", json={"quantity": 1}, headers=headers)
+
+    assert response.status_code == 409
+    assert calls == []
+
+
+def test_a_stale_claim_is_taken_over(app, client, make_user, calls):
+    user, headers = make_user()
+    headers["Idempotency-Key"] = "crashed"
+    claimed_at = datetime.utcnow() - timedelta(
+        seconds=app.config["IDEMPOTENCY_PROCESSING_TIMEOUT_SECONDS"] + 1)
+    claim(app, user, "crashed", {"quantity": 1}, claimed_at)
+
+    response = client.post("/test/echo", json={"quantity": 1}, headers=headers)
+
+    assert response.status_code == 200
+    assert calls == [{"quantity": 1}]
+
+    db.session.rollback()
+    stored = IdempotencyKey.query.filter_by(user_id=user.id, key="crashed").one()
+    assert stored.status == 'done'
+    assert stored.claimed_at > claimed_at
+
+    replayed = client.post("/test/echo", json={"quantity": 1}, headers=headers)
+    assert replayed.headers["Idempotent-Replayed"] == "true"
+    assert len(calls) == 1
+
+
+def test_a_stale_claim_is_taken_over_by_one_retry(app, make_user):
+    user, _ = make_user()
+    claimed_at = datetime.utcnow() - timedelta(hours=1)
+    claim(app, user, "raced", {"quantity": 1}, claimed_at)
+
+    with app.test_request_context():
+        first = IdempotencyKey.query.filter_by(key="raced").one()
+        assert _reclaim(first) is True
+
+        # a second retry still holding the stale claim loses
+        first.claimed_at = claimed_at
+        db.session.expunge(first)
+        assert _reclaim(first) is False
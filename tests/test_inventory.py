@@ -0,0 +1,69 @@
+import pytest
+
+from project import db
+from project.api.inventory import compact_inventory, locked_stock_levels, record_stock
+from project.api.shopping import persist_cart
+from project.exceptions import APIError
+from project.models import InventoryEntry, Sku_Stock
+
+from tests.conftest import cart_item
+
+
+def test_entries_committed_late_are_compacted(make_user, make_campaign):
+    owner, _ = make_user(is_admin=True)
+    campaign, _, image, stock = make_campaign(owner, quantity=10)
+
+    record_stock(stock.id, -2, "reserve")
+    db.session.commit()
+    record_stock(stock.id, -3, "reserve")
+    db.session.commit()
+
+    # the later entry was applied first, as when the earlier one commits late
+    late, applied = InventoryEntry.query.order_by(InventoryEntry.id).all()
+    applied.applied = True
+    Sku_Stock.query.get(stock.id).stock -= 3
+    db.session.commit()
+
+    assert compact_inventory() == 1
+
+    db.session.expire_all()
+    sku_stock = Sku_Stock.query.get(stock.id)
+    assert sku_stock.stock == 5
+    assert sku_stock.stock_level == 5
+    assert InventoryEntry.query.filter_by(applied=False).count() == 0
+    assert compact_inventory() == 0
+
+
+def test_checkout_reads_the_stock_after_locking_it(make_user, make_campaign):
+    owner, _ = make_user(is_admin=True)
+    campaign, _, image, stock = make_campaign(owner, quantity=3)
+    user, _ = make_user()
+
+    record_stock(stock.id, -2, "reserve")
+    db.session.commit()
+
+    assert locked_stock_levels([stock.id]) == {stock.id: 1}
+
+    with pytest.raises(APIError, match="Not enough stock"):
+        persist_cart(user.id, [cart_item(campaign, image, stock, quantity=2)])
+    db.session.rollback()
+
+    persist_cart(user.id, [cart_item(campaign, image, stock, quantity=1)])
+    db.session.commit()
+
+    assert Sku_Stock.query.get(stock.id).stock_level == 0
+
+
+def test_the_stock_level_is_only_loaded_where_needed(client, make_user, make_campaign):
+    owner, headers = make_user(is_admin=True)
+    campaign, _, image, stock = make_campaign(owner, quantity=4)
+    sku_stock_id = stock.id
+    record_stock(sku_stock_id, -1, "reserve")
+    db.session.commit()
+    db.session.expunge_all()
+
+    assert "stock_level" not in Sku_Stock.query.get(sku_stock_id).__dict__
+
+    response = client.get("/admin/inventory/{}".format(sku_stock_id), headers=headers)
+    assert response.json["data"]["sku_stock"]["stock"] == 3
+    assert response.json["data"]["snapshot"] == {"stock": 4, "unapplied": -1}
@@ -0,0 +1,23 @@
+import os
+
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from flask import current_app
+from flask_migrate import downgrade, stamp, upgrade
+
+from project import db
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(__file__)), "migrations")
+
+
+def test_migrations_match_the_models(app):
+    # the schema of create-db, taken back to the one before the migrations
+    db.session.remove()
+    stamp(directory=MIGRATIONS)
+    downgrade(directory=MIGRATIONS, revision="base")
+    upgrade(directory=MIGRATIONS)
+
+    with db.engine.connect() as connection:
+        context = MigrationContext.configure(
+            connection, opts=current_app.extensions["migrate"].configure_args)
+        assert compare_metadata(context, db.metadata) == []
@@ -0,0 +1,162 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import OperationalError
+
+from project import db
+from project.api import order as order_api
+from project.api.order import create_order_from_cart
+from project.api.outbox import dispatch_outbox
+from project.api.shopping import persist_cart
+from project.models import Coupon, Order, Order_Sku, OutboxEvent, Sku
+
+from tests.conftest import cart_item
+
+
+def test_list_orders_loads_users_and_locations_at_once(app, client, make_user,
+                                                       make_campaign, make_order):
+    app.config["QUERY_COUNT_HEADER"] = True
+    owner, _ = make_user(is_admin=True)
+    campaign, _, image, stock = make_campaign(owner)
+    for _ in range(5):
+        user, _ = make_user()
+        make_order(user, campaign, image, stock)
+
+    response = client.get("/order/list")
+
+    assert len(response.json["data"]["orders"]) == 5
+    assert response.json["data"]["orders"][0]["location"]["city"] == "City"
+    assert int(response.headers["X-Query-Count"]) == 3
+
+
+def test_order_status_requires_the_owner_or_an_admin(client, make_user,
+                                                     make_campaign, make_order):
+    owner, admin_headers = make_user(is_admin=True)
+    campaign, _, image, stock = make_campaign(owner)
+    user, headers = make_user()
+    _, other_headers = make_user()
+    order = make_order(user, campaign, image, stock)
+    path = "/order/status/{}".format(order.id)
+
+    assert client.get(path).status_code == 401
+    assert client.get(path, headers=other_headers).json["status"] is False
+    assert client.get(path, headers=headers).json["status"] is True
+    assert client.get(path, headers=admin_headers).json["status"] is True
+
+
+def test_users_may_only_cancel_or_return_their_orders(client, make_user,
+                                                      make_campaign, make_order):
+    owner, admin_headers = make_user(is_admin=True)
+    campaign, _, image, stock = make_campaign(owner)
+    user, headers = make_user()
+    paid = make_order(user, campaign, image, stock)
+    pending = make_order(user, campaign, image, stock)
+
+    response = client.put("/order/status/{}".format(paid.id),
+                          json={"status": "paid"}, headers=headers)
+    assert "permission" in response.json["message"]
+
+    response = client.put("/order/status/{}".format(paid.id),
+                          json={"status": "paid"}, headers=admin_headers)
+    assert response.json["status"] is True
+
+    response = client.put("/order/status/{}".format(pending.id),
+                          json={"status": "returned"}, headers=headers)
+    assert response.json["message"] == "Invalid status change from pending to returned"
+
+    response = client.put("/order/status/{}".format(pending.id),
+                          json={"status": "cancelled"}, headers=headers)
+    assert response.json["status"] is True
+
+
+def test_bulk_status_reports_database_errors(client, make_user, make_campaign,
+                                             make_order, monkeypatch):
+    owner, admin_headers = make_user(is_admin=True)
+    campaign, _, image, stock = make_campaign(owner)
+    user, _ = make_user()
+    order_ids = [make_order(user, campaign, image, stock).id for _ in range(3)]
+
+    execute = db.session.execute
+
+    def fail_updates(statement, *args, **kwargs):
+        if getattr(statement, "is_update", False):
+            raise OperationalError("UPDATE", {}, Exception("lock wait timeout"))
+        return execute(statement, *args, **kwargs)
+
+    monkeypatch.setattr(db.session, "execute", fail_updates)
+
+    response = client.put("/order/status", json={"order_ids": order_ids, "status": "paid"},
+                          headers=admin_headers)
+
+    assert response.status_code == 200
+    assert response.json["status"] is False
+    assert response.json["message"] == "Orders could not be updated, please try again"
+
+    monkeypatch.undo()
+    assert {order.status for order in Order.query.all()} == {"pending"}
+
+
+def place_order(make_user, make_campaign):
+    """An order of two skus, its order_created event not dispatched yet"""
+    owner, _ = make_user(is_admin=True)
+    first_campaign, first_sku, first_image, first_stock = make_campaign(owner, quantity=5)
+    second_campaign, second_sku, second_image, second_stock = make_campaign(owner, quantity=5)
+    user, _ = make_user()
+
+    shopping_cart = persist_cart(user.id, [
+        cart_item(first_campaign, first_image, first_stock, quantity=2),
+        cart_item(second_campaign, second_image, second_stock, quantity=1)])
+    shopping_cart.checkedout_at = datetime.utcnow()
+    order = create_order_from_cart(user.id, shopping_cart, 0.0)
+    db.session.commit()
+
+    return user, order, first_sku, second_sku
+
+
+def test_order_created_issues_coupons_and_counts_sales(make_user, make_campaign):
+    user, order, first_sku, second_sku = place_order(make_user, make_campaign)
+    assert Coupon.query.count() == 0
+
+    assert dispatch_outbox() == 1
+
+    order_skus = Order_Sku.query.filter_by(order_id=order.id).all()
+    coupons = Coupon.query.filter_by(user_id=user.id).all()
+    assert len(coupons) == 2
+    assert {order_sku.coupon_id for order_sku in order_skus} == {coupon.id for coupon in coupons}
+    assert sorted(coupon.amount_paid for coupon in coupons) == [5.0, 10.0]
+    assert Sku.query.get(first_sku.id).number_sold == 2
+    assert Sku.query.get(second_sku.id).number_sold == 1
+
+    # delivered again, nothing is issued twice
+    OutboxEvent.query.update({"status": "pending"})
+    db.session.commit()
+    assert dispatch_outbox() == 1
+    assert Coupon.query.count() == 2
+    assert Sku.query.get(first_sku.id).number_sold == 2
+
+
+def test_a_failed_order_created_event_is_retried(make_user, make_campaign, monkeypatch):
+    user, order, first_sku, _ = place_order(make_user, make_campaign)
+    generate_codes = order_api.generate_codes
+
+    def unavailable(count):
+        raise RuntimeError("code generator unavailable")
+
+    monkeypatch.setattr(order_api, "generate_codes", unavailable)
+    assert dispatch_outbox() == 0
+
+    event = OutboxEvent.query.one()
+    assert (event.status, event.attempts) == ("pending", 1)
+    assert "code generator unavailable" in event.last_error
+    assert Coupon.query.count() == 0
+    assert Sku.query.get(first_sku.id).number_sold == 0
+
+    # the backoff went by
+    monkeypatch.setattr(order_api, "generate_codes", generate_codes)
+    event.available_at = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+
+    assert dispatch_outbox() == 1
+    assert OutboxEvent.query.one().status == "done"
+    assert Coupon.query.filter_by(user_id=user.id).count() == 2
+    assert Order_Sku.query.filter_by(order_id=order.id, coupon_id=None).count() == 0
+    assert Sku.query.get(first_sku.id).number_sold == 2
@@ -0,0 +1,27 @@
+import os
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+from project.exceptions import APIError
+from project.passwords import PasswordPool
+
+
+class StuckExecutor:
+    def submit(self, func, *args):
+        return Future()
+
+
+def test_timed_out_hash_is_an_api_error(app):
+    app.config.update(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_TIMEOUT_SECONDS=0.01)
+    pool = PasswordPool()
+    pool.pid = os.getpid()
+    pool.executor = StuckExecutor()
+    pool.slots = threading.BoundedSemaphore(1)
+
+    with pytest.raises(APIError, match="Server is busy"):
+        pool.run(len, "password")
+
+    # the slot of the cancelled call is free again
+    assert pool.slots.acquire(blocking=False)
@@ -0,0 +1,118 @@
+import re
+from datetime import datetime
+
+from flask import g
+
+from project import db
+from project.api.coupon_codes import generate_codes
+from project.models import Coupon, Draw, User
+from project.models.archive_model import CouponArchive
+
+
+def make_coupon(user, campaign, image, stock) -> Coupon:
+    coupon = Coupon(user_id=user.id, campaign_id=campaign.id,
+                    sku_images_id=image.id, sku_stock_id=stock.id,
+                    create_date=datetime.now(), amount_paid=5.0,
+                    code=generate_codes(1)[0])
+    db.session.add(coupon)
+    db.session.commit()
+    return coupon
+
+
+def archive(coupon: Coupon):
+    db.session.execute(CouponArchive.__table__.insert().values(
+        id=coupon.id, user_id=coupon.user_id, campaign_id=coupon.campaign_id,
+        sku_images_id=coupon.sku_images_id, sku_stock_id=coupon.sku_stock_id,
+        code=coupon.code, create_date=coupon.create_date,
+        amount_paid=coupon.amount_paid, is_redeemed=False,
+        archived_at=datetime.utcnow()))
+    db.session.delete(coupon)
+    db.session.commit()
+
+
+def win(campaign, user, coupon=None):
+    """Draw the campaign, a draw without its coupon as recorded before"""
+    draw = Draw.query.filter_by(campaign_id=campaign.id).one()
+    draw.winner_id = user.id
+    draw.winner_coupon_id = coupon.id if coupon else None
+    db.session.commit()
+
+
+def test_redeem_live_coupon_once(client, make_user, make_campaign):
+    owner, _ = make_user(is_admin=True)
+    user, headers = make_user()
+    campaign, _, image, stock = make_campaign(owner)
+    code = make_coupon(user, campaign, image, stock).code
+
+    response = client.post("/prize/redeem-coupon", json={"coupon_code": code},
+                           headers=headers)
+    assert response.json["message"] == "Sorry, Try your luck next time!"
+
+    response = client.post("/prize/redeem-coupon", json={"coupon_code": code},
+                           headers=headers)
+    assert response.json["message"] == "Coupon is already redeemed"
+
+
+def test_redeem_archived_winning_coupon(client, make_user, make_campaign):
+    owner, _ = make_user(is_admin=True)
+    user, headers = make_user()
+    campaign, _, image, stock = make_campaign(owner)
+    coupon = make_coupon(user, campaign, image, stock)
+    coupon_id, code = coupon.id, coupon.code
+
+    draw = Draw.query.filter_by(campaign_id=campaign.id).one()
+    draw.winner_id = user.id
+    draw.winner_coupon_id = coupon_id
+    db.session.commit()
+    archive(coupon)
+
+    response = client.post("/prize/redeem-coupon", json={"coupon_code": code},
+                           headers=headers)
+
+    assert response.json["status"] is True
+    assert "lucky draw" in response.json["message"]
+    assert CouponArchive.query.get(coupon_id).is_redeemed is True
+
+
+def test_winners_coupons_are_loaded_without_a_query_each(client, make_user,
+                                                         make_campaign):
+    owner_id = make_user(is_admin=True)[0].id
+
+    def draw_three() -> dict:
+        """A live, an archived and a legacy winner, returns their coupon ids"""
+        owner, coupon_ids = User.query.get(owner_id), {}
+        # archived first, sqlite reuses the id of the last coupon if deleted
+        for kind in ("archived", "live", "legacy"):
+            user, _ = make_user()
+            campaign, _, image, stock = make_campaign(owner)
+            coupon = make_coupon(user, campaign, image, stock)
+            coupon_ids[campaign.id] = coupon.id
+            win(campaign, user, None if kind == "legacy" else coupon)
+            if kind == "archived":
+                archived = coupon
+        archive(archived)
+        return coupon_ids
+
+    def winners() -> tuple:
+        # the requests share the test's app context, its counter and session
+        g.pop("_query_stats", None)
+        db.session.remove()
+        response = client.get("/prize/winners?include_archived=1")
+        coupons = {winner["campaign"]["id"]: winner["coupon"]
+                   for winner in response.json["data"]["winners"]}
+        # draws serialize their campaign and winner a query each, count the
+        # coupon queries only
+        coupon_queries = sum(
+            count for statement, count in g._query_stats["fingerprints"].items()
+            if re.search(r"\bFROM coupon(_archive)?\b", statement))
+        return coupons, coupon_queries
+
+    coupon_ids = draw_three()
+    coupons, few_queries = winners()
+    assert {campaign_id: coupon["id"] for campaign_id, coupon in coupons.items()} == coupon_ids
+
+    coupon_ids.update(draw_three())
+    coupons, more_queries = winners()
+    assert {campaign_id: coupon["id"] for campaign_id, coupon in coupons.items()} == coupon_ids
+    assert sum(bool(coupon.get("archived")) for coupon in coupons.values()) == 2
+    assert more_queries == few_queries
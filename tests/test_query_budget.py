@@ -0,0 +1,61 @@
+import logging
+
+from flask import jsonify
+
+from project.api.query_budget import fingerprint
+from project.models import User
+
+
+def test_fingerprint_ignores_literals_and_in_list_length():
+    assert fingerprint("SELECT * FROM user WHERE id = 5 AND email = 'a@b.c'") == \
+        fingerprint("SELECT * FROM user WHERE id = 7 AND email = 'x@y.z'")
+    assert fingerprint("SELECT * FROM sku WHERE id IN (?, ?)") == \
+        fingerprint("SELECT * FROM sku WHERE id IN (?, ?, ?, ?)")
+
+
+def test_query_count_header(app, client, make_user):
+    app.config["QUERY_COUNT_HEADER"] = True
+    user, headers = make_user()
+
+    response = client.get("/users/get", headers=headers)
+
+    assert response.status_code == 200
+    assert int(response.headers["X-Query-Count"]) > 0
+
+
+def test_budget_overrun_raises_under_testing(app, client, make_user):
+    user, headers = make_user()
+    app.config["QUERY_BUDGETS"] = dict(app.config["QUERY_BUDGETS"], **{"user.get_user_by_auth_token": 1})
+
+    response = client.get("/users/get", headers=headers)
+
+    assert response.status_code == 500
+    assert "Query budget of 1 exceeded by user.get_user_by_auth_token" in response.json["error"]
+
+
+def test_budget_overrun_is_logged_outside_testing(app, client, make_user, caplog):
+    user, headers = make_user()
+    app.config["TESTING"] = False
+    app.config["QUERY_BUDGETS"] = dict(app.config["QUERY_BUDGETS"], **{"user.get_user_by_auth_token": 1})
+
+    with caplog.at_level(logging.WARNING, logger="project.api.query_budget"):
+        response = client.get("/users/get", headers=headers)
+
+    assert response.status_code == 200
+    assert "Query budget of 1 exceeded by user.get_user_by_auth_token" in caplog.text
+
+
+def test_repeated_statements_are_reported_as_n_plus_one(app, client, make_user, caplog):
+    user_ids = [make_user()[0].id for _ in range(3)]
+    app.config["N_PLUS_ONE_THRESHOLD"] = 3
+
+    def one_by_one():
+        return jsonify([User.query.get(user_id).email for user_id in user_ids])
+
+    app.add_url_rule("/test/one_by_one", "one_by_one", one_by_one)
+
+    with caplog.at_level(logging.WARNING, logger="project.api.query_budget"):
+        response = client.get("/test/one_by_one")
+
+    assert response.status_code == 200
+    assert "Possible N+1 in one_by_one: 3 calls of SELECT" in caplog.text
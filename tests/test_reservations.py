@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.orm.attributes import set_committed_value
+
+from project import db
+from project.api.order import create_order_from_cart
+from project.api.cart_store import cart_store
+from project.api.reservations import release_expired_reservations
+from project.api.shopping import persist_cart
+from project.exceptions import APIError
+from project.models import CartItem, InventoryEntry, Order, ShoppingCart, Sku_Stock
+
+from tests.conftest import cart_item
+
+
+def test_reaped_carts_can_be_checked_out_again(client, make_user, make_campaign):
+    owner, _ = make_user(is_admin=True)
+    campaign, _, image, stock = make_campaign(owner, quantity=5)
+    user, headers = make_user()
+
+    # checked out, but creating the order failed
+    shopping_cart = persist_cart(user.id, [cart_item(campaign, image, stock, quantity=2)])
+    shopping_cart.checkedout_at = datetime.utcnow()
+    CartItem.query.filter_by(cart_id=shopping_cart.id).update(
+        {"reservation_date": datetime.utcnow() - timedelta(hours=1)})
+    db.session.commit()
+
+    assert release_expired_reservations() == 1
+
+    assert ShoppingCart.query.get(shopping_cart.id).is_active is False
+    assert Sku_Stock.query.get(stock.id).stock_level == 5
+
+    response = client.post("/order/create", json={"cart_id": shopping_cart.id},
+                           headers=headers)
+    assert response.json["status"] is False
+    assert Order.query.count() == 0
+
+    cart_store().add_item(user.id, campaign.id, stock.id, image.id, 1)
+    response = client.post("/shopping/checkout", json={}, headers=headers)
+
+    assert response.json["status"] is True
+    assert response.json["order"]["status"] is True
+    assert Sku_Stock.query.get(stock.id).stock_level == 4
+
+
+def test_cart_reaped_before_its_order_is_not_sold(make_user, make_campaign):
+    owner, _ = make_user(is_admin=True)
+    campaign, _, image, stock = make_campaign(owner, quantity=5)
+    user, _ = make_user()
+
+    shopping_cart = persist_cart(user.id, [cart_item(campaign, image, stock, quantity=2)])
+    shopping_cart.checkedout_at = datetime.utcnow()
+    CartItem.query.filter_by(cart_id=shopping_cart.id).update(
+        {"reservation_date": datetime.utcnow() - timedelta(hours=1)})
+    db.session.commit()
+
+    assert release_expired_reservations() == 1
+
+    # the order request loaded the cart before the reaper ran
+    loaded = ShoppingCart.query.get(shopping_cart.id)
+    set_committed_value(loaded, "is_active", True)
+
+    with pytest.raises(APIError, match="no longer active"):
+        create_order_from_cart(user.id, loaded, 0.0)
+    db.session.rollback()
+
+    assert Order.query.count() == 0
+    assert InventoryEntry.query.filter_by(kind="sale").count() == 0
+    assert Sku_Stock.query.get(stock.id).stock_level == 5
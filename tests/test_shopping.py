@@ -0,0 +1,81 @@
+from flask import g
+
+from project.api.cart_store import cart_store
+from project.models import InventoryEntry, ShoppingCart
+
+from tests.conftest import cart_item
+
+
+def test_batch_add_holds_no_stock_until_checkout(client, make_user, make_campaign):
+    owner, _ = make_user(is_admin=True)
+    campaign, _, image, stock = make_campaign(owner, quantity=5)
+    other_campaign, _, other_image, other_stock = make_campaign(owner, quantity=1)
+    user, headers = make_user()
+
+    response = client.post("/shopping/add_to_cart/batch", json={"items": [
+        cart_item(campaign, image, stock, quantity=2),
+        cart_item(other_campaign, other_image, other_stock, quantity=2)]},
+        headers=headers)
+
+    assert response.json["status"] is False
+    assert [result["message"] for result in response.json["results"]] == [
+        "Item not added, another item failed", "Not enough stock"]
+    assert cart_store().count(user.id) == 0
+
+    response = client.post("/shopping/add_to_cart/batch", json={"items": [
+        cart_item(campaign, image, stock, quantity=2),
+        cart_item(other_campaign, other_image, other_stock, quantity=1)]},
+        headers=headers)
+
+    assert response.json["status"] is True
+    assert cart_store().count(user.id) == 2
+    assert InventoryEntry.query.count() == 0
+    assert ShoppingCart.query.count() == 0
+
+    response = client.post("/shopping/checkout", json={}, headers=headers)
+
+    assert response.json["status"] is True
+    assert {(entry.sku_stock_id, entry.quantity) for entry in InventoryEntry.query.filter_by(
+        kind="reserve")} == {(stock.id, -2), (other_stock.id, -1)}
+
+
+def test_cart_summary_reads_the_prices_with_one_query(app, client, make_user, make_campaign):
+    app.config["QUERY_COUNT_HEADER"] = True
+    owner, _ = make_user(is_admin=True)
+    user, headers = make_user()
+
+    response = client.get("/shopping/cart_summary", headers=headers)
+    assert response.json["data"] == {"cart_length": 0, "total_quantity": 0, "total_amount": 0}
+    empty_queries = int(response.headers["X-Query-Count"])
+    # the requests share the test's app context and its counter
+    g.pop("_query_stats")
+
+    for price, quantity in ((5.0, 2), (2.5, 1), (1.1, 3)):
+        campaign, _, image, stock = make_campaign(owner, price=price)
+        cart_store().add_item(user.id, campaign.id, stock.id, image.id, quantity)
+
+    response = client.get("/shopping/cart_summary", headers=headers)
+
+    assert response.json["data"] == {"cart_length": 3, "total_quantity": 6, "total_amount": 15.8}
+    assert int(response.headers["X-Query-Count"]) == empty_queries + 1
+
+
+def test_quantities_below_one_are_rejected(client, make_user, make_campaign):
+    owner, _ = make_user(is_admin=True)
+    campaign, _, image, stock = make_campaign(owner, quantity=5)
+    user, headers = make_user()
+
+    for quantity in (0, -2):
+        response = client.post("/shopping/add_to_cart", json=cart_item(
+            campaign, image, stock, quantity=quantity), headers=headers)
+        assert response.json["status"] is False
+        assert response.json["message"] == "Quantity should be positive"
+    assert cart_store().count(user.id) == 0
+
+    cart_store().add_item(user.id, campaign.id, stock.id, image.id, 2)
+    for quantity in (0, -2):
+        response = client.put("/shopping/update_cart/{}".format(stock.id),
+                              json={"quantity": quantity}, headers=headers)
+        assert response.json["status"] is False
+        assert response.json["message"] == "Quantity should be positive"
+    assert cart_store().get_item(user.id, stock.id)["quantity"] == 2
@@ -0,0 +1,83 @@
+import os
+import json
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from project import db
+from project.api.sql_stats import dump_path, load_snapshot, statement_stats
+
+
+@pytest.fixture
+def stats(app):
+    statement_stats.enabled = True
+    statement_stats.reset()
+    yield statement_stats
+    statement_stats.enabled = False
+    statement_stats.path = None
+    statement_stats.reset()
+
+
+def test_disabled_by_default(app):
+    assert app.config["SQL_STATS_ENABLED"] is False
+    assert statement_stats.enabled is False
+
+
+def test_records_statements_by_fingerprint(stats):
+    db.session.execute("SELECT 1")
+    db.session.execute("SELECT 2")
+
+    statements = stats.snapshot()["statements"]
+    assert [item["calls"] for item in statements if item["statement"] == "SELECT ?"] == [2]
+
+
+def test_failed_statement_does_not_skew_the_next_one(stats):
+    with pytest.raises(OperationalError):
+        db.session.execute("SELECT * FROM missing_table")
+    db.session.rollback()
+
+    db.session.execute("SELECT 1")
+
+    statements = {item["statement"]: item for item in stats.snapshot()["statements"]}
+    assert statements["SELECT ?"]["calls"] == 1
+    assert "SELECT * FROM missing_table" not in statements
+
+
+def test_dump_writes_the_snapshot_of_the_process(stats, tmp_path):
+    stats.path = str(tmp_path / "sql_stats.json")
+    db.session.execute("SELECT 1")
+
+    stats.dump()
+
+    with open(str(tmp_path / "sql_stats.{}.json".format(os.getpid()))) as f:
+        snapshot = json.load(f)
+    assert snapshot["statements"][0]["statement"] == "SELECT ?"
+    assert "rows" not in snapshot["statements"][0]
+
+
+def test_the_snapshots_of_all_processes_are_merged(stats, tmp_path):
+    stats.path = str(tmp_path / "sql_stats.json")
+    db.session.execute("SELECT 1")
+    stats.dump()
+
+    # another process ran the same statement three times
+    with open(dump_path(stats.path, os.getpid())) as f:
+        other = json.load(f)
+    for item in other["statements"] + other["endpoints"]:
+        item.update(calls=3, total_ms=30.0, max_ms=20.0, samples=[5.0, 5.0, 20.0])
+    other["statements"][0]["endpoints"] = {"<no request>": 3}
+    with open(dump_path(stats.path, os.getpid() + 1), "w") as f:
+        json.dump(other, f)
+
+    snapshot = load_snapshot(stats.path)
+
+    statement = snapshot["statements"][0]
+    assert statement["statement"] == "SELECT ?"
+    assert statement["calls"] == 4
+    assert statement["max_ms"] == 20.0
+    assert statement["endpoints"] == {"<no request>": 4}
+    assert snapshot["endpoints"][0]["calls"] == 4
+
+
+def test_nothing_to_load_without_dumps(tmp_path):
+    assert load_snapshot(str(tmp_path / "sql_stats.json")) is None
@@ -0,0 +1,149 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from project import db
+from project.api import utils
+from project.api.tickets import build_ticket_index, build_ticket_indexes, unindexed_campaigns
+from project.api.utils import draw_winner, lucky_draw
+from project.models import Coupon, Draw, TicketIndex
+
+
+def close(campaign):
+    campaign.is_active = False
+    campaign.end_date = datetime.utcnow()
+    db.session.commit()
+
+
+def test_campaign_without_coupons_gets_an_empty_index(make_user, make_campaign):
+    owner, _ = make_user(is_admin=True)
+    campaign, _, _, _ = make_campaign(owner)
+    close(campaign)
+
+    assert unindexed_campaigns() == [campaign.id]
+    assert build_ticket_indexes() == 1
+    assert unindexed_campaigns() == []
+    assert TicketIndex.query.get(campaign.id).tickets == 0
+
+    draw = Draw.query.filter_by(campaign_id=campaign.id).one()
+    assert draw_winner(draw.id) is None
+
+
+def test_deleting_an_order_drops_the_index(client, make_user, make_campaign, make_order):
+    owner, admin_headers = make_user(is_admin=True)
+    campaign, _, image, stock = make_campaign(owner)
+    first, _ = make_user()
+    second, _ = make_user()
+    deleted = make_order(first, campaign, image, stock)
+    make_order(second, campaign, image, stock)
+    close(campaign)
+    build_ticket_index(campaign.id)
+
+    response = client.delete("/order/delete/{}".format(deleted.id), headers=admin_headers)
+
+    assert response.json["status"] is True
+    assert TicketIndex.query.get(campaign.id) is None
+    assert build_ticket_index(campaign.id).tickets == 1
+
+
+@pytest.mark.filterwarnings("error::sqlalchemy.exc.SAWarning")
+def test_draw_rebuilds_a_stale_index(make_user, make_campaign, make_order):
+    owner, _ = make_user(is_admin=True)
+    campaign, _, image, stock = make_campaign(owner)
+    user, _ = make_user()
+    make_order(user, campaign, image, stock)
+    make_order(user, campaign, image, stock)
+    close(campaign)
+    build_ticket_index(campaign.id)
+
+    # a coupon removed behind the index's back
+    coupons = Coupon.query.filter_by(campaign_id=campaign.id).order_by(Coupon.id).all()
+    db.session.execute(Coupon.__table__.update().where(
+        Coupon.id == coupons[1].id).values(campaign_id=campaign.id + 1000))
+    db.session.commit()
+
+    draw = Draw.query.filter_by(campaign_id=campaign.id).one()
+    for _ in range(5):
+        draw.winner_id = draw.winner_coupon_id = None
+        db.session.commit()
+        assert draw_winner(draw.id) == user.id
+        assert Draw.query.get(draw.id).winner_coupon_id == coupons[0].id
+
+
+def end_draw(campaign) -> Draw:
+    draw = Draw.query.filter_by(campaign_id=campaign.id).one()
+    draw.start_date = datetime.utcnow() - timedelta(days=7)
+    draw.end_date = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+    return draw
+
+
+@pytest.mark.file_database
+def test_lucky_draw_picks_every_ended_draw_in_the_pool(app, make_user, make_campaign,
+                                                       make_order):
+    app.config["LUCKY_DRAW_WORKERS"] = 2
+    owner, _ = make_user(is_admin=True)
+    draws = {}
+    for _ in range(3):
+        campaign, _, image, stock = make_campaign(owner)
+        user, _ = make_user()
+        make_order(user, campaign, image, stock)
+        close(campaign)
+        draws[end_draw(campaign).id] = user.id
+
+    assert lucky_draw() == draws
+
+    db.session.expire_all()
+    assert {draw.id: draw.winner_id for draw in Draw.query} == draws
+    assert lucky_draw() == {}
+
+
+@pytest.mark.file_database
+def test_concurrent_draws_of_a_campaign_pick_one_winner(app, make_user, make_campaign,
+                                                        make_order, monkeypatch, caplog):
+    owner, _ = make_user(is_admin=True)
+    campaign, _, image, stock = make_campaign(owner)
+    holders = set()
+    for _ in range(4):
+        user, _ = make_user()
+        make_order(user, campaign, image, stock)
+        holders.add(user.id)
+    close(campaign)
+    build_ticket_index(campaign.id)
+    draw_id = end_draw(campaign).id
+
+    # both runs pick a ticket before either records its winner
+    picked = threading.Barrier(2, timeout=5)
+    pick_ticket_holder = utils.pick_ticket_holder
+
+    def pick_together(index):
+        holder = pick_ticket_holder(index)
+        picked.wait()
+        return holder
+
+    monkeypatch.setattr(utils, "pick_ticket_holder", pick_together)
+
+    results = []
+
+    def run():
+        with app.app_context():
+            results.append(lucky_draw())
+
+    threads = [threading.Thread(target=run) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # the draw that recorded its winner second found it drawn, no error
+    winners = [result[draw_id] for result in results if result.get(draw_id)]
+    assert len(results) == 2
+    assert len(winners) == 1
+    assert "failed" not in caplog.text
+
+    db.session.expire_all()
+    draw = Draw.query.get(draw_id)
+    assert draw.winner_id == winners[0]
+    assert draw.winner_id in holders
+    assert Coupon.query.get(draw.winner_coupon_id).user_id == draw.winner_id
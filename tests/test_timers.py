@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+
+from project import db
+from project.api import timers
+from project.models import Draw, ScheduledTask, TicketIndex
+
+
+def due_draw(campaign) -> Draw:
+    campaign.is_active = False
+    campaign.end_date = datetime.utcnow() - timedelta(minutes=1)
+    draw = Draw.query.filter_by(campaign_id=campaign.id).one()
+    draw.end_date = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+
+    # the campaign_end timer is not under test
+    db.session.execute(ScheduledTask.__table__.delete().where(
+        ScheduledTask.kind != "draw_end"))
+    db.session.commit()
+    return draw
+
+
+def test_draw_timer_picks_the_winner(make_user, make_campaign, make_order):
+    owner, _ = make_user(is_admin=True)
+    campaign, _, image, stock = make_campaign(owner)
+    user, _ = make_user()
+    make_order(user, campaign, image, stock)
+    draw = due_draw(campaign)
+
+    assert timers.fire_due_timers() == 1
+
+    assert Draw.query.get(draw.id).winner_id == user.id
+    assert ScheduledTask.query.count() == 0
+
+
+def test_failed_handler_rolls_back_its_effects(app, make_user, make_campaign,
+                                               make_order, monkeypatch):
+    owner, _ = make_user(is_admin=True)
+    campaign, _, image, stock = make_campaign(owner)
+    user, _ = make_user()
+    make_order(user, campaign, image, stock)
+    draw = due_draw(campaign)
+
+    def fail(index):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr("project.api.utils.pick_ticket_holder", fail)
+
+    assert timers.fire_due_timers() == 0
+
+    # the index built by the handler went with the failed timer
+    assert TicketIndex.query.get(campaign.id) is None
+    assert Draw.query.get(draw.id).winner_id is None
+
+    task = ScheduledTask.query.one()
+    assert task.attempts == 1
+    assert task.last_error == "boom"
+
+
+def test_handlers_do_not_commit(make_user, make_campaign, make_order, monkeypatch):
+    owner, _ = make_user(is_admin=True)
+    campaign, _, image, stock = make_campaign(owner)
+    user, _ = make_user()
+    make_order(user, campaign, image, stock)
+    draw = due_draw(campaign)
+
+    commits = []
+    monkeypatch.setattr(db.session, "commit", lambda: commits.append(1))
+
+    timers.TIMER_HANDLERS["draw_end"](draw.id)
+    timers.TIMER_HANDLERS["campaign_end"](campaign.id)
+
+    assert commits == []
+    db.session.rollback()
+    assert TicketIndex.query.get(campaign.id) is None
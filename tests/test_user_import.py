@@ -0,0 +1,52 @@
+import io
+
+from project.api.user_import import UserImport, import_users
+from project.models import Location, User
+
+HEADER = "firstname,lastname,email,mobile_no,address,city,state,country,zipcode\n"
+
+
+def csv_file(*rows) -> io.StringIO:
+    return io.StringIO(HEADER + "".join(
+        "Test,User,{},{},1 Main Street,City,State,Country,12345\n".format(email, mobile)
+        for email, mobile in rows))
+
+
+def test_emails_are_normalized_once(make_user):
+    make_user(email="taken@mail.com")
+
+    result = import_users(csv_file(("Someone@MAIL.COM", "1"),
+                                   ("someone@mail.com", "2"),
+                                   ("taken@MAIL.com", "3")), "csv")
+
+    assert result["imported"] == 1
+    assert [error["message"] for error in result["errors"]] == [
+        "Email is repeated in the file", "Email already exists"]
+    assert User.query.filter_by(mobile_no="1").one().email == "Someone@mail.com"
+
+
+def test_registered_emails_are_matched_case_insensitively(make_user):
+    make_user(email="Taken@mail.com")
+
+    result = import_users(csv_file(("taken@mail.com", "1"), ("TAKEN@mail.com", "2")), "csv")
+
+    assert result["imported"] == 0
+    assert [error["message"] for error in result["errors"]] == [
+        "Email is repeated in the file", "Email already exists"]
+
+
+def test_users_registered_meanwhile_are_rejected(make_user, monkeypatch):
+    make_user(email="taken@mail.com")
+    # the users are registered after the batch was checked
+    monkeypatch.setattr(UserImport, "_existing", lambda self, batch: (set(), set()))
+
+    result = import_users(csv_file(("first@mail.com", "1"),
+                                   ("taken@mail.com", "2"),
+                                   ("last@mail.com", "3")), "csv")
+
+    assert result["imported"] == 2
+    assert result["errors"] == [
+        {"line": 3, "message": "Email or mobile number already exists"}]
+    assert {user.email for user in User.query.filter(User.mobile_no.in_(["1", "3"]))} == {
+        "first@mail.com", "last@mail.com"}
+    assert Location.query.count() == 3
@@ -0,0 +1,160 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from project import db
+from project.api import worker as worker_module
+from project.api import leases
+from project.api.leases import job_heartbeat
+from project.api.worker import JOBS, Job, Worker
+from project.models import JobLock
+
+
+class Stop(Exception):
+    pass
+
+
+def test_unknown_job_is_rejected(app):
+    with pytest.raises(ValueError, match="Unknown job"):
+        Worker(jobs=["no_such_job"])
+
+
+def test_job_without_interval_is_rejected(app):
+    app.config["WORKER_JOB_INTERVALS"] = dict(
+        app.config["WORKER_JOB_INTERVALS"], archive_data=None)
+
+    with pytest.raises(ValueError, match="archive_data"):
+        Worker(jobs=["archive_data"])
+
+
+def test_lease_is_taken_once_per_interval(app):
+    worker = Worker(jobs=["archive_data"], owner="a")
+    worker.register()
+
+    assert worker.acquire(JOBS["archive_data"])
+    assert not Worker(jobs=["archive_data"], owner="b").acquire(JOBS["archive_data"])
+
+
+def test_failed_job_is_recorded(app, monkeypatch):
+    def fail():
+        raise RuntimeError("boom")
+
+    monkeypatch.setitem(JOBS, "archive_data", Job("archive_data", fail))
+    worker = Worker(jobs=["archive_data"], owner="a")
+    worker.register()
+
+    assert worker.run_job(JOBS["archive_data"])
+    lock = JobLock.query.get("archive_data")
+    assert lock.last_error == "boom"
+    assert lock.runs == 1
+    assert lock.locked_until is None
+
+
+def test_failing_timers_do_not_stop_the_dispatcher(app, monkeypatch):
+    calls = []
+
+    def fail():
+        calls.append("timers")
+        raise RuntimeError("database went away")
+
+    def dispatch():
+        calls.append("outbox")
+        return 0
+
+    monkeypatch.setattr(worker_module, "fire_due_timers", fail)
+    monkeypatch.setattr(worker_module, "dispatch_outbox", dispatch)
+
+    assert Worker(owner="a").dispatch_once() == app.config["TIMER_RESOLUTION_SECONDS"]
+    assert calls == ["timers", "outbox"]
+
+
+def test_timers_fire_while_a_job_runs(app, monkeypatch):
+    fired = threading.Event()
+
+    def fire():
+        fired.set()
+        return 1
+
+    def long_job():
+        # timers run on the dispatcher thread, not after the job
+        assert fired.wait(5)
+
+    def sleep(seconds):
+        if threading.current_thread() is threading.main_thread():
+            raise Stop()
+        # the dispatcher is done, it must not use the database at teardown
+        threading.Event().wait()
+
+    monkeypatch.setattr(worker_module, "fire_due_timers", fire)
+    monkeypatch.setattr(worker_module, "dispatch_outbox", lambda: 0)
+    monkeypatch.setattr(worker_module, "next_timer_at", lambda: None)
+    monkeypatch.setattr(worker_module.time, "sleep", sleep)
+    monkeypatch.setitem(JOBS, "archive_data", Job("archive_data", long_job))
+
+    worker = Worker(owner="a")
+    worker.jobs = [JOBS["archive_data"]]
+    with pytest.raises(Stop):
+        worker.run_forever()
+
+    assert JobLock.query.get("archive_data").last_error is None
+
+
+def test_named_jobs_run_alone(app, monkeypatch):
+    calls = []
+    monkeypatch.setattr(worker_module, "fire_due_timers", lambda: calls.append("timers"))
+    monkeypatch.setattr(worker_module, "dispatch_outbox", lambda: calls.append("outbox"))
+    monkeypatch.setitem(JOBS, "archive_data", Job("archive_data", lambda: calls.append("job")))
+
+    assert Worker(jobs=["archive_data"], owner="a").run_once()["jobs"] == 1
+    assert calls == ["job"]
+
+
+def renewal_due():
+    """Make the running job's next heartbeat renew its lease"""
+    leases._state.lease.renewed_at -= 3600
+
+
+def test_long_jobs_renew_their_lease(app, monkeypatch):
+    seen = []
+
+    def batches():
+        JobLock.query.get("archive_data").locked_until = datetime.utcnow()
+        db.session.commit()
+
+        renewal_due()
+        job_heartbeat()
+        seen.append(JobLock.query.get("archive_data").locked_until)
+
+    monkeypatch.setitem(JOBS, "archive_data", Job("archive_data", batches))
+    worker = Worker(jobs=["archive_data"], owner="a")
+    worker.register()
+
+    assert worker.run_job(JOBS["archive_data"])
+    assert seen[0] > datetime.utcnow() + timedelta(seconds=worker.lease - 60)
+
+
+def test_job_stops_when_its_lease_is_taken_over(app, monkeypatch):
+    batches = []
+
+    def batch():
+        for _ in range(3):
+            batches.append(1)
+
+            # another node took the job over after the lease ran out
+            JobLock.query.get("archive_data").owner = "b"
+            db.session.commit()
+
+            renewal_due()
+            job_heartbeat()
+
+    monkeypatch.setitem(JOBS, "archive_data", Job("archive_data", batch))
+    worker = Worker(jobs=["archive_data"], owner="a")
+    worker.register()
+
+    assert worker.run_job(JOBS["archive_data"])
+    assert batches == [1]
+
+    lock = JobLock.query.get("archive_data")
+    assert lock.owner == "b"
+    assert lock.runs == 0